@@ -13,6 +13,7 @@ from .models import (
     Instruction,
     InstructionAgreement,
     Tests,
+    TestSnapshot,
     Question,
     Answer,
     TestResult,
@@ -30,6 +31,12 @@ from .models import (
     GameSwiper,
     GameSwiperResult,
     PowerOfUser,
+    KioskCheckIn,
+    ExperienceDailyRollup,
+    ExperienceEvent,
+    FaceEnrollment,
+    FaceMatchAttempt,
+    FaceTemplate,
 )
 
 
@@ -45,6 +52,9 @@ class UserAdmin(admin.ModelAdmin):
     )
     search_fields = ("email", "first_name", "last_name")
     list_filter = ("role",)
+    # Очки меняются только записями журнала ExperienceEvent, иначе
+    # rebuild_experience_points отменит правку
+    readonly_fields = ("experience_points",)
 
 
 @admin.register(Badge)
@@ -98,9 +108,48 @@ class QuestionInline(admin.TabularInline):
 
 @admin.register(Tests)
 class TestsAdmin(admin.ModelAdmin):
-    list_display = ("name", "description", "passing_score", "test_is_control")
+    list_display = (
+        "name",
+        "description",
+        "passing_score",
+        "test_is_control",
+        "published_snapshot",
+    )
     search_fields = ("name",)
     inlines = (QuestionInline,)
+    readonly_fields = ("published_snapshot",)
+    actions = ("publish",)
+
+    @admin.action(description="Опубликовать новую версию")
+    def publish(self, request, queryset):
+        # api.utils.utils импортирует админку, сериализаторы - только здесь
+        from .serializers import serialize_questions
+        from .utils.test_snapshots import publish_test
+
+        for test in queryset:
+            publish_test(test, serialize_questions(test))
+        self.message_user(request, f"Опубликовано тестов: {len(queryset)}")
+
+
+@admin.register(TestSnapshot)
+class TestSnapshotAdmin(admin.ModelAdmin):
+    list_display = (
+        "test",
+        "version",
+        "passing_score",
+        "test_is_control",
+        "published_at",
+    )
+    search_fields = ("test__name",)
+    list_filter = ("published_at",)
+
+    def has_add_permission(self, request):
+        # Версии создаются только действием публикации теста
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        # Опубликованная версия не меняется
+        return False
 
 
 class AnswerInline(admin.TabularInline):
@@ -138,6 +187,7 @@ class TestResultAdmin(admin.ModelAdmin):
         "is_passed",
         "mark",
         "score",
+        "snapshot",
         "completion_time",
     )
     search_fields = ("user__email", "test__name")
@@ -308,3 +358,73 @@ class PowerOfUserAdmin(admin.ModelAdmin):
     list_display = ("user", "power")
     search_fields = ("user__email", "user__last_name", "user__first_name")
     list_filter = ("power",)
+
+
+@admin.register(KioskCheckIn)
+class KioskCheckInAdmin(admin.ModelAdmin):
+    list_display = (
+        "employee",
+        "operator",
+        "distance",
+        "created_at",
+        "is_confirmed",
+    )
+    search_fields = (
+        "employee__email",
+        "employee__last_name",
+        "operator__email",
+    )
+    list_filter = ("is_confirmed", "created_at")
+
+
+@admin.register(FaceMatchAttempt)
+class FaceMatchAttemptAdmin(admin.ModelAdmin):
+    list_display = (
+        "source",
+        "user",
+        "is_match",
+        "best_distance",
+        "second_distance",
+        "candidates",
+        "decrypt_ms",
+        "compare_ms",
+        "created_at",
+    )
+    list_filter = ("source", "is_match", "created_at")
+    search_fields = ("user__email", "user__last_name")
+
+
+@admin.register(FaceTemplate)
+class FaceTemplateAdmin(admin.ModelAdmin):
+    list_display = ("user", "key_id", "created_at")
+    search_fields = ("user__email", "user__last_name")
+    exclude = ("descriptor_blob",)
+
+
+@admin.register(FaceEnrollment)
+class FaceEnrollmentAdmin(admin.ModelAdmin):
+    list_display = ("user", "template", "verification_distance", "created_at")
+    list_filter = ("created_at",)
+    search_fields = ("user__email", "user__last_name")
+
+
+@admin.register(ExperienceEvent)
+class ExperienceEventAdmin(admin.ModelAdmin):
+    list_display = ("user", "source", "source_id", "points", "created_at")
+    list_filter = ("source", "created_at")
+    search_fields = ("user__email", "user__last_name")
+
+    def has_change_permission(self, request, obj=None):
+        # Журнал только дополняется, исправления - новыми записями
+        return False
+
+    def save_model(self, request, obj, form, change):
+        """Начисление через award_experience обновляет очки и звание."""
+        obj.user.award_experience(obj.points, obj.source, obj.source_id)
+
+
+@admin.register(ExperienceDailyRollup)
+class ExperienceDailyRollupAdmin(admin.ModelAdmin):
+    list_display = ("user", "date", "points")
+    list_filter = ("date",)
+    search_fields = ("user__email", "user__last_name")
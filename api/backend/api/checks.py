@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.checks import Error, register
+
+# Кэши, не общие для процессов сервера
+PER_PROCESS_CACHES = (
+    "django.core.cache.backends.dummy.DummyCache",
+    "django.core.cache.backends.locmem.LocMemCache",
+)
+
+
+@register()
+def check_shared_cache(app_configs, **kwargs):
+    """
+    Ключи передачи дескрипторов, счётчик изменений индекса лиц и версии
+    закэшированных таблиц должны быть видны всем воркерам.
+    """
+    if settings.CACHES["default"]["BACKEND"] in PER_PROCESS_CACHES:
+        return [
+            Error(
+                "Кэш по умолчанию не общий для процессов сервера.",
+                hint="Укажите в CACHES Redis или Memcached (CACHE_URL).",
+                id="api.E001",
+            )
+        ]
+    return []
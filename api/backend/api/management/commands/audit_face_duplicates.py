@@ -0,0 +1,162 @@
+from concurrent.futures import ProcessPoolExecutor
+import csv
+import os
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+import numpy as np
+
+from api.models import User
+from api.utils.face_index import load_templates
+from api.utils.face_search import squared_distances
+
+# Матрица шаблонов и их владельцы в процессах пула, передаются через
+# initializer
+_worker_matrix = None
+_worker_owners = None
+
+
+def _init_worker(matrix, owners):
+    global _worker_matrix, _worker_owners
+    _worker_matrix = matrix
+    _worker_owners = owners
+
+
+def find_block_pairs(row_start, block_size, max_squared_distance):
+    """
+    Ищет близкие пары шаблонов разных пользователей между блоком строк
+    и всеми строками после него
+    :return: список (строка, строка, расстояние)
+    """
+    matrix = _worker_matrix
+    owners = _worker_owners
+    row_block = matrix[row_start : row_start + block_size]
+    pairs = []
+    for column_start in range(row_start, len(matrix), block_size):
+        distances = squared_distances(
+            row_block, matrix[column_start : column_start + block_size]
+        )
+        rows, columns = np.nonzero(distances < max_squared_distance)
+        found = np.sqrt(distances[rows, columns])
+        rows = rows + row_start
+        columns = columns + column_start
+        # Каждая пара учитывается один раз, без шаблонов одного
+        # пользователя
+        upper = (rows < columns) & (owners[rows] != owners[columns])
+        pairs.extend(
+            zip(
+                rows[upper].tolist(),
+                columns[upper].tolist(),
+                found[upper].tolist(),
+            )
+        )
+    return pairs
+
+
+class Command(BaseCommand):
+    help = (
+        "Ищет пары пользователей с почти совпадающими дескрипторами лиц "
+        "и выводит их в CSV. Сравниваются все шаблоны пользователей, "
+        "для пары выводится наименьшее расстояние."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--threshold",
+            type=float,
+            default=settings.FACE_MATCH_THRESHOLD,
+            help="Максимальное расстояние между дескрипторами пары",
+        )
+        parser.add_argument(
+            "--block-size",
+            type=int,
+            default=2048,
+            help="Размер блока матрицы расстояний",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count() or 1,
+            help="Количество процессов",
+        )
+        parser.add_argument(
+            "--output",
+            help="CSV-файл для результатов, по умолчанию stdout",
+        )
+
+    def user_pairs(self, pairs, user_ids):
+        """
+        Пары пользователей с наименьшим расстоянием между их шаблонами
+        :return: список (user_id, user_id, расстояние)
+        """
+        closest = {}
+        for row, column, distance in pairs:
+            pair = tuple(sorted((int(user_ids[row]), int(user_ids[column]))))
+            if pair not in closest or distance < closest[pair]:
+                closest[pair] = distance
+        return [
+            (first, second, distance)
+            for (first, second), distance in closest.items()
+        ]
+
+    def write_csv(self, file, pair_user_ids):
+        emails = dict(
+            User.objects.filter(
+                pk__in={
+                    user_id for pair in pair_user_ids for user_id in pair[:2]
+                }
+            ).values_list("pk", "email")
+        )
+
+        writer = csv.writer(file)
+        writer.writerow(
+            ["user_id_1", "email_1", "user_id_2", "email_2", "distance"]
+        )
+        for first, second, distance in pair_user_ids:
+            writer.writerow(
+                [
+                    first,
+                    emails.get(first, ""),
+                    second,
+                    emails.get(second, ""),
+                    f"{distance:.6f}",
+                ]
+            )
+
+    def handle(self, *args, **options):
+        block_size = options["block_size"]
+        template_set = load_templates()
+        matrix = np.ascontiguousarray(template_set.descriptors)
+        user_ids = template_set.user_ids
+        self.stderr.write(
+            f"Шаблонов для сверки: {len(user_ids)}, "
+            f"пользователей: {len(np.unique(user_ids))}"
+        )
+
+        pairs = []
+        with ProcessPoolExecutor(
+            max_workers=max(1, options["workers"]),
+            initializer=_init_worker,
+            initargs=(matrix, user_ids),
+        ) as pool:
+            futures = [
+                pool.submit(
+                    find_block_pairs,
+                    row_start,
+                    block_size,
+                    options["threshold"] ** 2,
+                )
+                for row_start in range(0, len(matrix), block_size)
+            ]
+            for future in futures:
+                pairs.extend(future.result())
+        pairs = self.user_pairs(pairs, user_ids)
+        pairs.sort(key=lambda pair: pair[2])
+
+        if options["output"]:
+            with open(options["output"], "w", newline="") as file:
+                self.write_csv(file, pairs)
+        else:
+            self.write_csv(sys.stdout, pairs)
+        self.stderr.write(f"Найдено пар: {len(pairs)}")
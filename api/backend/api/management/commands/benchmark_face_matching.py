@@ -0,0 +1,265 @@
+import json
+import platform
+import time
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import Client
+from django.test.utils import (
+    setup_test_environment,
+    teardown_test_environment,
+)
+from django.urls import reverse
+from django.utils import timezone
+import numpy as np
+
+from api.models import User
+from api.utils.crypto import (
+    current_storage_key,
+    encrypt_descriptor,
+    seal_descriptor,
+)
+from api.utils.face_index import FaceIndex, face_index
+from api.utils.face_search import (
+    BruteForceBackend,
+    IVFBackend,
+    QuantizedBackend,
+)
+from api.utils.utils import is_face_already_registered
+from backend.constants import MAX_LENGTH_FACE_DESCRIPTOR
+
+EMAIL_DOMAIN = "benchmark.invalid"
+# Шум, при котором запрос остаётся ближе FACE_MATCH_THRESHOLD к исходному
+# дескриптору (норма шума ~ 0.3 против порога 0.78)
+GENUINE_NOISE = 0.03
+
+
+def random_descriptors(rng, count):
+    """Случайные 128-мерные дескрипторы единичной нормы."""
+    descriptors = rng.standard_normal(
+        (count, MAX_LENGTH_FACE_DESCRIPTOR)
+    ).astype(np.float32)
+    descriptors /= np.linalg.norm(descriptors, axis=1, keepdims=True)
+    return descriptors
+
+
+def summarize(durations):
+    """Перцентили задержки в миллисекундах и пропускная способность."""
+    durations = np.asarray(durations, dtype=np.float64)
+    p50, p95, p99 = np.percentile(durations, [50, 95, 99]) * 1000
+    return {
+        "iterations": len(durations),
+        "p50_ms": round(float(p50), 4),
+        "p95_ms": round(float(p95), 4),
+        "p99_ms": round(float(p99), 4),
+        "mean_ms": round(float(durations.mean()) * 1000, 4),
+        "throughput_per_s": round(len(durations) / float(durations.sum()), 2),
+    }
+
+
+def measure(function, arguments):
+    durations = []
+    for argument in arguments:
+        started = time.perf_counter()
+        function(argument)
+        durations.append(time.perf_counter() - started)
+    return summarize(durations)
+
+
+class Command(BaseCommand):
+    help = (
+        "Замеряет задержку распознавания лиц на синтетических "
+        "пользователях. Данные создаются в транзакции и откатываются."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes",
+            type=int,
+            nargs="+",
+            default=[1000, 10000, 100000],
+            help="Количество синтетических пользователей",
+        )
+        parser.add_argument(
+            "--queries",
+            type=int,
+            default=200,
+            help="Количество запросов на каждый замер",
+        )
+        parser.add_argument(
+            "--core-only",
+            action="store_true",
+            help="Замерять только поиск по индексу, без HTTP-слоя",
+        )
+        parser.add_argument(
+            "--legacy-format",
+            action="store_true",
+            help="Хранить дескрипторы в устаревшем JSON-формате",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--output",
+            help="Файл для JSON-результатов, по умолчанию stdout",
+        )
+
+    def seed_users(self, descriptors, legacy_format):
+        key_id, key = current_storage_key()
+        password = make_password(None)
+        for start in range(0, len(descriptors), 5000):
+            users = []
+            for offset, descriptor in enumerate(
+                descriptors[start : start + 5000], start
+            ):
+                user = User(
+                    email=f"bench-{offset}@{EMAIL_DOMAIN}",
+                    first_name="Benchmark",
+                    last_name=str(offset),
+                    password=password,
+                    face_descriptor_key_id=key_id,
+                )
+                if legacy_format:
+                    user.face_descriptor = json.dumps(
+                        encrypt_descriptor(descriptor, key)
+                    )
+                else:
+                    user.face_descriptor_blob = seal_descriptor(
+                        descriptor, key
+                    )
+                users.append(user)
+            User.objects.bulk_create(users)
+
+    def benchmark_backends(self, genuine, impostors, expected_ids):
+        results = {}
+        reference = None
+        for name, backend in (
+            ("brute_force", BruteForceBackend()),
+            ("ivf", IVFBackend()),
+            ("float16", QuantizedBackend(dtype="float16")),
+            ("int8", QuantizedBackend(dtype="int8")),
+        ):
+            index = FaceIndex(backend=backend)
+            started = time.perf_counter()
+            index.build()
+            build_seconds = time.perf_counter() - started
+
+            matches = [index.search(query) for query in genuine]
+            found = [match.user_id if match else None for match in matches]
+            accuracy = float(np.mean(np.array(found) == expected_ids))
+            if reference is None:
+                reference, reference_accuracy = found, accuracy
+            results[name] = {
+                "build_seconds": round(build_seconds, 4),
+                "memory_per_user_bytes": round(
+                    index.memory_bytes / max(1, len(index)), 2
+                ),
+                "genuine": measure(index.search, genuine),
+                "impostor": measure(index.search, impostors),
+                "batch": measure(
+                    index.search_batch,
+                    np.array_split(genuine, max(1, len(genuine) // 16)),
+                ),
+                "accuracy": round(accuracy, 4),
+                "accuracy_delta": round(accuracy - reference_accuracy, 4),
+                "agreement_with_brute_force": round(
+                    float(np.mean(np.array(found) == np.array(reference))), 4
+                ),
+            }
+        return results
+
+    def benchmark_http(self, genuine):
+        client = Client()
+        url = reverse("face_login")
+        key_id, raw_key = "benchmark-face-login", bytes(32)
+        cache.set(key_id, raw_key, timeout=None)
+        payloads = [
+            json.dumps(
+                {
+                    "key_id": key_id,
+                    "face_descriptor": encrypt_descriptor(query, raw_key),
+                }
+            )
+            for query in genuine
+        ]
+
+        def login(payload):
+            response = client.post(
+                url, payload, content_type="application/json"
+            )
+            assert response.status_code == 200, response.content
+
+        try:
+            return measure(login, payloads)
+        finally:
+            cache.delete(key_id)
+
+    def run_size(self, size, options):
+        rng = np.random.default_rng(options["seed"])
+        descriptors = random_descriptors(rng, size)
+        query_count = options["queries"]
+        picked = rng.choice(size, min(size, query_count), replace=False)
+        genuine = descriptors[picked] + GENUINE_NOISE * rng.standard_normal(
+            (len(picked), MAX_LENGTH_FACE_DESCRIPTOR)
+        ).astype(np.float32)
+        impostors = random_descriptors(rng, query_count)
+
+        result = {"size": size}
+        with transaction.atomic():
+            started = time.perf_counter()
+            self.seed_users(descriptors, options["legacy_format"])
+            result["seed_seconds"] = round(time.perf_counter() - started, 4)
+
+            emails = dict(
+                User.objects.filter(
+                    email__endswith=f"@{EMAIL_DOMAIN}"
+                ).values_list("email", "pk")
+            )
+            expected_ids = np.array(
+                [emails[f"bench-{row}@{EMAIL_DOMAIN}"] for row in picked]
+            )
+
+            result["backends"] = self.benchmark_backends(
+                genuine, impostors, expected_ids
+            )
+
+            face_index.build()
+            result["is_face_already_registered"] = measure(
+                is_face_already_registered, impostors
+            )
+            if not options["core_only"]:
+                result["face_login_http"] = self.benchmark_http(genuine)
+
+            transaction.set_rollback(True)
+        face_index.build()
+        return result
+
+    def handle(self, *args, **options):
+        report = {
+            "created_at": timezone.now().isoformat(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "face_match_threshold": settings.FACE_MATCH_THRESHOLD,
+            "queries": options["queries"],
+            "core_only": options["core_only"],
+            "legacy_format": options["legacy_format"],
+            "results": [],
+        }
+        if not options["core_only"]:
+            # Тестовый клиент обращается к хосту testserver
+            setup_test_environment()
+        try:
+            for size in options["sizes"]:
+                self.stderr.write(f"Замер на {size} пользователях...")
+                report["results"].append(self.run_size(size, options))
+        finally:
+            if not options["core_only"]:
+                teardown_test_environment()
+
+        output = json.dumps(report, ensure_ascii=False, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as file:
+                file.write(output)
+        else:
+            self.stdout.write(output)
@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from api.utils.face_index import save_snapshot
+
+
+class Command(BaseCommand):
+    help = "Пересобирает общий для воркеров снапшот индекса лиц в tmpfs."
+
+    def handle(self, *args, **options):
+        if not settings.FACE_INDEX_SNAPSHOT_DIR:
+            raise CommandError("Не задан FACE_INDEX_SNAPSHOT_DIR")
+
+        try:
+            version = save_snapshot()
+        except ImproperlyConfigured as e:
+            raise CommandError(str(e))
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Снапшот индекса лиц записан, версия {version}"
+            )
+        )
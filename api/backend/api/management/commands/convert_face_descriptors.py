@@ -0,0 +1,82 @@
+from django.core.management.base import BaseCommand
+
+from api.models import User
+from api.utils.crypto import (
+    current_storage_key,
+    decrypt_stored_descriptor,
+    seal_descriptor,
+)
+from api.utils.face_index import replace_stored_descriptors
+
+
+class Command(BaseCommand):
+    help = (
+        "Переводит дескрипторы лиц из устаревшего JSON-формата "
+        "в двоичный формат хранения. "
+        "Дескрипторы, изменённые во время преобразования, пропускаются."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=1000,
+            help="Количество пользователей, обрабатываемых за одну транзакцию",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Проверить дешифрование без записи в базу",
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options["chunk_size"]
+        dry_run = options["dry_run"]
+        key_id, key = current_storage_key()
+        queryset = User.objects.filter(
+            face_descriptor__isnull=False, face_descriptor_blob__isnull=True
+        ).only("id", "face_descriptor", "face_descriptor_key_id")
+
+        converted = failed = skipped = 0
+        last_pk = 0
+        while True:
+            chunk = list(
+                queryset.filter(pk__gt=last_pk).order_by("pk")[:chunk_size]
+            )
+            if not chunk:
+                break
+            last_pk = chunk[-1].pk
+
+            sealed = []
+            for user in chunk:
+                try:
+                    descriptor = decrypt_stored_descriptor(
+                        user.face_descriptor, user.face_descriptor_key_id
+                    )
+                except ValueError as e:
+                    failed += 1
+                    self.stderr.write(f"Пользователь {user.pk}: {e}")
+                    continue
+                sealed.append(
+                    (
+                        user.pk,
+                        user.face_descriptor,
+                        user.face_descriptor_key_id,
+                        seal_descriptor(descriptor, key),
+                    )
+                )
+
+            changed = 0
+            if sealed and not dry_run:
+                changed = replace_stored_descriptors(sealed, key_id)
+            converted += len(sealed) - changed
+            skipped += changed
+            self.stdout.write(f"Обработано до id={last_pk}: {converted}")
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{'Проверено' if dry_run else 'Преобразовано'}: "
+                f"{converted}, ошибок: {failed}, "
+                f"изменены во время работы: {skipped}"
+            )
+        )
@@ -0,0 +1,191 @@
+import csv
+from datetime import timedelta
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+import numpy as np
+
+from api.models import FaceMatchAttempt
+from api.utils.face_index import load_templates
+from api.utils.face_search import squared_distances
+
+
+def impostor_histogram(matrix, owners, edges, block_size):
+    """
+    Гистограмма расстояний между шаблонами разных пользователей
+    по блокам матрицы расстояний, без хранения всех пар
+    :param owners: id пользователя для каждой строки matrix
+    """
+    counts = np.zeros(len(edges) - 1, dtype=np.int64)
+    for row_start in range(0, len(matrix), block_size):
+        row_block = matrix[row_start : row_start + block_size]
+        row_owners = owners[row_start : row_start + block_size]
+        for column_start in range(row_start, len(matrix), block_size):
+            column_stop = column_start + block_size
+            distances = np.sqrt(
+                squared_distances(row_block, matrix[column_start:column_stop])
+            )
+            impostor = row_owners[:, None] != owners[column_start:column_stop]
+            if column_start == row_start:
+                # В диагональном блоке только пары выше диагонали
+                impostor &= np.triu(np.ones_like(impostor), k=1)
+            counts += np.histogram(distances[impostor], bins=edges)[0]
+    return counts
+
+
+def genuine_histogram(matrix, owners, edges):
+    """
+    Гистограмма расстояний между шаблонами одного пользователя
+    :param owners: id пользователя для каждой строки matrix
+    """
+    counts = np.zeros(len(edges) - 1, dtype=np.int64)
+    order = np.argsort(owners, kind="stable")
+    _, starts, sizes = np.unique(
+        owners[order], return_index=True, return_counts=True
+    )
+    for start, size in zip(starts, sizes):
+        if size < 2:
+            continue
+        rows = matrix[order[start : start + size]]
+        distances = np.sqrt(squared_distances(rows, rows))
+        counts += np.histogram(
+            distances[np.triu_indices(size, k=1)], bins=edges
+        )[0]
+    return counts
+
+
+def error_rates(counts):
+    """
+    Доля расстояний меньше каждой из границ гистограммы
+    :return: numpy array длиной len(counts) + 1
+    """
+    total = counts.sum()
+    below = np.concatenate(([0], np.cumsum(counts)))
+    return below / total if total else np.full(len(below), np.nan)
+
+
+class Command(BaseCommand):
+    help = (
+        "Строит кривые FAR/FRR для порога FACE_MATCH_THRESHOLD. Чужие пары - "
+        "шаблоны разных пользователей, свои - шаблоны одного пользователя. "
+        "С --telemetry к своим парам добавляются все попытки подтверждения "
+        "личности, включая отклонённые. Входы и отметки на киоске не "
+        "учитываются: у отклонённых попыток пользователь неизвестен."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--step",
+            type=float,
+            default=0.01,
+            help="Шаг сетки порогов",
+        )
+        parser.add_argument(
+            "--max-distance",
+            type=float,
+            default=2.0,
+            help="Наибольший порог сетки",
+        )
+        parser.add_argument(
+            "--telemetry",
+            action="store_true",
+            help=(
+                "Добавить к своим парам попытки из телеметрии. Среди "
+                "отклонённых попыток могут быть чужие лица"
+            ),
+        )
+        parser.add_argument(
+            "--days",
+            type=int,
+            help="Учитывать телеметрию только за последние дни",
+        )
+        parser.add_argument(
+            "--block-size",
+            type=int,
+            default=2048,
+            help="Размер блока матрицы расстояний",
+        )
+        parser.add_argument(
+            "--output",
+            help="CSV-файл для кривых, по умолчанию stdout",
+        )
+
+    def telemetry_distances(self, days):
+        """Расстояния принятых и отклонённых попыток подтверждения личности"""
+        attempts = FaceMatchAttempt.objects.filter(
+            source=FaceMatchAttempt.Source.VERIFICATION,
+            best_distance__isnull=False,
+        )
+        if days:
+            attempts = attempts.filter(
+                created_at__gte=timezone.now() - timedelta(days=days)
+            )
+        return np.fromiter(
+            attempts.values_list("best_distance", flat=True).iterator(),
+            dtype=np.float64,
+        )
+
+    def write_csv(self, file, thresholds, far, frr):
+        writer = csv.writer(file)
+        writer.writerow(["threshold", "far", "frr"])
+        for threshold, false_accept, false_reject in zip(thresholds, far, frr):
+            writer.writerow(
+                [
+                    f"{threshold:.4f}",
+                    f"{false_accept:.6f}",
+                    f"{false_reject:.6f}",
+                ]
+            )
+
+    def handle(self, *args, **options):
+        thresholds = np.arange(
+            0.0, options["max_distance"] + options["step"] / 2, options["step"]
+        )
+        # Последний интервал собирает все расстояния больше сетки
+        edges = np.append(thresholds, np.inf)
+
+        template_set = load_templates()
+        matrix = np.ascontiguousarray(template_set.descriptors)
+        impostor_counts = impostor_histogram(
+            matrix, template_set.user_ids, edges, options["block_size"]
+        )
+        genuine_counts = genuine_histogram(
+            matrix, template_set.user_ids, edges
+        )
+        genuine_pairs = int(genuine_counts.sum())
+        attempts = 0
+        if options["telemetry"]:
+            telemetry = self.telemetry_distances(options["days"])
+            attempts = len(telemetry)
+            genuine_counts += np.histogram(telemetry, bins=edges)[0]
+
+        # Совпадение засчитывается при расстоянии строго меньше порога
+        far = error_rates(impostor_counts)[: len(thresholds)]
+        frr = 1.0 - error_rates(genuine_counts)[: len(thresholds)]
+
+        if options["output"]:
+            with open(options["output"], "w", newline="") as file:
+                self.write_csv(file, thresholds, far, frr)
+        else:
+            self.write_csv(sys.stdout, thresholds, far, frr)
+
+        self.stderr.write(
+            f"Чужих пар: {impostor_counts.sum()}, "
+            f"своих пар: {genuine_pairs}, попыток из телеметрии: {attempts}"
+        )
+        current = int(
+            np.searchsorted(thresholds, settings.FACE_MATCH_THRESHOLD)
+        )
+        if current < len(thresholds):
+            self.stderr.write(
+                f"При пороге {thresholds[current]:.4f}: "
+                f"FAR={far[current]:.6f}, FRR={frr[current]:.6f}"
+            )
+        if genuine_counts.sum() and impostor_counts.sum():
+            equal = int(np.nanargmin(np.abs(far - frr)))
+            self.stderr.write(
+                f"EER ~ {(far[equal] + frr[equal]) / 2:.6f} "
+                f"при пороге {thresholds[equal]:.4f}"
+            )
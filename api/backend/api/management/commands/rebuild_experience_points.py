@@ -0,0 +1,126 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Sum
+
+from api.models import Badge, ExperienceEvent, Rank, User, UserBadge
+
+
+class Command(BaseCommand):
+    help = (
+        "Пересчитывает User.experience_points по журналу начислений "
+        "ExperienceEvent и обновляет звания и значки изменившихся "
+        "пользователей. "
+        "Исправления отмечаются в журнале записями без очков, "
+        "чтобы таблицы лидеров их перечитали."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=1000,
+            help="Количество пользователей, обрабатываемых за одну транзакцию",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Показать расхождения без записи в базу",
+        )
+
+    def update_ranks_and_badges(self, users):
+        """
+        Звания и значки пользователей по кэшированным таблицам порогов:
+        одно обновление званий и одна вставка значков на пачку
+        """
+        ranked, badges = [], []
+        for user in users:
+            reached = Rank.threshold_table(user.position_id).reached(
+                user.experience_points
+            )
+            rank_id = reached[-1] if reached else None
+            if rank_id != user.current_rank_id:
+                user.current_rank_id = rank_id
+                ranked.append(user)
+            badges.extend(
+                UserBadge(user_id=user.pk, badge_id=badge_id)
+                for badge_id in Badge.threshold_table(
+                    user.position_id
+                ).reached(user.experience_points)
+            )
+        User.objects.bulk_update(ranked, ["current_rank"])
+        UserBadge.objects.bulk_create(badges, ignore_conflicts=True)
+
+    def correct_chunk(self, chunk):
+        """
+        Сравнивает очки пользователей с суммой по журналу
+        :return: пользователи с исправленными experience_points
+        """
+        totals = dict(
+            ExperienceEvent.objects.filter(
+                user_id__in=[user.pk for user in chunk]
+            )
+            .values("user_id")
+            .annotate(total=Sum("points"))
+            .values_list("user_id", "total")
+        )
+        updated = []
+        for user in chunk:
+            total = totals.get(user.pk, 0)
+            if user.experience_points != total:
+                self.stdout.write(
+                    f"Пользователь {user.pk}: "
+                    f"{user.experience_points} -> {total}"
+                )
+                user.experience_points = total
+                updated.append(user)
+        return updated
+
+    def handle(self, *args, **options):
+        chunk_size = options["chunk_size"]
+        dry_run = options["dry_run"]
+        queryset = User.objects.only(
+            "id", "experience_points", "position_id", "current_rank_id"
+        )
+
+        checked = changed = 0
+        last_pk = 0
+        while True:
+            ids = list(
+                queryset.filter(pk__gt=last_pk)
+                .order_by("pk")
+                .values_list("pk", flat=True)[:chunk_size]
+            )
+            if not ids:
+                break
+            last_pk = ids[-1]
+
+            with transaction.atomic():
+                # Строки блокируются до чтения журнала: начисление,
+                # закоммиченное раньше, попадёт в сумму, а ожидающее
+                # блокировки прибавит очки к исправленному значению.
+                chunk = queryset.filter(pk__in=ids).order_by("pk")
+                if not dry_run:
+                    chunk = chunk.select_for_update()
+                chunk = list(chunk)
+                updated = self.correct_chunk(chunk)
+                if updated and not dry_run:
+                    User.objects.bulk_update(updated, ["experience_points"])
+                    self.update_ranks_and_badges(updated)
+                    # Запись без очков - изменение для таблиц лидеров
+                    ExperienceEvent.objects.bulk_create(
+                        ExperienceEvent(
+                            user_id=user.pk,
+                            source=ExperienceEvent.Source.REBUILD,
+                            points=0,
+                        )
+                        for user in updated
+                    )
+            checked += len(chunk)
+            changed += len(updated)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Проверено: {checked}, "
+                f"{'расхождений' if dry_run else 'исправлено'}: {changed}"
+            )
+        )
@@ -0,0 +1,44 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Min
+from django.utils import timezone
+
+from api.models import ExperienceEvent
+from api.utils.leaderboard import refresh_daily_rollups
+
+
+class Command(BaseCommand):
+    help = (
+        "Пересчитывает дневные свёртки очков опыта по журналу начислений. "
+        "Нужен для заполнения истории, дальше свёртки обновляет задача "
+        "rollup_experience_points."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=31,
+            help="Сколько последних дней пересчитать",
+        )
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Пересчитать всю историю начислений",
+        )
+
+    def handle(self, *args, **options):
+        today = timezone.localdate()
+        start = today - timedelta(days=max(0, options["days"] - 1))
+        if options["all"]:
+            first = ExperienceEvent.objects.aggregate(first=Min("created_at"))[
+                "first"
+            ]
+            if first is not None:
+                start = min(start, timezone.localtime(first).date())
+
+        count = refresh_daily_rollups(start, today)
+        self.stdout.write(
+            self.style.SUCCESS(f"Свёрток за {start} - {today}: {count}")
+        )
@@ -0,0 +1,224 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Q
+
+from api.models import FaceTemplate, User
+from api.utils.face_index import (
+    record_face_index_changes,
+    replace_stored_descriptors,
+)
+from api.utils.crypto import (
+    DEFAULT_KEY_ID,
+    open_stored_descriptor,
+    seal_descriptor,
+)
+
+# Ключи хранения в процессах пула, передаются через initializer
+_worker_keys = {}
+
+
+def _init_worker(keys):
+    _worker_keys.update(keys)
+
+
+def reencrypt_rows(rows, new_key_id):
+    """
+    Перешифровывает дескрипторы в процессе пула
+    :param rows: список (pk, stored_value, key_id)
+    :return: (список (pk, stored_value, key_id, новый blob),
+        список (pk, ошибка))
+    """
+    sealed, errors = [], []
+    new_key = _worker_keys[new_key_id]
+    for user_id, stored_value, key_id in rows:
+        try:
+            old_key = _worker_keys.get(key_id or DEFAULT_KEY_ID)
+            if old_key is None:
+                raise ValueError(f"неизвестный ключ {key_id}")
+            descriptor = open_stored_descriptor(stored_value, old_key)
+            sealed.append(
+                (
+                    user_id,
+                    stored_value,
+                    key_id,
+                    seal_descriptor(descriptor, new_key),
+                )
+            )
+        except ValueError as e:
+            errors.append((user_id, str(e)))
+    return sealed, errors
+
+
+class Command(BaseCommand):
+    help = (
+        "Перешифровывает дескрипторы лиц и шаблоны лиц текущим ключом "
+        "AES_STORAGE_KEY. "
+        "Прежние ключи должны быть перечислены в AES_STORAGE_PREVIOUS_KEYS. "
+        "Повторный запуск продолжает с необработанных пользователей. "
+        "Дескрипторы, изменённые во время перешифрования, пропускаются "
+        "и будут обработаны повторным запуском."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=1000,
+            help="Количество пользователей в одной пачке",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count() or 1,
+            help="Количество процессов для шифрования",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Проверить перешифрование без записи в базу",
+        )
+
+    def pending_users(self, key_id):
+        return User.objects.filter(
+            Q(face_descriptor_blob__isnull=False)
+            | Q(face_descriptor__isnull=False)
+        ).exclude(face_descriptor_key_id=key_id)
+
+    def pending_templates(self, key_id):
+        return FaceTemplate.objects.exclude(key_id=key_id)
+
+    def read_chunks(self, queryset, chunk_size):
+        """Читает пачки по возрастанию id, не завися от записанных."""
+        queryset = queryset.order_by("pk").values_list(
+            "pk",
+            "face_descriptor_blob",
+            "face_descriptor",
+            "face_descriptor_key_id",
+        )
+        last_pk = 0
+        while True:
+            chunk = [
+                (
+                    pk,
+                    bytes(blob) if blob is not None else legacy_value,
+                    key_id,
+                )
+                for pk, blob, legacy_value, key_id in queryset.filter(
+                    pk__gt=last_pk
+                )[:chunk_size]
+            ]
+            if not chunk:
+                return
+            last_pk = chunk[-1][0]
+            yield chunk
+
+    def read_template_chunks(self, queryset, chunk_size):
+        queryset = queryset.order_by("pk").values_list(
+            "pk", "descriptor_blob", "key_id"
+        )
+        last_pk = 0
+        while True:
+            chunk = [
+                (pk, bytes(blob), key_id)
+                for pk, blob, key_id in queryset.filter(pk__gt=last_pk)[
+                    :chunk_size
+                ]
+            ]
+            if not chunk:
+                return
+            last_pk = chunk[-1][0]
+            yield chunk
+
+    def write_template_chunk(self, sealed, key_id):
+        """
+        Записывает шаблоны, если они не изменились после чтения
+        :return: количество пропущенных шаблонов
+        """
+        written = []
+        with transaction.atomic():
+            for template_id, old_blob, old_key_id, blob in sealed:
+                if FaceTemplate.objects.filter(
+                    pk=template_id, descriptor_blob=old_blob, key_id=old_key_id
+                ).update(descriptor_blob=blob, key_id=key_id):
+                    written.append(template_id)
+            record_face_index_changes(
+                FaceTemplate.objects.filter(pk__in=written)
+                .values_list("user_id", flat=True)
+                .distinct()
+            )
+        return len(sealed) - len(written)
+
+    def write_chunk(self, sealed, key_id):
+        """
+        Записывает дескрипторы пользователей, не изменившиеся после
+        чтения
+        :return: количество пропущенных пользователей
+        """
+        return replace_stored_descriptors(sealed, key_id)
+
+    def handle(self, *args, **options):
+        key_id = settings.AES_STORAGE_KEY_ID
+        keys = settings.AES_STORAGE_KEYS
+        if not keys.get(key_id):
+            raise CommandError("Не задан AES_STORAGE_KEY")
+        dry_run = options["dry_run"]
+        workers = max(1, options["workers"])
+
+        users = self.pending_users(key_id)
+        templates = self.pending_templates(key_id)
+        total = users.count() + templates.count()
+        self.stdout.write(
+            f"К перешифрованию ключом {key_id}: {total} дескрипторов"
+        )
+
+        done = failed = skipped = 0
+
+        def collect(future, label, write):
+            nonlocal done, failed, skipped
+            sealed, errors = future.result()
+            for pk, error in errors:
+                self.stderr.write(f"{label} {pk}: {error}")
+            changed = write(sealed, key_id) if sealed and not dry_run else 0
+            done += len(sealed) - changed
+            failed += len(errors)
+            skipped += changed
+            self.stdout.write(f"Обработано {done + failed + skipped}/{total}")
+
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker, initargs=(keys,)
+        ) as pool:
+            for chunks, label, write in (
+                (
+                    self.read_chunks(users, options["chunk_size"]),
+                    "Пользователь",
+                    self.write_chunk,
+                ),
+                (
+                    self.read_template_chunks(
+                        templates, options["chunk_size"]
+                    ),
+                    "Шаблон",
+                    self.write_template_chunk,
+                ),
+            ):
+                in_flight = deque()
+                for chunk in chunks:
+                    in_flight.append(
+                        pool.submit(reencrypt_rows, chunk, key_id)
+                    )
+                    if len(in_flight) >= 2 * workers:
+                        collect(in_flight.popleft(), label, write)
+                while in_flight:
+                    collect(in_flight.popleft(), label, write)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{'Проверено' if dry_run else 'Перешифровано'}: {done}, "
+                f"ошибок: {failed}, изменены во время работы: {skipped}"
+            )
+        )
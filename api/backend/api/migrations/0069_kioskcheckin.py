@@ -0,0 +1,69 @@
+# Generated by Django 5.2.1 on 2026-10-18 17:42
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0068_rename_item_medicinequizitem_text"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="KioskCheckIn",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "distance",
+                    models.FloatField(verbose_name="Расстояние до дескриптора"),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(
+                        auto_now_add=True, db_index=True, verbose_name="Дата отметки"
+                    ),
+                ),
+                (
+                    "is_confirmed",
+                    models.BooleanField(
+                        default=False, verbose_name="Подтверждено руководителем"
+                    ),
+                ),
+                (
+                    "employee",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="kiosk_check_ins",
+                        to=settings.AUTH_USER_MODEL,
+                        verbose_name="Сотрудник",
+                    ),
+                ),
+                (
+                    "operator",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="kiosk_operator_check_ins",
+                        to=settings.AUTH_USER_MODEL,
+                        verbose_name="Оператор киоска",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Отметка на киоске",
+                "verbose_name_plural": "Отметки на киоске",
+                "ordering": ("-created_at",),
+            },
+        ),
+    ]
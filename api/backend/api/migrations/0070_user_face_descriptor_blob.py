@@ -0,0 +1,20 @@
+# Generated by Django 5.2.1 on 2026-10-18 17:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0069_kioskcheckin"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="face_descriptor_blob",
+            field=models.BinaryField(
+                blank=True, null=True, verbose_name="Дескриптор лица (двоичный формат)"
+            ),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.1 on 2026-10-18 17:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0070_user_face_descriptor_blob"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="face_descriptor_key_id",
+            field=models.CharField(
+                blank=True,
+                max_length=32,
+                null=True,
+                verbose_name="Идентификатор ключа шифрования дескриптора",
+            ),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.1 on 2026-10-18 17:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0071_user_face_descriptor_key_id"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="FaceIndexChange",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "user_id",
+                    models.PositiveIntegerField(verbose_name="ID пользователя"),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(
+                        auto_now_add=True, db_index=True, verbose_name="Дата изменения"
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Изменение индекса лиц",
+                "verbose_name_plural": "Изменения индекса лиц",
+                "ordering": ("id",),
+            },
+        ),
+    ]
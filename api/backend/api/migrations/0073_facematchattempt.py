@@ -0,0 +1,81 @@
+# Generated by Django 5.2.1 on 2026-10-18 18:00
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0072_faceindexchange"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="FaceMatchAttempt",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "source",
+                    models.CharField(
+                        choices=[
+                            ("login", "Вход по лицу"),
+                            ("registration", "Проверка при регистрации"),
+                            ("verification", "Подтверждение личности"),
+                        ],
+                        max_length=16,
+                        verbose_name="Источник",
+                    ),
+                ),
+                ("is_match", models.BooleanField(verbose_name="Совпадение найдено")),
+                (
+                    "best_distance",
+                    models.FloatField(null=True, verbose_name="Лучшее расстояние"),
+                ),
+                (
+                    "second_distance",
+                    models.FloatField(null=True, verbose_name="Второе расстояние"),
+                ),
+                (
+                    "candidates",
+                    models.PositiveIntegerField(verbose_name="Количество кандидатов"),
+                ),
+                (
+                    "decrypt_ms",
+                    models.FloatField(verbose_name="Время дешифрования, мс"),
+                ),
+                ("compare_ms", models.FloatField(verbose_name="Время сравнения, мс")),
+                (
+                    "created_at",
+                    models.DateTimeField(
+                        auto_now_add=True, db_index=True, verbose_name="Дата попытки"
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="face_match_attempts",
+                        to=settings.AUTH_USER_MODEL,
+                        verbose_name="Найденный или подтверждаемый пользователь",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Попытка сравнения лица",
+                "verbose_name_plural": "Попытки сравнения лиц",
+                "ordering": ("-created_at",),
+            },
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 5.2.1 on 2026-10-18 18:04
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0073_facematchattempt"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="FaceTemplate",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "descriptor_blob",
+                    models.BinaryField(
+                        verbose_name="Дескриптор лица (двоичный формат)"
+                    ),
+                ),
+                (
+                    "key_id",
+                    models.CharField(
+                        blank=True,
+                        max_length=32,
+                        null=True,
+                        verbose_name="Идентификатор ключа шифрования дескриптора",
+                    ),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(
+                        auto_now_add=True, verbose_name="Дата добавления"
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="face_templates",
+                        to=settings.AUTH_USER_MODEL,
+                        verbose_name="Пользователь",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Шаблон лица",
+                "verbose_name_plural": "Шаблоны лиц",
+                "ordering": ("user", "id"),
+            },
+        ),
+    ]
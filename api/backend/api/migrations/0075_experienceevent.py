@@ -0,0 +1,97 @@
+# Generated by Django 5.2.1 on 2026-10-18 18:07
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def create_opening_balances(apps, schema_editor):
+    User = apps.get_model("api", "User")
+    ExperienceEvent = apps.get_model("api", "ExperienceEvent")
+
+    # Очки, набранные до появления журнала, становятся начальным балансом
+    ExperienceEvent.objects.bulk_create(
+        (
+            ExperienceEvent(
+                user_id=user_id, source="opening_balance", points=points
+            )
+            for user_id, points in User.objects.exclude(
+                experience_points=0
+            ).values_list("pk", "experience_points").iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0074_facetemplate"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ExperienceEvent",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "source",
+                    models.CharField(
+                        choices=[
+                            ("test", "Тестирование"),
+                            ("instruction", "Инструктаж"),
+                            ("swiper", "Игра Swiper"),
+                            ("quiz", "Квиз"),
+                            ("opening_balance", "Начальный баланс"),
+                        ],
+                        max_length=16,
+                        verbose_name="Источник",
+                    ),
+                ),
+                (
+                    "source_id",
+                    models.PositiveIntegerField(
+                        blank=True, null=True, verbose_name="Идентификатор результата"
+                    ),
+                ),
+                ("points", models.IntegerField(verbose_name="Очки опыта")),
+                (
+                    "created_at",
+                    models.DateTimeField(
+                        auto_now_add=True, db_index=True, verbose_name="Дата начисления"
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="experience_events",
+                        to=settings.AUTH_USER_MODEL,
+                        verbose_name="Пользователь",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Начисление очков опыта",
+                "verbose_name_plural": "Начисления очков опыта",
+                "ordering": ("-created_at",),
+                "indexes": [
+                    models.Index(
+                        fields=["user", "created_at"],
+                        name="api_experie_user_id_70816b_idx",
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(
+            create_opening_balances, migrations.RunPython.noop
+        ),
+    ]
@@ -0,0 +1,33 @@
+from django.db import migrations
+
+from backend.constants import POWER_OF_USER
+
+
+def create_missing_power_of_user(apps, schema_editor):
+    User = apps.get_model("api", "User")
+    PowerOfUser = apps.get_model("api", "PowerOfUser")
+
+    # Раньше запись создавалась при любом сохранении пользователя,
+    # теперь только при создании
+    PowerOfUser.objects.bulk_create(
+        (
+            PowerOfUser(user_id=user_id, power=POWER_OF_USER)
+            for user_id in User.objects.filter(
+                power_of_user__isnull=True
+            ).values_list("pk", flat=True).iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0075_experienceevent"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            create_missing_power_of_user, migrations.RunPython.noop
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.1 on 2026-10-18 18:09
+
+from django.db import migrations, models
+from django.db.models import Min
+
+
+def remove_duplicate_user_badges(apps, schema_editor):
+    UserBadge = apps.get_model("api", "UserBadge")
+
+    # Оставляем самое раннее присвоение значка пользователю
+    first_ids = (
+        UserBadge.objects.values("user", "badge")
+        .annotate(first_id=Min("id"))
+        .values_list("first_id", flat=True)
+    )
+    UserBadge.objects.exclude(id__in=list(first_ids)).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0076_create_missing_power_of_user"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            remove_duplicate_user_badges, migrations.RunPython.noop
+        ),
+        migrations.AddConstraint(
+            model_name="userbadge",
+            constraint=models.UniqueConstraint(
+                fields=("user", "badge"), name="unique_user_badge"
+            ),
+        ),
+    ]
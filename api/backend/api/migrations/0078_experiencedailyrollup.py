@@ -0,0 +1,45 @@
+# Generated by Django 5.2.1 on 2026-10-18 18:12
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0077_unique_user_badge"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ExperienceDailyRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("date", models.DateField(db_index=True, verbose_name="Дата")),
+                ("points", models.IntegerField(default=0, verbose_name="Очки опыта")),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="experience_rollups",
+                        to=settings.AUTH_USER_MODEL,
+                        verbose_name="Пользователь",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Очки опыта за день",
+                "verbose_name_plural": "Очки опыта по дням",
+                "unique_together": {("user", "date")},
+            },
+        ),
+    ]
@@ -0,0 +1,85 @@
+# Generated by Django 5.2.1 on 2026-10-18 18:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0078_experiencedailyrollup"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TestSnapshot",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("version", models.PositiveIntegerField(verbose_name="Версия")),
+                (
+                    "test_is_control",
+                    models.BooleanField(verbose_name="Тест является контрольным"),
+                ),
+                ("passing_score", models.IntegerField(verbose_name="Проходной балл")),
+                ("questions", models.JSONField(verbose_name="Вопросы")),
+                (
+                    "published_at",
+                    models.DateTimeField(
+                        auto_now_add=True, verbose_name="Дата публикации"
+                    ),
+                ),
+                (
+                    "test",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="snapshots",
+                        to="api.tests",
+                        verbose_name="Тест",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Версия теста",
+                "verbose_name_plural": "Версии тестов",
+                "ordering": ("test", "-version"),
+            },
+        ),
+        migrations.AddField(
+            model_name="testresult",
+            name="snapshot",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="test_results",
+                to="api.testsnapshot",
+                verbose_name="Версия теста",
+            ),
+        ),
+        migrations.AddField(
+            model_name="tests",
+            name="published_snapshot",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to="api.testsnapshot",
+                verbose_name="Опубликованная версия",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="testsnapshot",
+            constraint=models.UniqueConstraint(
+                fields=("test", "version"), name="unique_test_version"
+            ),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.1 on 2026-10-18 18:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0081_experienceevent_manual_source"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="facematchattempt",
+            name="source",
+            field=models.CharField(
+                choices=[
+                    ("login", "Вход по лицу"),
+                    ("registration", "Проверка при регистрации"),
+                    ("verification", "Подтверждение личности"),
+                    ("kiosk", "Отметка на киоске"),
+                ],
+                max_length=16,
+                verbose_name="Источник",
+            ),
+        ),
+    ]
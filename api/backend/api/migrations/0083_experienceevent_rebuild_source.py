@@ -0,0 +1,30 @@
+# Generated by Django 5.2.1 on 2026-10-18 18:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0082_facematchattempt_kiosk_source"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="experienceevent",
+            name="source",
+            field=models.CharField(
+                choices=[
+                    ("test", "Тестирование"),
+                    ("instruction", "Инструктаж"),
+                    ("swiper", "Игра Swiper"),
+                    ("quiz", "Квиз"),
+                    ("opening_balance", "Начальный баланс"),
+                    ("manual", "Корректировка администратором"),
+                    ("rebuild", "Пересчёт по журналу"),
+                ],
+                max_length=16,
+                verbose_name="Источник",
+            ),
+        ),
+    ]
@@ -6,6 +6,7 @@ from django.conf import settings
 from django.utils import timezone
 from telegram import Bot
 
+from .utils.thresholds import cached_threshold_table
 from .utils.validators import normalize_phone_number
 from backend.constants import (
     MAX_LENGTH_EMAIL_ADDRESS,
@@ -129,6 +130,17 @@ class User(AbstractUser):
         blank=True,
         null=True,
     )
+    face_descriptor_blob = models.BinaryField(
+        "Дескриптор лица (двоичный формат)",
+        blank=True,
+        null=True,
+    )
+    face_descriptor_key_id = models.CharField(
+        "Идентификатор ключа шифрования дескриптора",
+        max_length=32,
+        blank=True,
+        null=True,
+    )
     supervisor = models.ForeignKey(
         "self",
         on_delete=models.SET_NULL,
@@ -168,57 +180,138 @@ class User(AbstractUser):
         """Возвращает строковое представление объекта пользователя."""
         return f"{self.last_name} {self.first_name}"
 
+    # Поля, от которых зависит строка пользователя в индексе лиц
+    FACE_INDEX_FIELDS = (
+        "face_descriptor",
+        "face_descriptor_blob",
+        "face_descriptor_key_id",
+        "position_id",
+    )
+    # Поля, от которых зависят звание и значки
+    RANK_FIELDS = ("experience_points", "position_id")
+    # Значения этих полей запоминаются при загрузке из БД, чтобы
+    # определять изменения без повторного чтения пользователя
+    TRACKED_FIELDS = tuple(dict.fromkeys(FACE_INDEX_FIELDS + RANK_FIELDS))
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._remember_loaded_state()
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using=using, fields=fields, **kwargs)
+        self._remember_loaded_state(
+            None
+            if fields is None
+            else {self._meta.get_field(name).attname for name in fields}
+        )
+
+    def _remember_loaded_state(self, fields=None):
+        """
+        Запоминает значения отслеживаемых полей как сохранённые в БД
+        :param fields: attname сохранённых полей, None - все поля
+        """
+        if fields is None:
+            self._loaded_state = {}
+        elif not hasattr(self, "_loaded_state"):
+            return
+        self._loaded_state.update(
+            (field, self.__dict__[field])
+            for field in self.TRACKED_FIELDS
+            if field in self.__dict__ and (fields is None or field in fields)
+        )
+
+    def _fields_changed(self, fields):
+        """Изменились ли поля из TRACKED_FIELDS с загрузки из БД."""
+        loaded = getattr(self, "_loaded_state", None)
+        if loaded is None:
+            return True
+        return any(
+            field in self.__dict__
+            and (field not in loaded or self.__dict__[field] != loaded[field])
+            for field in fields
+        )
+
+    @property
+    def face_index_changed(self):
+        """Изменились ли дескриптор лица или должность с загрузки из БД."""
+        return self._fields_changed(self.FACE_INDEX_FIELDS)
+
+    @property
+    def stored_face_descriptor(self):
+        """Зашифрованный дескриптор в двоичном или устаревшем JSON-формате."""
+        if self.face_descriptor_blob is not None:
+            return bytes(self.face_descriptor_blob)
+        return self.face_descriptor
+
     def save(self, *args, **kwargs):
         if self.mobile_phone:
             self.mobile_phone = normalize_phone_number(self.mobile_phone)
 
-        update_ranks_and_badges = False
-        if self.pk:
-            original = User.objects.get(pk=self.pk)
-            if (
-                self.experience_points != original.experience_points
-                or self.position != original.position
-            ):
-                update_ranks_and_badges = True
-        else:
-            update_ranks_and_badges = True
+        creating = self._state.adding
+        update_ranks_and_badges = creating or self._fields_changed(
+            self.RANK_FIELDS
+        )
 
+        update_fields = kwargs.get("update_fields")
         super().save(*args, **kwargs)
+        self._remember_loaded_state(
+            None
+            if update_fields is None
+            else {self._meta.get_field(name).attname for name in update_fields}
+        )
+
+        if creating:
+            PowerOfUser.objects.create(user=self, power=POWER_OF_USER)
 
         if update_ranks_and_badges:
             self._update_rank()
             self._assign_badges()
 
-        if not PowerOfUser.objects.filter(user=self).exists():
-            PowerOfUser.objects.create(user=self, power=POWER_OF_USER)
+    def award_experience(self, points, source, source_id=None):
+        """
+        Начисляет очки опыта записью в журнал ExperienceEvent и атомарным
+        увеличением experience_points без сохранения всего пользователя
+        :param points: количество очков, отрицательное - списание
+        :param source: ExperienceEvent.Source
+        :param source_id: id результата, за который начислены очки
+        """
+        with transaction.atomic():
+            ExperienceEvent.objects.create(
+                user=self, source=source, source_id=source_id, points=points
+            )
+            User.objects.filter(pk=self.pk).update(
+                experience_points=models.F("experience_points") + points
+            )
+        self.refresh_from_db(fields=["experience_points"])
+        self._update_rank()
+        self._assign_badges()
 
     def _update_rank(self):
         """Обновление звания пользователя"""
-        new_rank = (
-            Rank.objects.filter(
-                models.Q(position=self.position)
-                | models.Q(position__isnull=True),
-                required_points__lte=self.experience_points,
-            )
-            .order_by("-required_points")
-            .first()
+        reached = Rank.threshold_table(self.position_id).reached(
+            self.experience_points
         )
+        new_rank_id = reached[-1] if reached else None
 
-        if new_rank != self.current_rank:
-            self.current_rank = new_rank
+        if new_rank_id != self.current_rank_id:
+            self.current_rank_id = new_rank_id
             self.save(update_fields=["current_rank"])
 
     def _assign_badges(self):
         """Присвоение новых значков"""
-        existing_badges_ids = self.badges.values_list("badge_id", flat=True)
-
-        eligible_badges = Badge.objects.filter(
-            models.Q(position=self.position) | models.Q(position__isnull=True),
-            required_count__lte=self.experience_points,
-        ).exclude(id__in=existing_badges_ids)
-
-        for badge in eligible_badges:
-            UserBadge.objects.get_or_create(user=self, badge=badge)
+        eligible_badge_ids = Badge.threshold_table(self.position_id).reached(
+            self.experience_points
+        )
+        if eligible_badge_ids:
+            UserBadge.objects.bulk_create(
+                [
+                    UserBadge(user=self, badge_id=badge_id)
+                    for badge_id in eligible_badge_ids
+                ],
+                ignore_conflicts=True,
+            )
 
 
 class Badge(models.Model):
@@ -246,6 +339,18 @@ class Badge(models.Model):
         """Возвращает строковое представление объекта."""
         return self.name
 
+    @classmethod
+    def threshold_table(cls, position_id):
+        """Кэшированные пороги значков должности и общих значков."""
+        return cached_threshold_table(
+            "badge",
+            position_id,
+            lambda: cls.objects.filter(
+                models.Q(position_id=position_id)
+                | models.Q(position__isnull=True)
+            ).values_list("required_count", "id"),
+        )
+
 
 class UserBadge(models.Model):
     """Модель присвоения значков сотрудникам."""
@@ -259,6 +364,11 @@ class UserBadge(models.Model):
     class Meta:
         verbose_name = "Значок пользователя"
         verbose_name_plural = "Значки пользователей"
+        constraints = [
+            models.UniqueConstraint(
+                fields=("user", "badge"), name="unique_user_badge"
+            )
+        ]
 
     def __str__(self):
         return f"Значок пользователя: {str(self.badge)}"
@@ -285,6 +395,18 @@ class Rank(models.Model):
     def __str__(self):
         return self.name
 
+    @classmethod
+    def threshold_table(cls, position_id):
+        """Кэшированные пороги званий должности и общих званий."""
+        return cached_threshold_table(
+            "rank",
+            position_id,
+            lambda: cls.objects.filter(
+                models.Q(position_id=position_id)
+                | models.Q(position__isnull=True)
+            ).values_list("required_points", "id"),
+        )
+
 
 class Position(models.Model):
     """Модель должности пользователя."""
@@ -530,6 +652,14 @@ class Tests(models.Model):
         related_name="tests",
         db_index=True,
     )
+    published_snapshot = models.ForeignKey(
+        "TestSnapshot",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        verbose_name="Опубликованная версия",
+        related_name="+",
+    )
 
     class Meta:
         verbose_name = "Тест"
@@ -636,6 +766,38 @@ class Answer(models.Model):
         return self.name
 
 
+class TestSnapshot(models.Model):
+    """
+    Опубликованная версия теста: неизменяемая копия вопросов и ответов
+    в том виде, в котором их получает клиент.
+    """
+
+    test = models.ForeignKey(
+        Tests,
+        on_delete=models.CASCADE,
+        related_name="snapshots",
+        verbose_name="Тест",
+    )
+    version = models.PositiveIntegerField("Версия")
+    test_is_control = models.BooleanField("Тест является контрольным")
+    passing_score = models.IntegerField("Проходной балл")
+    questions = models.JSONField("Вопросы")
+    published_at = models.DateTimeField("Дата публикации", auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Версия теста"
+        verbose_name_plural = "Версии тестов"
+        ordering = ("test", "-version")
+        constraints = [
+            models.UniqueConstraint(
+                fields=("test", "version"), name="unique_test_version"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.test} - версия {self.version}"
+
+
 class TestResult(models.Model):
     """Модель результатов тестирования."""
 
@@ -657,6 +819,14 @@ class TestResult(models.Model):
         null=True,
         db_index=True,
     )
+    snapshot = models.ForeignKey(
+        TestSnapshot,
+        on_delete=models.SET_NULL,
+        related_name="test_results",
+        verbose_name="Версия теста",
+        blank=True,
+        null=True,
+    )
     is_passed = models.BooleanField("Тест пройден", default=False)
     mark = models.FloatField(
         "Оценка",
@@ -685,16 +855,19 @@ class TestResult(models.Model):
         )
 
     def create_notification(self):
-        if self.user.supervisor:
-            # Создаем уведомление
-            notification = Notification.objects.create(
-                user=self.user.supervisor,
+        """
+        Создаёт уведомление руководителю. Отправка в Telegram - задачей
+        Celery после коммита, см. signals.
+        :return: Notification или None, если руководителя нет
+        """
+        if self.user.supervisor_id:
+            return Notification.objects.create(
+                user_id=self.user.supervisor_id,
                 employee=self.user,
                 notification_type=Notification.NotificationType.TEST,
                 test_result=self,
             )
-
-            notification.send_notification()
+        return None
 
     def save(self, *args, **kwargs):
         base_xp = self.score * TEST_SCORE
@@ -704,12 +877,14 @@ class TestResult(models.Model):
             time_bonus = max(
                 0, 100 - self.test_duration // 10
             )
-            self.user.experience_points += base_xp + time_bonus
-            self.user.save()
+            points = base_xp + time_bonus
         else:
-            self.user.experience_points -= base_xp
-            self.user.save()
-        super().save(*args, **kwargs)
+            points = -base_xp
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            self.user.award_experience(
+                points, ExperienceEvent.Source.TEST, self.pk
+            )
 
 
 class UserAnswer(models.Model):
@@ -782,23 +957,29 @@ class InstructionResult(models.Model):
         return f"{self.user} - {self.instruction} - {self.result}"
 
     def create_notification(self):
-        if self.user.supervisor:
-            notification = Notification.objects.create(
-                user=self.user.supervisor,
+        """
+        Создаёт уведомление руководителю, отправка - после коммита
+        :return: Notification или None, если руководителя нет
+        """
+        if self.user.supervisor_id:
+            return Notification.objects.create(
+                user_id=self.user.supervisor_id,
                 employee=self.user,
                 notification_type=Notification.NotificationType.INSTRUCTION,
                 instruction_result=self,
             )
-
-            notification.send_notification()
+        return None
 
     def save(self, *args, **kwargs):
-        if (
-            self.result and not self.pk
-        ):
-            self.user.experience_points += INSTRUCTION_SCORE
-            self.user.save()
-        super().save(*args, **kwargs)
+        award = self.result and not self.pk
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if award:
+                self.user.award_experience(
+                    INSTRUCTION_SCORE,
+                    ExperienceEvent.Source.INSTRUCTION,
+                    self.pk,
+                )
 
 
 class InstructionAgreementResult(models.Model):
@@ -971,12 +1152,16 @@ class GameSwiperResult(models.Model):
         return f"{self.user} - {self.date} ({self.score})"
 
     def save(self, *args, **kwargs):
-        self.user.experience_points += self.score * SWIPER_FACTOR
-        PowerOfUser.objects.filter(
-            user=self.user
-        ).update(power=models.F("power") - 1)
-        self.user.save(update_fields=["experience_points"])
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            PowerOfUser.objects.filter(user=self.user).update(
+                power=models.F("power") - 1
+            )
+            super().save(*args, **kwargs)
+            self.user.award_experience(
+                self.score * SWIPER_FACTOR,
+                ExperienceEvent.Source.SWIPER,
+                self.pk,
+            )
 
 
 class FireSafetyQuiz(models.Model):
@@ -1062,12 +1247,16 @@ class QuizResult(models.Model):
 
 
     def save(self, *args, **kwargs):
-        self.user.experience_points += self.level * QUIZ_FACTOR
-        PowerOfUser.objects.filter(
-            user=self.user
-        ).update(power=models.F("power") - 2)
-        self.user.save(update_fields=["experience_points"])
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            PowerOfUser.objects.filter(user=self.user).update(
+                power=models.F("power") - 2
+            )
+            super().save(*args, **kwargs)
+            self.user.award_experience(
+                self.level * QUIZ_FACTOR,
+                ExperienceEvent.Source.QUIZ,
+                self.pk,
+            )
 
 
 class PowerOfUser(models.Model):
@@ -1094,3 +1283,231 @@ class PowerOfUser(models.Model):
 
     def __str__(self):
         return f"{self.user} - {self.power}"
+
+
+class ExperienceEvent(models.Model):
+    """
+    Журнал начислений очков опыта.
+
+    Записи только добавляются, User.experience_points - сумма очков
+    пользователя по журналу.
+    """
+
+    class Source(models.TextChoices):
+        TEST = "test", "Тестирование"
+        INSTRUCTION = "instruction", "Инструктаж"
+        SWIPER = "swiper", "Игра Swiper"
+        QUIZ = "quiz", "Квиз"
+        OPENING_BALANCE = "opening_balance", "Начальный баланс"
+        MANUAL = "manual", "Корректировка администратором"
+        REBUILD = "rebuild", "Пересчёт по журналу"
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name="experience_events",
+        verbose_name="Пользователь",
+    )
+    source = models.CharField(
+        "Источник", max_length=16, choices=Source.choices
+    )
+    source_id = models.PositiveIntegerField(
+        "Идентификатор результата", null=True, blank=True
+    )
+    points = models.IntegerField("Очки опыта")
+    created_at = models.DateTimeField(
+        "Дата начисления", auto_now_add=True, db_index=True
+    )
+
+    class Meta:
+        verbose_name = "Начисление очков опыта"
+        verbose_name_plural = "Начисления очков опыта"
+        ordering = ("-created_at",)
+        indexes = [models.Index(fields=("user", "created_at"))]
+
+    def __str__(self):
+        return f"{self.user} - {self.get_source_display()} ({self.points})"
+
+
+class ExperienceDailyRollup(models.Model):
+    """
+    Очки опыта пользователя за день, свёрнутые из журнала
+    ExperienceEvent. Источник рейтингов за день, неделю и месяц.
+    """
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name="experience_rollups",
+        verbose_name="Пользователь",
+    )
+    date = models.DateField("Дата", db_index=True)
+    points = models.IntegerField("Очки опыта", default=0)
+
+    class Meta:
+        verbose_name = "Очки опыта за день"
+        verbose_name_plural = "Очки опыта по дням"
+        unique_together = ("user", "date")
+
+    def __str__(self):
+        return f"{self.user} - {self.date} ({self.points})"
+
+
+class FaceTemplate(models.Model):
+    """
+    Модель дополнительных дескрипторов лица пользователя.
+
+    Основной дескриптор хранится в User.face_descriptor_blob, шаблоны
+    дополняют его снимками в каске, при другом освещении и т.п.
+    """
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name="face_templates",
+        verbose_name="Пользователь",
+    )
+    descriptor_blob = models.BinaryField("Дескриптор лица (двоичный формат)")
+    key_id = models.CharField(
+        "Идентификатор ключа шифрования дескриптора",
+        max_length=32,
+        blank=True,
+        null=True,
+    )
+    created_at = models.DateTimeField("Дата добавления", auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Шаблон лица"
+        verbose_name_plural = "Шаблоны лиц"
+        ordering = ("user", "id")
+
+    def __str__(self):
+        return f"{self.user} - {self.created_at}"
+
+
+class FaceEnrollment(models.Model):
+    """
+    Журнал добавления шаблонов лица. Шаблон добавляется только после
+    подтверждения лица по уже сохранённым дескрипторам пользователя.
+    """
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name="face_enrollments",
+        verbose_name="Пользователь",
+    )
+    template = models.ForeignKey(
+        FaceTemplate,
+        on_delete=models.SET_NULL,
+        related_name="enrollments",
+        verbose_name="Шаблон лица",
+        blank=True,
+        null=True,
+    )
+    verification_distance = models.FloatField(
+        "Расстояние при подтверждении лица"
+    )
+    created_at = models.DateTimeField("Дата добавления", auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Добавление шаблона лица"
+        verbose_name_plural = "Добавления шаблонов лиц"
+        ordering = ("-created_at",)
+
+    def __str__(self):
+        return f"{self.user} - {self.created_at}"
+
+
+class FaceIndexChange(models.Model):
+    """
+    Журнал изменений дескрипторов лиц и должностей пользователей.
+
+    id записи служит версией: воркеры применяют к своему индексу лиц
+    только изменения новее уже применённых.
+    """
+
+    user_id = models.PositiveIntegerField("ID пользователя")
+    created_at = models.DateTimeField(
+        "Дата изменения", auto_now_add=True, db_index=True
+    )
+
+    class Meta:
+        verbose_name = "Изменение индекса лиц"
+        verbose_name_plural = "Изменения индекса лиц"
+        ordering = ("id",)
+
+    def __str__(self):
+        return f"{self.user_id} - {self.created_at}"
+
+
+class FaceMatchAttempt(models.Model):
+    """Модель телеметрии попыток сравнения лиц."""
+
+    class Source(models.TextChoices):
+        LOGIN = "login", "Вход по лицу"
+        REGISTRATION = "registration", "Проверка при регистрации"
+        VERIFICATION = "verification", "Подтверждение личности"
+        KIOSK = "kiosk", "Отметка на киоске"
+
+    source = models.CharField(
+        "Источник", max_length=16, choices=Source.choices
+    )
+    user = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="face_match_attempts",
+        verbose_name="Найденный или подтверждаемый пользователь",
+    )
+    is_match = models.BooleanField("Совпадение найдено")
+    best_distance = models.FloatField("Лучшее расстояние", null=True)
+    second_distance = models.FloatField("Второе расстояние", null=True)
+    candidates = models.PositiveIntegerField("Количество кандидатов")
+    decrypt_ms = models.FloatField("Время дешифрования, мс")
+    compare_ms = models.FloatField("Время сравнения, мс")
+    created_at = models.DateTimeField(
+        "Дата попытки", auto_now_add=True, db_index=True
+    )
+
+    class Meta:
+        verbose_name = "Попытка сравнения лица"
+        verbose_name_plural = "Попытки сравнения лиц"
+        ordering = ("-created_at",)
+
+    def __str__(self):
+        return f"{self.get_source_display()} - {self.best_distance}"
+
+
+class KioskCheckIn(models.Model):
+    """Модель отметок сотрудников, опознанных на киоске."""
+
+    operator = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        related_name="kiosk_operator_check_ins",
+        verbose_name="Оператор киоска",
+    )
+    employee = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name="kiosk_check_ins",
+        verbose_name="Сотрудник",
+    )
+    distance = models.FloatField("Расстояние до дескриптора")
+    created_at = models.DateTimeField(
+        "Дата отметки", auto_now_add=True, db_index=True
+    )
+    is_confirmed = models.BooleanField(
+        "Подтверждено руководителем", default=False
+    )
+
+    class Meta:
+        verbose_name = "Отметка на киоске"
+        verbose_name_plural = "Отметки на киоске"
+        ordering = ("-created_at",)
+
+    def __str__(self):
+        return f"{self.employee} - {self.created_at}"
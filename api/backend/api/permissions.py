@@ -13,3 +13,17 @@ class IsAdminPermission(BasePermission):
     def has_permission(self, request, view):
         """Определяет права доступа на уровне всего запроса."""
         return request.user.is_authenticated and request.user.is_staff
+
+
+class IsManagementPermission(BasePermission):
+    """ManagementPermission.
+
+    Проверяет, что пользователь - руководитель или администратор.
+    """
+
+    def has_permission(self, request, view):
+        """Определяет права доступа на уровне всего запроса."""
+        return request.user.is_authenticated and (
+            request.user.is_staff
+            or request.user.role == request.user.Role.MANAGEMENT
+        )
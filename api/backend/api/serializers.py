@@ -1,14 +1,15 @@
-import json
 import random
-import os
+import time
 
 from django.conf import settings
-from django.core.cache import cache
-from dotenv import load_dotenv
+from django.db import transaction
 import numpy as np
 from rest_framework import serializers
 
 from api.models import (
+    FaceEnrollment,
+    FaceMatchAttempt,
+    FaceTemplate,
     User,
     Instruction,
     InstructionAgreement,
@@ -33,13 +34,29 @@ from api.models import (
     MedicineQuiz,
     MedicineQuizItem
 )
-from api.utils.utils import (
+from api.utils.crypto import (
+    current_storage_key,
     decrypt_descriptor,
-    encrypt_descriptor,
-    is_face_already_registered
+    seal_descriptor,
+)
+from api.utils.grading import (
+    GradingError,
+    cached_answer_key,
+    served_questions,
+    sign_served_questions,
+)
+from api.utils.question_pools import cached_question_pool
+from api.utils.test_snapshots import cached_snapshot
+from api.utils.transport_keys import use_transport_key
+from api.utils.utils import (
+    identify_face,
+    is_face_already_registered,
+    verify_face,
 )
 from api.utils.validators import normalize_phone_number
 from backend.constants import (
+    MAX_FACE_BATCH_SIZE,
+    MAX_FACE_TEMPLATES,
     MAX_LENGTH_FACE_DESCRIPTOR,
     MAX_LENGTH_EMAIL_ADDRESS,
     MAX_LENGTH_FIRST_NAME,
@@ -48,12 +65,6 @@ from backend.constants import (
     MAX_LENGTH_PASSWORD,
 )
 
-load_dotenv()
-
-AES_STORAGE_KEY = os.getenv("AES_STORAGE_KEY")
-AES_STORAGE_KEY = AES_STORAGE_KEY.encode()
-
-
 class AdminUserSerializer(serializers.ModelSerializer):
     """Базовый сериализатор для операций с моделью User."""
 
@@ -209,11 +220,10 @@ class SignUpSerializer(serializers.Serializer):
     def validate_face_descriptor(self, value):
         try:
             request = self.context.get("request")
-            encoded_key = cache.get(request.data.get("key_id"))
-            if not encoded_key:
-                raise serializers.ValidationError(
-                    "Ключ шифрования истёк или не существует"
-                )
+            encoded_key = use_transport_key(
+                request.data.get("key_id"), [value]
+            )
+            started = time.perf_counter()
             decrypted_descriptor = decrypt_descriptor(
                 value,
                 encoded_key
@@ -222,13 +232,14 @@ class SignUpSerializer(serializers.Serializer):
                 decrypted_descriptor,
                 dtype=np.float32
             )
+            decrypt_seconds = time.perf_counter() - started
 
             if len(input_descriptor) != MAX_LENGTH_FACE_DESCRIPTOR:
                 raise serializers.ValidationError(
                     "Дескриптор лица должен содержать 128 элементов"
                 )
 
-            if is_face_already_registered(input_descriptor):
+            if is_face_already_registered(input_descriptor, decrypt_seconds):
                 raise serializers.ValidationError(
                     "Пользователь с таким дескриптором лица уже существует"
                 )
@@ -269,8 +280,11 @@ class SignUpSerializer(serializers.Serializer):
         )
 
         try:
-            encrypted_descriptor = encrypt_descriptor(face_descriptor, AES_STORAGE_KEY)
-            validated_data["face_descriptor"] = json.dumps(encrypted_descriptor)
+            key_id, key = current_storage_key()
+            validated_data["face_descriptor_blob"] = seal_descriptor(
+                face_descriptor, key
+            )
+            validated_data["face_descriptor_key_id"] = key_id
 
             return User.objects.create_user(**validated_data)
         except Exception as e:
@@ -279,6 +293,122 @@ class SignUpSerializer(serializers.Serializer):
             )
 
 
+class FaceTemplateSerializer(serializers.Serializer):
+    """
+    Сериализатор добавления шаблона лица текущему пользователю.
+
+    verification_descriptor - свежий снимок лица, который должен совпасть
+    с уже сохранёнными дескрипторами пользователя: без него чужая сессия
+    могла бы добавить к учётной записи своё лицо.
+    """
+
+    key_id = serializers.CharField(required=True)
+    face_descriptor = serializers.DictField()
+    verification_descriptor = serializers.DictField()
+
+    def _decrypt(self, value, encoded_key):
+        descriptor = np.array(
+            decrypt_descriptor(value, encoded_key), dtype=np.float32
+        )
+        if len(descriptor) != MAX_LENGTH_FACE_DESCRIPTOR:
+            raise serializers.ValidationError(
+                "Дескриптор лица должен содержать 128 элементов"
+            )
+        return descriptor
+
+    def validate(self, attrs):
+        """
+        Проверяем, что лицо подтверждено по сохранённым дескрипторам
+        и новый шаблон не принадлежит другому пользователю.
+        """
+        user = self.context["request"].user
+        if not user.stored_face_descriptor:
+            raise serializers.ValidationError(
+                "Основной дескриптор лица задаётся при регистрации"
+            )
+        try:
+            encoded_key = use_transport_key(
+                attrs["key_id"],
+                [attrs["face_descriptor"], attrs["verification_descriptor"]],
+            )
+            started = time.perf_counter()
+            input_descriptor = self._decrypt(
+                attrs["face_descriptor"], encoded_key
+            )
+            verification_descriptor = self._decrypt(
+                attrs["verification_descriptor"], encoded_key
+            )
+            decrypt_seconds = time.perf_counter() - started
+        except serializers.ValidationError:
+            raise
+        except ValueError as e:
+            raise serializers.ValidationError(str(e))
+        except Exception as e:
+            raise serializers.ValidationError(
+                f"Ошибка обработки дескриптора лица: {str(e)}"
+            )
+
+        verified = verify_face(
+            user, verification_descriptor, decrypt_seconds / 2
+        )
+        if verified is None:
+            raise serializers.ValidationError(
+                "Лицо не совпадает с сохранёнными дескрипторами пользователя"
+            )
+
+        match = identify_face(
+            input_descriptor,
+            source=FaceMatchAttempt.Source.REGISTRATION,
+            decrypt_seconds=decrypt_seconds / 2,
+        )
+        if match and match.user_id != user.id:
+            raise serializers.ValidationError(
+                "Дескриптор лица принадлежит другому пользователю"
+            )
+
+        return {
+            "face_descriptor": input_descriptor,
+            "verification_distance": verified.distance,
+        }
+
+    def create(self, validated_data):
+        """
+        Сохраняет шаблон и запись в журнал добавлений. Сверх
+        MAX_FACE_TEMPLATES удаляются самые старые шаблоны.
+        :return: созданный FaceTemplate
+        """
+        user = self.context["request"].user
+        key_id, key = current_storage_key()
+        blob = seal_descriptor(validated_data["face_descriptor"], key)
+
+        with transaction.atomic():
+            template = FaceTemplate.objects.create(
+                user=user, descriptor_blob=blob, key_id=key_id
+            )
+            FaceEnrollment.objects.create(
+                user=user,
+                template=template,
+                verification_distance=validated_data["verification_distance"],
+            )
+            for outdated in FaceTemplate.objects.filter(user=user).order_by(
+                "-id"
+            )[MAX_FACE_TEMPLATES:]:
+                outdated.delete()
+        return template
+
+
+class KioskFaceBatchSerializer(serializers.Serializer):
+    """Сериализатор пачки зашифрованных дескрипторов с киоска."""
+
+    key_id = serializers.CharField(required=True)
+    face_descriptors = serializers.ListField(
+        child=serializers.DictField(),
+        min_length=1,
+        max_length=MAX_FACE_BATCH_SIZE,
+    )
+    position = serializers.IntegerField(required=False)
+
+
 class LoginSerializer(serializers.Serializer):
     """Сериализатор для получения токена аутентификации пользователя."""
 
@@ -397,23 +527,25 @@ class InstructionResultSerializer(serializers.ModelSerializer):
         return value
 
     def validate_face_descriptor(self, value):
-        """Проверяем, что лицо соответствует зарегистрированному пользователю."""
+        """Проверяем, что лицо принадлежит текущему пользователю."""
         try:
             request = self.context.get("request")
-            encoded_key = cache.get(request.data.get("key_id"))
-            if not encoded_key:
-                raise serializers.ValidationError(
-                    "Ключ шифрования истёк или не существует"
-                )
+            encoded_key = use_transport_key(
+                request.data.get("key_id"), [value]
+            )
+            started = time.perf_counter()
             decrypted_descriptor = decrypt_descriptor(value, encoded_key)
             input_descriptor = np.array(decrypted_descriptor, dtype=np.float32)
+            decrypt_seconds = time.perf_counter() - started
 
             if len(input_descriptor) != MAX_LENGTH_FACE_DESCRIPTOR:
                 raise serializers.ValidationError(
                     "Дескриптор лица должен содержать 128 элементов"
                 )
 
-            if not is_face_already_registered(input_descriptor):
+            if not verify_face(
+                request.user, input_descriptor, decrypt_seconds
+            ):
                 raise serializers.ValidationError(
                     "Лицо не распознано. Пройдите аутентификацию."
                 )
@@ -515,6 +647,22 @@ class UserAnswerSerializer(serializers.ModelSerializer):
     class Meta:
         model = UserAnswer
         fields = ("id", "selected_id", "is_correct")
+        # Верность ответа определяет сервер при проверке
+        read_only_fields = ("is_correct",)
+
+
+def serialize_questions(test):
+    """
+    Все вопросы теста в том виде, в котором их получит клиент, вместе
+    с объяснениями
+    """
+    questions = test.questions.prefetch_related(
+        "answers", "reference_link"
+    ).order_by("id")
+    return [
+        dict(question)
+        for question in QuestionSerializer(questions, many=True).data
+    ]
 
 
 class TestResultSerializer(serializers.ModelSerializer):
@@ -535,9 +683,22 @@ class TestResultSerializer(serializers.ModelSerializer):
 
 
 class TestResultCreateSerializer(serializers.ModelSerializer):
-    """Сериализатор для создания результатов теста."""
+    """
+    Сериализатор для создания результатов теста. questions_token -
+    подпись выданных пользователю вопросов из TestSerializer, в ней же
+    номер версии теста, на которую он отвечал. test_version, если
+    передан, должен совпадать с этой версией.
+
+    Баллы, оценку, признак сдачи и верность ответов сервер вычисляет сам
+    по ключу ответов теста, присланные клиентом значения игнорируются.
+    Принимается ровно один ответ на каждый выданный вопрос.
+    """
 
     user_answers = UserAnswerSerializer(many=True, required=False)
+    questions_token = serializers.CharField(write_only=True)
+    test_version = serializers.IntegerField(
+        write_only=True, required=False, min_value=1
+    )
 
     class Meta:
         model = TestResult
@@ -551,41 +712,133 @@ class TestResultCreateSerializer(serializers.ModelSerializer):
             "score",
             "total_points",
             "user_answers",
+            "questions_token",
+            "test_version",
         )
+        read_only_fields = ("mark", "is_passed", "score", "total_points")
         extra_kwargs = {
             "test": {"required": True},
-            "mark": {"required": True},
         }
 
+    def validate(self, attrs):
+        test = attrs["test"]
+        try:
+            version, served_ids = served_questions(
+                attrs.pop("questions_token"),
+                self.context["request"].user.pk,
+                test.id,
+            )
+        except GradingError as e:
+            raise serializers.ValidationError({"questions_token": str(e)})
+        requested_version = attrs.pop("test_version", None)
+        if requested_version not in (None, version):
+            raise serializers.ValidationError(
+                {"test_version": "Вопросы выданы из другой версии теста."}
+            )
+        if version is None:
+            snapshot_id = None
+        else:
+            snapshot_id = (
+                test.snapshots.filter(version=version)
+                .values_list("id", flat=True)
+                .first()
+            )
+            if snapshot_id is None:
+                raise serializers.ValidationError(
+                    {"test_version": "Версия теста не найдена."}
+                )
+        attrs["snapshot_id"] = snapshot_id
+
+        user_answers = attrs.get("user_answers", [])
+        if snapshot_id is None:
+            passing_score = test.passing_score
+        else:
+            passing_score = cached_snapshot(snapshot_id).passing_score
+        try:
+            grade = cached_answer_key(
+                test.id, snapshot_id, lambda: serialize_questions(test)
+            ).grade(
+                [answer["question"]["id"] for answer in user_answers],
+                [answer["selected_answer"]["id"] for answer in user_answers],
+                passing_score,
+                served_ids,
+            )
+        except GradingError as e:
+            raise serializers.ValidationError({"user_answers": str(e)})
+
+        attrs.update(
+            score=grade.score,
+            total_points=grade.total_points,
+            mark=grade.mark,
+            is_passed=grade.is_passed,
+        )
+        for answer, is_correct, points_earned in zip(
+            user_answers, grade.is_correct, grade.points_earned
+        ):
+            answer["is_correct"] = is_correct
+            answer["points_earned"] = points_earned
+        return attrs
+
     def create(self, validated_data):
+        """
+        Сохраняет результат, ответы и начисление опыта одной транзакцией.
+        Уведомление руководителю отправляется после коммита.
+        """
         user_answers_data = validated_data.pop("user_answers", [])
-        test_result = TestResult.objects.create(**validated_data)
-
-        for answer_data in user_answers_data:
-            UserAnswer.objects.create(
-                test_result=test_result,
-                question_id=answer_data["question"]["id"],
-                selected_answer_id=answer_data["selected_answer"]["id"],
-                is_correct=answer_data["is_correct"],
-                points_earned=answer_data.get("points_earned", 0),
+        with transaction.atomic():
+            test_result = TestResult.objects.create(**validated_data)
+            UserAnswer.objects.bulk_create(
+                [
+                    UserAnswer(
+                        test_result=test_result,
+                        question_id=answer_data["question"]["id"],
+                        selected_answer_id=answer_data["selected_answer"][
+                            "id"
+                        ],
+                        is_correct=answer_data["is_correct"],
+                        points_earned=answer_data.get("points_earned", 0),
+                    )
+                    for answer_data in user_answers_data
+                ]
             )
 
         return test_result
 
 
+class TestSummarySerializer(serializers.Serializer):
+    """Сводка попыток текущего пользователя, посчитанная в SQL"""
+
+    attempts = serializers.IntegerField(source="attempts_count")
+    best_mark = serializers.FloatField()
+    last_attempt = serializers.DateTimeField(source="last_attempt_at")
+    is_passed = serializers.BooleanField(source="has_passed")
+
+
 class BaseTestSerializer(serializers.ModelSerializer):
     """Базовый сериализатор для тестов с общими полями"""
 
     test_results = serializers.SerializerMethodField()
+    summary = serializers.SerializerMethodField()
+
+    def get_fields(self):
+        fields = super().get_fields()
+        # Клиент получает либо историю своих попыток, либо сводку по ним
+        fields.pop(
+            "test_results" if self.context.get("summary") else "summary"
+        )
+        return fields
 
     def get_test_results(self, obj):
         """Возвращает данные результатов теста для текущего пользователя"""
-        user = self.context["request"].user
-        user_results = [
-            result for result in getattr(obj, "all_test_results", [])
-            if result.user_id == user.id
-        ]
-        return TestResultSerializer(user_results, many=True, context=self.context).data
+        return TestResultSerializer(
+            getattr(obj, "user_test_results", []),
+            many=True,
+            context=self.context,
+        ).data
+
+    def get_summary(self, obj):
+        """Возвращает сводку попыток текущего пользователя"""
+        return TestSummarySerializer(obj).data
 
 
 class TestListSerializer(BaseTestSerializer):
@@ -599,14 +852,23 @@ class TestListSerializer(BaseTestSerializer):
             "description",
             "test_is_control",
             "test_results",
+            "summary",
         )
 
 
 class TestSerializer(BaseTestSerializer):
-    """Сериализатор для детального просмотра теста"""
+    """
+    Сериализатор для детального просмотра теста. Вопросы, проходной
+    балл и признак контрольного теста берутся из опубликованной версии
+    теста, а если тест не опубликован - из текущих данных теста.
+    """
 
     questions = serializers.SerializerMethodField()
     total_points = serializers.SerializerMethodField()
+    test_is_control = serializers.SerializerMethodField()
+    passing_score = serializers.SerializerMethodField()
+    test_version = serializers.SerializerMethodField()
+    questions_token = serializers.SerializerMethodField()
 
     class Meta:
         model = Tests
@@ -616,26 +878,52 @@ class TestSerializer(BaseTestSerializer):
             "description",
             "test_is_control",
             "passing_score",
+            "test_version",
             "total_points",
             "test_results",
+            "summary",
             "questions",
+            "questions_token",
         )
 
+    def _snapshot(self, obj):
+        """Опубликованная версия теста или None"""
+        if not hasattr(self, "_cached_snapshot"):
+            self._cached_snapshot = (
+                cached_snapshot(obj.published_snapshot_id)
+                if obj.published_snapshot_id
+                else None
+            )
+        return self._cached_snapshot
+
     def get_questions(self, obj):
-        """Метод для получения вопросов теста"""
+        """
+        Метод для получения вопросов теста: случайная выборка из
+        закэшированных вопросов без сортировки в БД
+        """
 
         if not hasattr(self, "_cached_questions"):
             limit = getattr(settings, "TEST_QUESTIONS_LIMIT")
-            questions = obj.questions.prefetch_related(
-                "answers", "reference_link"
-            ).order_by("?")[:limit]
-
-            question_context = self.context.copy()
-            question_context["test_is_control"] = obj.test_is_control
-
-            self._cached_questions = QuestionSerializer(
-                questions, many=True, context=question_context
-            ).data
+            snapshot = self._snapshot(obj)
+            if snapshot is not None:
+                pool = snapshot.questions
+                test_is_control = snapshot.test_is_control
+            else:
+                pool = cached_question_pool(
+                    obj.id, lambda: serialize_questions(obj)
+                )
+                test_is_control = obj.test_is_control
+            questions = random.sample(pool, min(limit, len(pool)))
+            if test_is_control:
+                questions = [
+                    {
+                        key: value
+                        for key, value in question.items()
+                        if key != "explanation"
+                    }
+                    for question in questions
+                ]
+            self._cached_questions = questions
 
         return self._cached_questions
 
@@ -645,6 +933,34 @@ class TestSerializer(BaseTestSerializer):
             self._cached_questions = self.get_questions(obj)
         return sum(q["points"] for q in self._cached_questions)
 
+    def get_test_is_control(self, obj):
+        snapshot = self._snapshot(obj)
+        return (
+            obj.test_is_control
+            if snapshot is None
+            else snapshot.test_is_control
+        )
+
+    def get_passing_score(self, obj):
+        snapshot = self._snapshot(obj)
+        return (
+            obj.passing_score if snapshot is None else snapshot.passing_score
+        )
+
+    def get_test_version(self, obj):
+        """Номер опубликованной версии, None - тест не опубликован"""
+        snapshot = self._snapshot(obj)
+        return None if snapshot is None else snapshot.version
+
+    def get_questions_token(self, obj):
+        """Подпись выданных вопросов, клиент возвращает её с ответами"""
+        return sign_served_questions(
+            self.context["request"].user.pk,
+            obj.id,
+            self.get_test_version(obj),
+            [question["id"] for question in self.get_questions(obj)],
+        )
+
 
 class VideoSerializer(serializers.ModelSerializer):
     class Meta:
@@ -1,15 +1,132 @@
-from django.db.models.signals import post_save
+from functools import partial
+import logging
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
-from .models import TestResult, InstructionResult
+from .models import (
+    Answer,
+    Badge,
+    FaceTemplate,
+    InstructionResult,
+    Position,
+    Question,
+    Rank,
+    ReferenceLink,
+    TestResult,
+    Tests,
+    User,
+)
+from .tasks import send_result_notification
+from .utils.face_index import face_index, record_face_index_change
+from .utils.question_pools import invalidate_question_pools
+from .utils.thresholds import invalidate_threshold_tables
+
+logger = logging.getLogger(__name__)
+
+
+def _send_result_notification_task(notification_id):
+    try:
+        send_result_notification.apply_async((notification_id,), retry=False)
+    except Exception as e:
+        logger.error(
+            f"Не удалось запустить send_result_notification: {str(e)}"
+        )
+
+
+def _schedule_result_notification(notification):
+    """Отправляет уведомление в Telegram задачей Celery после коммита."""
+    if notification is not None:
+        transaction.on_commit(
+            partial(_send_result_notification_task, notification.pk)
+        )
 
 
 @receiver(post_save, sender=TestResult)
 def handle_test_result(sender, instance, created, **kwargs):
     if created:
-        instance.create_notification()
+        _schedule_result_notification(instance.create_notification())
 
 
 @receiver(post_save, sender=InstructionResult)
 def handle_instruction_result(sender, instance, created, **kwargs):
     if created:
-        instance.create_notification()
+        _schedule_result_notification(instance.create_notification())
+
+
+@receiver(post_save, sender=User)
+def handle_user_face_descriptor(
+    sender, instance, created, update_fields, **kwargs
+):
+    if update_fields is not None and not {
+        "face_descriptor",
+        "face_descriptor_blob",
+        "face_descriptor_key_id",
+        "position",
+    } & set(update_fields):
+        return
+    if not instance.face_index_changed:
+        return
+    if created and not instance.stored_face_descriptor:
+        return
+
+    # Индекс процесса меняется только после коммита, иначе при откате
+    # он разошёлся бы с БД
+    transaction.on_commit(
+        partial(
+            face_index.update_user,
+            instance.pk,
+            instance.stored_face_descriptor,
+            instance.position_id,
+            instance.face_descriptor_key_id,
+        )
+    )
+    record_face_index_change(instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def handle_user_delete(sender, instance, **kwargs):
+    transaction.on_commit(partial(face_index.remove_user, instance.pk))
+    if instance.stored_face_descriptor:
+        record_face_index_change(instance.pk)
+
+
+@receiver(post_save, sender=FaceTemplate)
+@receiver(post_delete, sender=FaceTemplate)
+def handle_face_template(sender, instance, **kwargs):
+    user = User.objects.filter(pk=instance.user_id).first()
+    if user is None:
+        return
+    transaction.on_commit(
+        partial(
+            face_index.update_user,
+            user.pk,
+            user.stored_face_descriptor,
+            user.position_id,
+            user.face_descriptor_key_id,
+        )
+    )
+    record_face_index_change(user.pk)
+
+
+@receiver(post_save, sender=Rank)
+@receiver(post_delete, sender=Rank)
+@receiver(post_save, sender=Badge)
+@receiver(post_delete, sender=Badge)
+# Удаление должности обнуляет position у званий и значков запросом
+# UPDATE, без сигналов Rank и Badge
+@receiver(post_delete, sender=Position)
+def handle_threshold_change(sender, **kwargs):
+    transaction.on_commit(invalidate_threshold_tables)
+
+
+@receiver(post_save, sender=Tests)
+@receiver(post_delete, sender=Tests)
+@receiver(post_save, sender=Question)
+@receiver(post_delete, sender=Question)
+@receiver(post_save, sender=Answer)
+@receiver(post_delete, sender=Answer)
+@receiver(post_save, sender=ReferenceLink)
+@receiver(post_delete, sender=ReferenceLink)
+def handle_question_change(sender, **kwargs):
+    transaction.on_commit(invalidate_question_pools)
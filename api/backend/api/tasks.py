@@ -7,8 +7,21 @@ from django.conf import settings
 import logging
 from telegram import Bot
 
-from .models import DutySchedule, User
-from backend.constants import POWER_OF_USER
+from .models import (
+    DutySchedule,
+    FaceIndexChange,
+    FaceMatchAttempt,
+    Notification,
+    User,
+)
+from .utils.face_index import save_snapshot
+from .utils.leaderboard import refresh_daily_rollups
+from backend.constants import (
+    FACE_INDEX_CHANGES_RETENTION_DAYS,
+    FACE_MATCH_ATTEMPTS_RETENTION_DAYS,
+    FACE_TELEMETRY_MAX_ROWS,
+    POWER_OF_USER,
+)
 
 
 logger = logging.getLogger(__name__)
@@ -65,6 +78,76 @@ def send_game_notification():
         logger.error(f"Ошибка отправки уведомления пользователю {str(e)}")
 
 
+@shared_task(expires=3600)
+def send_result_notification(notification_id):
+    """Отправка руководителю уведомления о результате теста или инструктажа"""
+    notification = (
+        Notification.objects.select_related(
+            "user",
+            "employee__current_rank",
+            "test_result__test",
+            "instruction_result__instruction",
+        )
+        .filter(pk=notification_id, is_sent=False)
+        .first()
+    )
+    if notification is not None:
+        notification.send_notification()
+
+
+@shared_task
+def prune_face_index_changes():
+    """Удаление устаревших записей журнала изменений индекса лиц"""
+    deleted, _ = FaceIndexChange.objects.filter(
+        created_at__lt=timezone.now()
+        - timedelta(days=FACE_INDEX_CHANGES_RETENTION_DAYS)
+    ).delete()
+    logger.info(f"Удалено записей журнала индекса лиц: {deleted}")
+
+
+@shared_task
+def prune_face_match_attempts():
+    """
+    Удаление телеметрии старше FACE_MATCH_ATTEMPTS_RETENTION_DAYS
+    и сверх последних FACE_TELEMETRY_MAX_ROWS записей
+    """
+    deleted, _ = FaceMatchAttempt.objects.filter(
+        created_at__lt=timezone.now()
+        - timedelta(days=FACE_MATCH_ATTEMPTS_RETENTION_DAYS)
+    ).delete()
+    boundary = (
+        FaceMatchAttempt.objects.order_by("-id")
+        .values_list("id", flat=True)[FACE_TELEMETRY_MAX_ROWS:]
+        .first()
+    )
+    if boundary is not None:
+        overflow = FaceMatchAttempt.objects.filter(id__lte=boundary)
+        deleted += overflow.delete()[0]
+    logger.info(f"Удалено записей телеметрии сравнения лиц: {deleted}")
+
+
+@shared_task(expires=600)
+def rollup_experience_points():
+    """Свёртка начислений очков опыта за вчера и сегодня по дням"""
+    today = timezone.localdate()
+    # Вчерашний день пересчитывается, чтобы учесть начисления,
+    # закоммиченные после полуночи
+    count = refresh_daily_rollups(today - timedelta(days=1), today)
+    logger.info(f"Обновлено дневных свёрток очков опыта: {count}")
+
+
+@shared_task(expires=600)
+def build_face_snapshot():
+    """Пересборка общего снапшота индекса лиц для воркеров"""
+    try:
+        version = save_snapshot()
+        if version:
+            logger.info(f"Снапшот индекса лиц обновлён до версии {version}")
+    except Exception as e:
+        logger.error(f"Ошибка в задаче build_face_snapshot: {str(e)}")
+        raise
+
+
 async def _send_message(message: str, telegram_chat_id: str):
     """Асинхронная отправка сообщения в Telegram"""
     try:
@@ -0,0 +1,413 @@
+import base64
+from io import StringIO
+import os
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+import numpy as np
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from api.management.commands.rebuild_experience_points import (
+    Command as RebuildCommand,
+)
+from api.models import (
+    Answer,
+    ExperienceEvent,
+    Position,
+    Question,
+    Rank,
+    TestResult,
+    Tests,
+    User,
+)
+from api.utils.crypto import current_storage_key, seal_descriptor
+from api.utils.face_index import FaceIndex
+from api.utils.leaderboard import Board, Leaderboard
+from api.utils.transport_keys import (
+    TransportKeyError,
+    issue_transport_key,
+    use_transport_key,
+)
+
+
+@override_settings(TEST_QUESTIONS_LIMIT=3)
+class TestResultGradingTests(TestCase):
+    """Проверка результатов тестирования на сервере."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email="worker@example.com",
+            password="password",
+            first_name="Иван",
+            last_name="Иванов",
+        )
+        cls.test = Tests.objects.create(
+            name="Тест",
+            description="Описание",
+            test_is_control=True,
+            passing_score=60,
+        )
+        cls.answers = []
+        for number in range(4):
+            question = Question.objects.create(
+                tests=cls.test, name=f"Вопрос {number}", points=1
+            )
+            right = Answer.objects.create(
+                question=question, name="Да", is_correct=True, points=1
+            )
+            wrong = Answer.objects.create(
+                question=question, name="Нет", is_correct=False, points=0
+            )
+            cls.answers.append((question, right, wrong))
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.choices = {
+            question.id: (right, wrong)
+            for question, right, wrong in self.answers
+        }
+
+    def serve(self):
+        response = self.client.get(
+            reverse("tests-detail", args=[self.test.id])
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return (
+            [question["id"] for question in response.data["questions"]],
+            response.data["questions_token"],
+        )
+
+    def submit(self, user_answers, token):
+        now = timezone.now().isoformat()
+        return self.client.post(
+            reverse("test_results"),
+            {
+                "test": self.test.id,
+                "mark": 10,
+                "is_passed": True,
+                "score": 100,
+                "total_points": 1,
+                "start_time": now,
+                "completion_time": now,
+                "test_duration": 60,
+                "user_answers": user_answers,
+                "questions_token": token,
+            },
+            format="json",
+        )
+
+    def answer(self, question_id, correct=True):
+        right, wrong = self.choices[question_id]
+        return {
+            "id": question_id,
+            "selected_id": (right if correct else wrong).id,
+        }
+
+    def test_all_served_questions_are_graded(self):
+        served, token = self.serve()
+        response = self.submit(
+            [
+                self.answer(served[0]),
+                self.answer(served[1]),
+                self.answer(served[2], correct=False),
+            ],
+            token,
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["score"], 2)
+        self.assertEqual(response.data["total_points"], 3)
+        self.assertEqual(response.data["mark"], 7)
+        self.assertTrue(response.data["is_passed"])
+
+    def test_answer_change_is_graded_after_commit(self):
+        served, token = self.serve()
+        right, wrong = self.choices[served[0]]
+        with self.captureOnCommitCallbacks(execute=True):
+            right.is_correct, wrong.is_correct = False, True
+            right.save()
+            wrong.save()
+
+        response = self.submit(
+            [self.answer(question_id) for question_id in served], token
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["score"], 2)
+
+    def test_subset_of_questions_is_rejected(self):
+        served, token = self.serve()
+        response = self.submit(
+            [self.answer(question_id) for question_id in served[:2]], token
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("user_answers", response.data)
+        self.assertFalse(TestResult.objects.exists())
+
+    def test_empty_answers_are_rejected(self):
+        _, token = self.serve()
+        response = self.submit([], token)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(TestResult.objects.exists())
+
+    def test_duplicate_selections_are_rejected(self):
+        served, token = self.serve()
+        response = self.submit(
+            [self.answer(question_id) for question_id in served]
+            + [self.answer(served[0])],
+            token,
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(TestResult.objects.exists())
+
+    def test_questions_not_served_are_rejected(self):
+        served, token = self.serve()
+        not_served = (set(self.choices) - set(served)).pop()
+        response = self.submit(
+            [self.answer(question_id) for question_id in served[1:]]
+            + [self.answer(not_served)],
+            token,
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(TestResult.objects.exists())
+
+    def test_forged_token_is_rejected(self):
+        served, token = self.serve()
+        response = self.submit(
+            [self.answer(question_id) for question_id in served],
+            token[:-1] + ("A" if token[-1] != "A" else "B"),
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("questions_token", response.data)
+
+
+class ThresholdTableTests(TestCase):
+    """Сброс кэшированных таблиц порогов званий."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.position = Position.objects.create(name="Монтажник")
+        cls.common = Rank.objects.create(name="Новичок", required_points=0)
+
+    def setUp(self):
+        # Таблицы, закэшированные другими тестами, строились по их данным
+        cache.clear()
+
+    def test_rank_change_resets_table_after_commit(self):
+        self.assertEqual(
+            Rank.threshold_table(self.position.pk).ids, (self.common.pk,)
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            rank = Rank.objects.create(
+                name="Мастер", required_points=100, position=self.position
+            )
+
+        table = Rank.threshold_table(self.position.pk)
+        self.assertEqual(table.ids, (self.common.pk, rank.pk))
+        self.assertEqual(table.reached(99), (self.common.pk,))
+
+    def test_position_delete_resets_table(self):
+        rank = Rank.objects.create(
+            name="Мастер", required_points=100, position=self.position
+        )
+        self.assertEqual(Rank.threshold_table(None).ids, (self.common.pk,))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.position.delete()
+
+        self.assertEqual(
+            Rank.threshold_table(None).ids, (self.common.pk, rank.pk)
+        )
+
+
+def create_user(email, **fields):
+    return User.objects.create_user(
+        email=email,
+        password="password",
+        first_name="Иван",
+        last_name="Иванов",
+        **fields,
+    )
+
+
+class FaceIndexTests(TestCase):
+    """Точечные изменения индекса лиц и поиск по нему."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.rng = np.random.default_rng(0)
+        cls.first = cls.enroll(create_user("first@example.com"))
+        cls.second = cls.enroll(create_user("second@example.com"))
+
+    @classmethod
+    def descriptor(cls):
+        """Случайные единичные векторы далеки друг от друга (~1.41)."""
+        vector = cls.rng.standard_normal(128)
+        return (vector / np.linalg.norm(vector)).astype(np.float32)
+
+    @classmethod
+    def enroll(cls, user):
+        key_id, key = current_storage_key()
+        descriptor = cls.descriptor()
+        user.face_descriptor_blob = seal_descriptor(descriptor, key)
+        user.face_descriptor_key_id = key_id
+        user.save()
+        user.descriptor = descriptor
+        return user
+
+    def setUp(self):
+        cache.clear()
+        self.index = FaceIndex()
+        self.index.build()
+
+    def update(self, user):
+        self.index.update_user(
+            user.pk,
+            user.stored_face_descriptor,
+            user.position_id,
+            user.face_descriptor_key_id,
+        )
+
+    def test_search_finds_enrolled_users(self):
+        self.assertEqual(len(self.index), 2)
+        for user in (self.first, self.second):
+            match = self.index.search(user.descriptor + 0.01)
+            self.assertEqual(match.user_id, user.pk)
+        self.assertIsNone(self.index.search(self.descriptor()))
+
+    def test_added_user_is_found(self):
+        third = self.enroll(create_user("third@example.com"))
+        self.update(third)
+
+        self.assertEqual(len(self.index), 3)
+        self.assertEqual(self.index.search(third.descriptor).user_id, third.pk)
+
+    def test_updated_descriptor_replaces_old_one(self):
+        old = self.first.descriptor
+        user = self.enroll(User.objects.get(pk=self.first.pk))
+        self.update(user)
+
+        self.assertEqual(len(self.index), 2)
+        self.assertEqual(self.index.search(user.descriptor).user_id, user.pk)
+        self.assertIsNone(self.index.search(old))
+
+    def test_removed_user_is_not_found(self):
+        descriptor = self.second.descriptor
+        User.objects.filter(pk=self.second.pk).delete()
+        self.index.remove_user(self.second.pk)
+
+        self.assertEqual(len(self.index), 1)
+        self.assertIsNone(self.index.search(descriptor))
+        self.assertEqual(
+            self.index.search(self.first.descriptor).user_id, self.first.pk
+        )
+
+
+class TransportKeyTests(TestCase):
+    """Повтор дескриптора с сессионным ключом киоска."""
+
+    def setUp(self):
+        cache.clear()
+        self.key_id, _, _ = issue_transport_key(session=True)
+        self.iv = base64.b64encode(os.urandom(12)).decode()
+
+    def test_repeated_iv_is_rejected(self):
+        use_transport_key(self.key_id, [{"iv": self.iv}])
+        with self.assertRaises(TransportKeyError):
+            use_transport_key(self.key_id, [{"iv": self.iv}])
+
+    def test_iv_written_differently_is_rejected(self):
+        use_transport_key(self.key_id, [{"iv": self.iv}])
+        with self.assertRaises(TransportKeyError):
+            use_transport_key(
+                self.key_id, [{"iv": f"{self.iv[:8]}\n{self.iv[8:]}"}]
+            )
+
+    def test_malformed_iv_is_rejected(self):
+        with self.assertRaises(TransportKeyError):
+            use_transport_key(self.key_id, [{"iv": "не base64"}])
+
+
+class RebuildExperiencePointsTests(TestCase):
+    """Пересчёт очков опыта по журналу начислений."""
+
+    def setUp(self):
+        self.user = create_user("worker@example.com")
+        self.user.award_experience(30, ExperienceEvent.Source.MANUAL)
+        # Расхождение со времён начислений без журнала
+        User.objects.filter(pk=self.user.pk).update(experience_points=5)
+
+    def rebuild(self):
+        call_command("rebuild_experience_points", stdout=StringIO())
+        self.user.refresh_from_db()
+
+    def test_award_during_rebuild_is_kept(self):
+        correct_chunk = RebuildCommand.correct_chunk
+
+        def award_first(command, chunk):
+            # Начисление закоммичено после чтения id пачки
+            User.objects.get(pk=self.user.pk).award_experience(
+                10, ExperienceEvent.Source.MANUAL
+            )
+            return correct_chunk(command, chunk)
+
+        with mock.patch.object(RebuildCommand, "correct_chunk", award_first):
+            self.rebuild()
+
+        self.assertEqual(self.user.experience_points, 40)
+
+    def test_leaderboard_sees_correction(self):
+        board = Leaderboard()
+        self.assertEqual(board.ranked().points[self.user.pk], 5)
+
+        self.rebuild()
+
+        self.assertEqual(self.user.experience_points, 30)
+        self.assertEqual(board.ranked().points[self.user.pk], 30)
+        self.assertTrue(
+            ExperienceEvent.objects.filter(
+                user=self.user, source=ExperienceEvent.Source.REBUILD
+            ).exists()
+        )
+
+
+class LeaderboardTieTests(TestCase):
+    """Места в таблице лидеров при равных очках."""
+
+    def setUp(self):
+        self.board = Board.from_rows([4, 3, 2, 1], [30, 50, 30, 10])
+
+    def test_equal_points_share_rank(self):
+        self.assertEqual(
+            self.board.window(0, 4),
+            [(1, 3, 50), (2, 2, 30), (2, 4, 30), (4, 1, 10)],
+        )
+
+    def test_standing_among_ties(self):
+        standing = self.board.standing(4, 30, radius=1)
+
+        self.assertEqual(standing.rank, 2)
+        self.assertEqual(standing.total, 4)
+        self.assertEqual(
+            standing.neighbours, [(2, 2, 30), (2, 4, 30), (4, 1, 10)]
+        )
+
+    def test_insert_and_remove_keep_ties(self):
+        self.board.insert(5, 30)
+        self.board.remove(3, 50)
+
+        self.assertEqual(
+            self.board.window(0, 4),
+            [(1, 2, 30), (1, 4, 30), (1, 5, 30), (4, 1, 10)],
+        )
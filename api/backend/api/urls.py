@@ -6,6 +6,8 @@ from rest_framework.routers import DefaultRouter
 from api.views import (
     InstructionViewSet,
     FaceLoginView,
+    FaceTemplateView,
+    KioskFaceBatchView,
     UserViewSet,
     TestViewSet,
     SignUpView,
@@ -40,12 +42,18 @@ auth_urls = [
     path("signup/", SignUpView.as_view(), name="signup"),
     path("login/", LoginView.as_view(), name="login"),
     path("face_login/", FaceLoginView.as_view(), name="face_login"),
+    path("face_templates/", FaceTemplateView.as_view(), name="face_templates"),
     path("logout/", LogoutView.as_view(), name="logout"),
 ]
 
 urlpatterns = [
     path("auth/", include(auth_urls)),
     path("generate_key/", GenerateAESKeyView.as_view(), name="generate_key"),
+    path(
+        "kiosk/face_batch/",
+        KioskFaceBatchView.as_view(),
+        name="kiosk_face_batch",
+    ),
     path(
         "instruction_results/",
         InstructionResultView.as_view(),
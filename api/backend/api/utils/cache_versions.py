@@ -0,0 +1,23 @@
+import time
+
+from django.core.cache import cache
+
+
+def current_version(key):
+    """
+    Версия группы значений в кэше. Входит в ключи значений группы,
+    поэтому bump_version сбрасывает их все сразу. Версия хранится
+    в общем кэше, чтобы сброс был виден всем воркерам (проверка
+    api.E001).
+    """
+    return cache.get_or_set(key, time.time_ns, timeout=None)
+
+
+def bump_version(key):
+    """Сбрасывает все значения группы."""
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Счётчик вытеснен: начинаем с момента времени, чтобы не
+        # вернуться к версии уже закэшированных значений
+        cache.set(key, time.time_ns(), timeout=None)
@@ -0,0 +1,148 @@
+import base64
+import json
+import os
+
+from Crypto.Cipher import AES
+from django.conf import settings
+import numpy as np
+
+from backend.constants import MAX_LENGTH_FACE_DESCRIPTOR
+
+# Идентификатор ключа дескрипторов, сохранённых без key id
+DEFAULT_KEY_ID = "default"
+
+# Двоичный формат хранения: версия | nonce | tag | шифротекст
+# 128 float32 little-endian. Байт версии аутентифицируется как AAD.
+DESCRIPTOR_FORMAT_VERSION = 1
+NONCE_SIZE = 12
+TAG_SIZE = 16
+DESCRIPTOR_DTYPE = np.dtype("<f4")
+DESCRIPTOR_BYTES = MAX_LENGTH_FACE_DESCRIPTOR * DESCRIPTOR_DTYPE.itemsize
+SEALED_DESCRIPTOR_BYTES = 1 + NONCE_SIZE + TAG_SIZE + DESCRIPTOR_BYTES
+
+
+def decrypt_descriptor(encrypted_data, key):
+    """Дешифрует дескриптор лица (двоичный или устаревший JSON-формат)"""
+    if isinstance(encrypted_data, (bytes, bytearray, memoryview)):
+        return open_descriptor(encrypted_data, key)
+    try:
+        iv = base64.b64decode(encrypted_data["iv"])
+        ciphertext = base64.b64decode(encrypted_data["ciphertext"])
+        tag = base64.b64decode(encrypted_data["tag"])
+
+        cipher = AES.new(key, AES.MODE_GCM, nonce=iv)
+        decrypted = cipher.decrypt_and_verify(ciphertext, tag)
+        return json.loads(decrypted.decode("utf-8"))
+    except Exception as e:
+        raise ValueError(f"Ошибка дешифрования: {str(e)}")
+
+
+def encrypt_descriptor(descriptor, key):
+    """Шифрует дескриптор лица для хранения"""
+    try:
+        descriptor_json = json.dumps(
+            descriptor.tolist()
+            if isinstance(descriptor, np.ndarray)
+            else descriptor
+        )
+
+        cipher = AES.new(key, AES.MODE_GCM)
+        ciphertext, tag = cipher.encrypt_and_digest(
+            descriptor_json.encode("utf-8")
+        )
+
+        return {
+            "iv": base64.b64encode(cipher.nonce).decode("utf-8"),
+            "ciphertext": base64.b64encode(ciphertext).decode("utf-8"),
+            "tag": base64.b64encode(tag).decode("utf-8"),
+        }
+    except Exception as e:
+        raise ValueError(f"Ошибка шифрования: {str(e)}")
+
+
+def seal_descriptor(descriptor, key):
+    """
+    Шифрует дескриптор лица в двоичный формат хранения
+    :param descriptor: numpy array или список из 128 чисел
+    :return: bytes длиной SEALED_DESCRIPTOR_BYTES
+    """
+    try:
+        plaintext = np.asarray(descriptor, dtype=DESCRIPTOR_DTYPE).tobytes()
+        if len(plaintext) != DESCRIPTOR_BYTES:
+            raise ValueError("Дескриптор лица должен содержать 128 элементов")
+
+        header = bytes((DESCRIPTOR_FORMAT_VERSION,))
+        cipher = AES.new(key, AES.MODE_GCM, nonce=os.urandom(NONCE_SIZE))
+        cipher.update(header)
+        ciphertext, tag = cipher.encrypt_and_digest(plaintext)
+        return header + cipher.nonce + tag + ciphertext
+    except Exception as e:
+        raise ValueError(f"Ошибка шифрования: {str(e)}")
+
+
+def open_descriptor(sealed, key):
+    """
+    Дешифрует дескриптор лица из двоичного формата хранения
+    :return: numpy array float32
+    """
+    try:
+        sealed = bytes(sealed)
+        if len(sealed) != SEALED_DESCRIPTOR_BYTES:
+            raise ValueError("неверная длина")
+        if sealed[0] != DESCRIPTOR_FORMAT_VERSION:
+            raise ValueError(f"неизвестная версия формата {sealed[0]}")
+
+        nonce = sealed[1 : 1 + NONCE_SIZE]
+        tag = sealed[1 + NONCE_SIZE : 1 + NONCE_SIZE + TAG_SIZE]
+        ciphertext = sealed[1 + NONCE_SIZE + TAG_SIZE :]
+
+        cipher = AES.new(key, AES.MODE_GCM, nonce=nonce)
+        cipher.update(sealed[:1])
+        plaintext = cipher.decrypt_and_verify(ciphertext, tag)
+        return np.frombuffer(plaintext, dtype=DESCRIPTOR_DTYPE).astype(
+            np.float32
+        )
+    except Exception as e:
+        raise ValueError(f"Ошибка дешифрования: {str(e)}")
+
+
+def get_storage_key(key_id=None):
+    """
+    Ключ хранения дескрипторов по идентификатору
+    :param key_id: User.face_descriptor_key_id, None - ключ DEFAULT_KEY_ID
+    """
+    key_id = key_id or DEFAULT_KEY_ID
+    try:
+        return settings.AES_STORAGE_KEYS[key_id]
+    except KeyError:
+        raise ValueError(f"Неизвестный ключ шифрования дескрипторов: {key_id}")
+
+
+def current_storage_key():
+    """
+    Ключ, которым шифруются новые дескрипторы
+    :return: (key_id, key)
+    """
+    key_id = settings.AES_STORAGE_KEY_ID
+    return key_id, get_storage_key(key_id)
+
+
+def open_stored_descriptor(stored_value, key):
+    """
+    Дешифрует сохранённый дескриптор заданным ключом
+    :param stored_value: bytes в двоичном формате или JSON-строка
+        устаревшего формата из User.face_descriptor
+    :return: numpy array float32
+    """
+    if isinstance(stored_value, str):
+        stored_value = json.loads(stored_value)
+    return np.array(decrypt_descriptor(stored_value, key), dtype=np.float32)
+
+
+def decrypt_stored_descriptor(stored_value, key_id=None):
+    """
+    Дешифрует дескриптор, сохранённый у пользователя
+    :param key_id: идентификатор ключа, которым зашифрован дескриптор
+    :return: numpy array float32
+    """
+    return open_stored_descriptor(stored_value, get_storage_key(key_id))
@@ -0,0 +1,891 @@
+from collections import defaultdict
+from datetime import timedelta
+import hashlib
+import logging
+import threading
+import time
+from typing import NamedTuple, Optional
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Count, Max, Q
+from django.utils import timezone
+import numpy as np
+
+from api.models import FaceIndexChange, FaceTemplate, User
+from api.utils.crypto import decrypt_stored_descriptor
+from api.utils.face_search import get_backend, squared_distances
+from api.utils.face_snapshot import load_snapshot, read_current, write_snapshot
+from backend.constants import (
+    FACE_INDEX_CHANGE_LAG_SECONDS,
+    MAX_LENGTH_FACE_DESCRIPTOR,
+)
+
+logger = logging.getLogger(__name__)
+
+DIGEST_SIZE = 16
+# Значение position_ids для пользователей без должности
+NO_POSITION = -1
+# Счётчик изменений индекса лиц в кэше
+FACE_INDEX_VERSION_KEY = "face_index_version"
+
+
+class FaceMatch(NamedTuple):
+    """Результат поиска ближайшего дескриптора."""
+
+    user_id: int
+    distance: float
+
+
+class FaceSearchResult(NamedTuple):
+    """Результат поиска вместе с данными для телеметрии."""
+
+    match: Optional[FaceMatch]
+    best_distance: Optional[float]
+    second_distance: Optional[float]
+    candidates: int
+
+
+class UserEntry(NamedTuple):
+    """Строка пользователя в индексе."""
+
+    centroid: np.ndarray
+    # Наибольшее расстояние от центроида до шаблона пользователя
+    radius: float
+    # Все дескрипторы пользователя, None при единственном дескрипторе
+    templates: Optional[np.ndarray]
+    digest: bytes
+
+
+class DescriptorSet(NamedTuple):
+    """
+    Расшифрованные дескрипторы всех пользователей: по строке-центроиду
+    на пользователя и шаблоны пользователей с несколькими дескрипторами.
+    """
+
+    change_version: int
+    user_ids: np.ndarray
+    descriptors: np.ndarray
+    digests: np.ndarray
+    position_ids: np.ndarray
+    radii: np.ndarray
+    templates: np.ndarray
+    template_owners: np.ndarray
+
+
+class TemplateSet(NamedTuple):
+    """
+    Все сохранённые дескрипторы пользователей без усреднения: строка на
+    основной дескриптор и на каждый дополнительный шаблон.
+    """
+
+    user_ids: np.ndarray
+    descriptors: np.ndarray
+
+
+def enrolled_users():
+    return User.objects.filter(
+        Q(face_descriptor_blob__isnull=False)
+        | Q(face_descriptor__isnull=False)
+    )
+
+
+def stored_descriptors(queryset):
+    """
+    Читает сохранённые дескрипторы пользователей
+    :return: итератор (user_id, stored_value, key_id, position_id)
+    """
+    queryset = queryset.values_list(
+        "id",
+        "face_descriptor_blob",
+        "face_descriptor",
+        "face_descriptor_key_id",
+        "position_id",
+    )
+    for (
+        user_id,
+        blob,
+        legacy_value,
+        key_id,
+        position_id,
+    ) in queryset.iterator(chunk_size=2000):
+        stored_value = bytes(blob) if blob is not None else legacy_value
+        yield user_id, stored_value, key_id, position_id
+
+
+def latest_change_version():
+    return FaceIndexChange.objects.aggregate(last=Max("id"))["last"] or 0
+
+
+def _bump_change_version():
+    try:
+        caches["default"].incr(FACE_INDEX_VERSION_KEY)
+    except ValueError:
+        # Счётчик вытеснен или ещё не создан: начинаем с момента времени,
+        # чтобы новое значение не совпало с уже виденным воркерами
+        caches["default"].add(
+            FACE_INDEX_VERSION_KEY, time.time_ns(), timeout=None
+        )
+
+
+def record_face_index_change(user_id):
+    """
+    Записывает изменение пользователя в журнал индекса лиц и после
+    коммита увеличивает счётчик изменений в кэше.
+    """
+    FaceIndexChange.objects.create(user_id=user_id)
+    transaction.on_commit(_bump_change_version)
+
+
+def record_face_index_changes(user_ids):
+    """Записывает изменения нескольких пользователей одним запросом."""
+    changes = [FaceIndexChange(user_id=user_id) for user_id in user_ids]
+    if changes:
+        FaceIndexChange.objects.bulk_create(changes)
+        transaction.on_commit(_bump_change_version)
+
+
+def replace_stored_descriptors(rows, key_id):
+    """
+    Заменяет сохранённые дескрипторы пользователей, если они не
+    изменились после чтения: иначе пользователь, заново
+    зарегистрировавший лицо во время замены, получил бы прежний
+    дескриптор. Замены записываются в журнал индекса лиц.
+    :param rows: список (user_id, прежнее stored_value, прежний key_id,
+        новый blob)
+    :param key_id: идентификатор ключа, которым зашифрован новый blob
+    :return: количество пропущенных пользователей
+    """
+    written = []
+    with transaction.atomic():
+        for user_id, old_value, old_key_id, blob in rows:
+            if isinstance(old_value, bytes):
+                unchanged = Q(face_descriptor_blob=old_value)
+            else:
+                unchanged = Q(
+                    face_descriptor_blob__isnull=True,
+                    face_descriptor=old_value,
+                )
+            # update не отправляет post_save, поэтому изменения
+            # записываются в журнал индекса лиц явно
+            if User.objects.filter(
+                unchanged, pk=user_id, face_descriptor_key_id=old_key_id
+            ).update(
+                face_descriptor_blob=blob,
+                face_descriptor=None,
+                face_descriptor_key_id=key_id,
+            ):
+                written.append(user_id)
+        record_face_index_changes(written)
+    return len(rows) - len(written)
+
+
+def current_change_token():
+    """
+    Признак появления новых записей в журнале изменений: счётчик в общем
+    кэше, а если он вытеснен или ещё не создан - сводка самого журнала.
+    """
+    version = caches["default"].get(FACE_INDEX_VERSION_KEY)
+    if version is not None:
+        return version
+    stats = FaceIndexChange.objects.aggregate(
+        total=Count("id"), last=Max("id")
+    )
+    return stats["total"], stats["last"]
+
+
+def stored_templates(user_ids=None):
+    """
+    Читает дополнительные шаблоны лиц
+    :param user_ids: id пользователей, None - все пользователи
+    :return: dict user_id -> список (blob, key_id) в порядке добавления
+    """
+    queryset = FaceTemplate.objects.order_by("id")
+    if user_ids is not None:
+        queryset = queryset.filter(user_id__in=user_ids)
+    templates = defaultdict(list)
+    for user_id, blob, key_id in queryset.values_list(
+        "user_id", "descriptor_blob", "key_id"
+    ).iterator(chunk_size=2000):
+        templates[user_id].append((bytes(blob), key_id))
+    return templates
+
+
+def source_digest(stored_value, position_id, extra_templates=()):
+    """Отпечаток данных пользователя, по которым построена строка."""
+    if isinstance(stored_value, str):
+        stored_value = stored_value.encode()
+    digest = hashlib.blake2b(
+        f"{position_id}:".encode() + bytes(stored_value),
+        digest_size=DIGEST_SIZE,
+    )
+    for blob, _ in extra_templates:
+        digest.update(blob)
+    return digest.digest()
+
+
+def decrypt_user_descriptor(user_id, stored_value, key_id=None):
+    """Дешифрует дескриптор пользователя, None при ошибке."""
+    try:
+        descriptor = decrypt_stored_descriptor(stored_value, key_id)
+    except Exception as e:
+        logger.error(
+            f"Ошибка обработки дескриптора лица пользователя "
+            f"{user_id}: {str(e)}"
+        )
+        return None
+    if descriptor.shape != (MAX_LENGTH_FACE_DESCRIPTOR,):
+        return None
+    return descriptor
+
+
+def user_entry(user_id, stored_value, key_id, position_id, extra_templates):
+    """
+    Дешифрует дескрипторы пользователя и считает его центроид
+    :param extra_templates: список (blob, key_id) из stored_templates
+    :return: UserEntry или None, если основной дескриптор не читается
+    """
+    descriptor = decrypt_user_descriptor(user_id, stored_value, key_id)
+    if descriptor is None:
+        return None
+    digest = source_digest(stored_value, position_id, extra_templates)
+
+    templates = [descriptor]
+    for blob, template_key_id in extra_templates:
+        template = decrypt_user_descriptor(user_id, blob, template_key_id)
+        if template is not None:
+            templates.append(template)
+    if len(templates) == 1:
+        return UserEntry(descriptor, 0.0, None, digest)
+
+    templates = np.stack(templates)
+    centroid = templates.mean(axis=0)
+    radius = float(np.linalg.norm(templates - centroid, axis=1).max())
+    return UserEntry(centroid, radius, templates, digest)
+
+
+def _stack(rows):
+    matrix = np.empty(
+        (len(rows), MAX_LENGTH_FACE_DESCRIPTOR), dtype=np.float32
+    )
+    if rows:
+        np.stack(rows, out=matrix)
+    return matrix
+
+
+def load_descriptors():
+    """
+    Дешифрует дескрипторы всех пользователей из БД для индекса
+    распознавания: у пользователя с несколькими шаблонами строка индекса -
+    их центроид. Для анализа отдельных шаблонов - load_templates.
+    """
+    # Версия берётся до чтения пользователей: изменения, попавшие
+    # в чтение, будут применены повторно, что безопасно.
+    change_version = latest_change_version()
+    user_ids, rows, digests, position_ids, radii = [], [], [], [], []
+    templates, template_owners = [], []
+
+    extra_templates = stored_templates()
+    for user_id, stored_value, key_id, position_id in stored_descriptors(
+        enrolled_users()
+    ):
+        entry = user_entry(
+            user_id,
+            stored_value,
+            key_id,
+            position_id,
+            extra_templates.get(user_id, ()),
+        )
+        if entry is None:
+            continue
+        user_ids.append(user_id)
+        rows.append(entry.centroid)
+        digests.append(entry.digest)
+        position_ids.append(
+            NO_POSITION if position_id is None else position_id
+        )
+        radii.append(entry.radius)
+        if entry.templates is not None:
+            templates.extend(entry.templates)
+            template_owners.extend([user_id] * len(entry.templates))
+
+    return DescriptorSet(
+        change_version=change_version,
+        user_ids=np.array(user_ids, dtype=np.int64),
+        descriptors=_stack(rows),
+        digests=np.array(digests, dtype=f"S{DIGEST_SIZE}"),
+        position_ids=np.array(position_ids, dtype=np.int64),
+        radii=np.array(radii, dtype=np.float32),
+        templates=_stack(templates),
+        template_owners=np.array(template_owners, dtype=np.int64),
+    )
+
+
+def load_templates():
+    """Дешифрует основные дескрипторы и шаблоны всех пользователей."""
+    user_ids, rows = [], []
+    extra_templates = stored_templates()
+    for user_id, stored_value, key_id, _ in stored_descriptors(
+        enrolled_users()
+    ):
+        descriptor = decrypt_user_descriptor(user_id, stored_value, key_id)
+        if descriptor is None:
+            continue
+        user_ids.append(user_id)
+        rows.append(descriptor)
+        for blob, template_key_id in extra_templates.get(user_id, ()):
+            template = decrypt_user_descriptor(user_id, blob, template_key_id)
+            if template is not None:
+                user_ids.append(user_id)
+                rows.append(template)
+    return TemplateSet(
+        user_ids=np.array(user_ids, dtype=np.int64),
+        descriptors=_stack(rows),
+    )
+
+
+def group_templates(templates, template_owners):
+    """Раскладывает строки шаблонов по пользователям."""
+    if not len(template_owners):
+        return {}
+    order = np.argsort(template_owners, kind="stable")
+    owners, starts = np.unique(template_owners[order], return_index=True)
+    return {
+        owner: templates[rows]
+        for owner, rows in zip(owners.tolist(), np.split(order, starts[1:]))
+    }
+
+
+def refine_distance(templates, user_id, descriptor):
+    """Расстояние до ближайшего шаблона пользователя."""
+    return float(np.linalg.norm(templates[user_id] - descriptor, axis=1).min())
+
+
+def partition_rows(position_ids):
+    """Группирует номера строк индекса по должности пользователя."""
+    order = np.argsort(position_ids, kind="stable")
+    values, starts = np.unique(position_ids[order], return_index=True)
+    return dict(zip(values.tolist(), np.split(order, starts[1:])))
+
+
+def best_matches(
+    matrix, user_ids, descriptors, threshold, radii=None, templates=None
+):
+    """
+    Точное ранжирование строк для пачки дескрипторов одной операцией.
+    Шаблоны сравниваются только у пользователей, чей центроид ближе
+    порога с учётом радиуса шаблонов.
+    :return: список FaceSearchResult для каждого дескриптора
+    """
+    if not len(user_ids):
+        return [FaceSearchResult(None, None, None, 0)] * len(descriptors)
+    distances = np.sqrt(squared_distances(descriptors, matrix))
+    if templates:
+        near = (radii > 0) & (distances - radii < threshold)
+        for query, row in zip(*np.nonzero(near)):
+            distances[query, row] = refine_distance(
+                templates, int(user_ids[row]), descriptors[query]
+            )
+    queries = np.arange(len(descriptors))
+    best = np.argmin(distances, axis=1)
+    best_distances = distances[queries, best]
+    second_distances = [None] * len(descriptors)
+    if len(user_ids) > 1:
+        second_distances = np.partition(distances, 1, axis=1)[:, 1].tolist()
+    return [
+        FaceSearchResult(
+            (
+                FaceMatch(int(user_ids[row]), float(distance))
+                if distance < threshold
+                else None
+            ),
+            float(distance),
+            second_distance,
+            len(user_ids),
+        )
+        for row, distance, second_distance in zip(
+            best, best_distances, second_distances
+        )
+    ]
+
+
+def rank_rows(
+    matrix, user_ids, descriptor, threshold, radii=None, templates=None
+):
+    """
+    Точное ранжирование строк по расстоянию до дескриптора.
+
+    Строка - центроид дескрипторов пользователя. По неравенству
+    треугольника шаблоны пользователя не ближе, чем расстояние до
+    центроида минус радиус, поэтому шаблоны сравниваются только у
+    пользователей, для которых эта оценка меньше порога.
+    :return: FaceSearchResult с лучшим и вторым расстоянием
+    """
+    if not len(user_ids):
+        return FaceSearchResult(None, None, None, 0)
+    distances = np.linalg.norm(matrix - descriptor, axis=1)
+    if templates:
+        for row in np.flatnonzero(
+            (radii > 0) & (distances - radii < threshold)
+        ):
+            distances[row] = refine_distance(
+                templates, int(user_ids[row]), descriptor
+            )
+    if len(distances) > 1:
+        best, second = np.argpartition(distances, 1)[:2]
+        second_distance = float(distances[second])
+    else:
+        best, second_distance = 0, None
+    best_distance = float(distances[best])
+    match = (
+        FaceMatch(int(user_ids[best]), best_distance)
+        if best_distance < threshold
+        else None
+    )
+    return FaceSearchResult(
+        match, best_distance, second_distance, len(distances)
+    )
+
+
+def save_snapshot():
+    """
+    Записывает снапшот индекса лиц для воркеров
+    :return: номер версии снапшота или None, если снапшоты отключены
+    """
+    directory = settings.FACE_INDEX_SNAPSHOT_DIR
+    if not directory:
+        return None
+    descriptor_set = load_descriptors()
+    return write_snapshot(
+        directory,
+        descriptor_set.change_version,
+        user_ids=descriptor_set.user_ids,
+        descriptors=descriptor_set.descriptors,
+        digests=descriptor_set.digests,
+        position_ids=descriptor_set.position_ids,
+        radii=descriptor_set.radii,
+        templates=descriptor_set.templates,
+        template_owners=descriptor_set.template_owners,
+    )
+
+
+class FaceIndex:
+    """
+    Индекс дескрипторов лиц в памяти процесса.
+
+    Все расшифрованные дескрипторы хранятся одной непрерывной
+    float32-матрицей с параллельным массивом id пользователей,
+    поэтому поиск - это одно векторизованное вычисление расстояний.
+
+    Изменения, сделанные другими процессами, применяются точечно по
+    журналу FaceIndexChange, когда меняется счётчик изменений в общем
+    кэше. Изменения собственного процесса применяются после коммита.
+
+    Если задан FACE_INDEX_SNAPSHOT_DIR, матрица отображается из общего
+    для всех воркеров снапшота в tmpfs и подменяется при появлении
+    новой версии. Локальные изменения копируют матрицу в память процесса
+    до следующей версии снапшота.
+
+    Кандидатов отбирает бэкенд из FACE_SEARCH_BACKEND, после чего они
+    точно переранжируются по FACE_MATCH_THRESHOLD. При известной
+    должности сначала перебирается только её раздел индекса.
+
+    Пользователь с дополнительными шаблонами FaceTemplate представлен
+    в матрице центроидом своих дескрипторов, сами шаблоны сравниваются
+    только для центроидов, прошедших проверку радиуса.
+    """
+
+    def __init__(self, backend=None):
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._built_at = 0.0
+        self._change_version = 0
+        self._change_token = None
+        self._snapshot_version = None
+        # None - бэкенд из FACE_SEARCH_BACKEND при первом обращении
+        self._backend = backend
+        self._backend_state = None
+        self._user_ids = np.empty(0, dtype=np.int64)
+        self._position_ids = np.empty(0, dtype=np.int64)
+        self._partitions = {}
+        self._matrix = np.empty(
+            (0, MAX_LENGTH_FACE_DESCRIPTOR), dtype=np.float32
+        )
+        self._radii = np.empty(0, dtype=np.float32)
+        # user_id -> матрица шаблонов пользователей с несколькими
+        # дескрипторами
+        self._templates = {}
+        # Отпечатки данных, по которым построены строки. Позволяют
+        # не дешифровать дескриптор повторно при save() без изменения
+        # дескриптора и должности.
+        self._sources = {}
+
+    def __len__(self):
+        return len(self._user_ids)
+
+    @property
+    def snapshot_version(self):
+        return self._snapshot_version
+
+    @property
+    def memory_bytes(self):
+        """Объём матрицы, id пользователей и состояния бэкенда в байтах."""
+        with self._lock:
+            return (
+                self._matrix.nbytes
+                + self._user_ids.nbytes
+                + self._position_ids.nbytes
+                + self._radii.nbytes
+                + sum(
+                    templates.nbytes for templates in self._templates.values()
+                )
+                + self.backend.memory_bytes(self._backend_state)
+            )
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            self._backend = get_backend()
+        return self._backend
+
+    def _refit(self):
+        self._backend_state = self.backend.fit(
+            self._matrix, previous=self._backend_state
+        )
+        self._partitions = partition_rows(self._position_ids)
+
+    def _install(self, descriptor_set, snapshot_version=None):
+        backend_state = self.backend.fit(descriptor_set.descriptors)
+        partitions = partition_rows(descriptor_set.position_ids)
+        with self._lock:
+            self._user_ids = descriptor_set.user_ids
+            self._position_ids = descriptor_set.position_ids
+            self._matrix = descriptor_set.descriptors
+            self._radii = descriptor_set.radii
+            self._templates = group_templates(
+                descriptor_set.templates, descriptor_set.template_owners
+            )
+            self._backend_state = backend_state
+            self._partitions = partitions
+            self._sources = dict(
+                zip(
+                    descriptor_set.user_ids.tolist(),
+                    descriptor_set.digests.tolist(),
+                )
+            )
+            self._change_version = descriptor_set.change_version
+            self._change_token = None
+            self._snapshot_version = snapshot_version
+            self._built_at = time.monotonic()
+            self._loaded = True
+
+    def _load_snapshot(self, metadata):
+        """Подключает снапшот, изменения после него применяются по журналу."""
+        change_version = metadata.get("change_version")
+        if change_version is None:
+            return False
+        try:
+            arrays = load_snapshot(
+                settings.FACE_INDEX_SNAPSHOT_DIR, metadata["version"]
+            )
+        except (OSError, ValueError) as e:
+            logger.error(f"Ошибка загрузки снапшота индекса лиц: {str(e)}")
+            return False
+        self._install(
+            DescriptorSet(change_version=change_version, **arrays),
+            snapshot_version=metadata["version"],
+        )
+        return True
+
+    def build(self):
+        """Перестраивает индекс из снапшота или по таблице пользователей."""
+        with self._lock:
+            metadata = None
+            if settings.FACE_INDEX_SNAPSHOT_DIR:
+                metadata = read_current(settings.FACE_INDEX_SNAPSHOT_DIR)
+            if not (metadata and self._load_snapshot(metadata)):
+                self._install(load_descriptors())
+            self.apply_changes()
+
+    def ensure_loaded(self):
+        """Строит индекс при первом обращении и применяет изменения."""
+        if self._loaded:
+            if settings.FACE_INDEX_SNAPSHOT_DIR:
+                metadata = read_current(settings.FACE_INDEX_SNAPSHOT_DIR)
+                if (
+                    metadata
+                    and metadata["version"] != self._snapshot_version
+                    and self._load_snapshot(metadata)
+                ):
+                    self.apply_changes()
+                    return
+            if time.monotonic() - self._built_at < settings.FACE_INDEX_TTL:
+                self.apply_changes()
+                return
+        self.build()
+
+    def apply_changes(self):
+        """
+        Применяет к индексу изменения из журнала FaceIndexChange
+        :return: True, если индекс процесса изменился
+        """
+        token = current_change_token()
+        if token == self._change_token:
+            return False
+
+        with self._lock:
+            # Недавние записи перечитываются: запись с меньшим id могла
+            # закоммититься позже уже применённой.
+            recent = timezone.now() - timedelta(
+                seconds=FACE_INDEX_CHANGE_LAG_SECONDS
+            )
+            changes = list(
+                FaceIndexChange.objects.filter(
+                    Q(id__gt=self._change_version) | Q(created_at__gte=recent)
+                ).values_list("id", "user_id")
+            )
+            user_ids = {user_id for _, user_id in changes}
+            current = {
+                user_id: row
+                for user_id, *row in stored_descriptors(
+                    User.objects.filter(pk__in=user_ids)
+                )
+            }
+            extra_templates = stored_templates(list(current))
+
+            changed = False
+            for user_id in user_ids:
+                if user_id in current:
+                    stored_value, key_id, position_id = current[user_id]
+                    changed |= self._patch(
+                        user_id,
+                        stored_value,
+                        position_id,
+                        key_id,
+                        extra_templates.get(user_id, []),
+                    )
+                else:
+                    changed |= self._drop(user_id)
+            if changed:
+                self._refit()
+
+            if changes:
+                self._change_version = max(
+                    self._change_version,
+                    max(change_id for change_id, _ in changes),
+                )
+            self._change_token = token
+            return changed
+
+    def _patch(
+        self, user_id, stored_value, position_id, key_id, extra_templates=None
+    ):
+        """
+        Меняет строку пользователя без переобучения бэкенда
+        :param extra_templates: шаблоны из stored_templates, None - прочитать
+        """
+        if stored_value is None:
+            return self._drop(user_id)
+        if not self._loaded:
+            return False
+
+        if extra_templates is None:
+            extra_templates = stored_templates([user_id]).get(user_id, [])
+        digest = source_digest(stored_value, position_id, extra_templates)
+        if self._sources.get(user_id) == digest:
+            return False
+
+        entry = user_entry(
+            user_id, stored_value, key_id, position_id, extra_templates
+        )
+        if entry is None:
+            return self._drop(user_id)
+
+        if position_id is None:
+            position_id = NO_POSITION
+        # Массивы не меняются на месте: поиск читает их без блокировки
+        # по ссылкам, взятым до изменения
+        rows = np.flatnonzero(self._user_ids == user_id)
+        if rows.size:
+            self._matrix = np.array(self._matrix)
+            self._matrix[rows[0]] = entry.centroid
+            self._position_ids = np.array(self._position_ids)
+            self._position_ids[rows[0]] = position_id
+            self._radii = np.array(self._radii)
+            self._radii[rows[0]] = entry.radius
+        else:
+            self._matrix = np.vstack((self._matrix, entry.centroid[None, :]))
+            self._user_ids = np.append(self._user_ids, user_id)
+            self._position_ids = np.append(self._position_ids, position_id)
+            self._radii = np.append(self._radii, np.float32(entry.radius))
+        self._templates = dict(self._templates)
+        if entry.templates is None:
+            self._templates.pop(user_id, None)
+        else:
+            self._templates[user_id] = entry.templates
+        self._sources[user_id] = digest
+        return True
+
+    def _drop(self, user_id):
+        """Удаляет строку пользователя без переобучения бэкенда."""
+        if not self._loaded or user_id not in self._sources:
+            return False
+        keep = self._user_ids != user_id
+        self._matrix = np.ascontiguousarray(self._matrix[keep])
+        self._user_ids = self._user_ids[keep]
+        self._position_ids = self._position_ids[keep]
+        self._radii = self._radii[keep]
+        self._templates = {
+            owner: templates
+            for owner, templates in self._templates.items()
+            if owner != user_id
+        }
+        del self._sources[user_id]
+        return True
+
+    def update_user(
+        self, user_id, stored_value, position_id=None, key_id=None
+    ):
+        """
+        Патчит строку индекса после изменения дескриптора или должности
+        :param stored_value: User.stored_face_descriptor
+        :param key_id: User.face_descriptor_key_id
+        :return: True, если индекс процесса изменился
+        """
+        with self._lock:
+            changed = self._patch(user_id, stored_value, position_id, key_id)
+            if changed:
+                self._refit()
+            return changed
+
+    def remove_user(self, user_id):
+        """
+        Удаляет пользователя из индекса
+        :return: True, если индекс процесса изменился
+        """
+        with self._lock:
+            changed = self._drop(user_id)
+            if changed:
+                self._refit()
+            return changed
+
+    def search(self, descriptor, threshold=None, position_id=None):
+        """
+        Ищет ближайшего пользователя к дескриптору
+        :param descriptor: numpy array с дескриптором лица
+        :param threshold: порог расстояния, по умолчанию FACE_MATCH_THRESHOLD
+        :param position_id: должность, раздел которой проверяется первым
+        :return: FaceMatch или None, если никто не ближе порога
+        """
+        return self.search_detailed(descriptor, threshold, position_id).match
+
+    def search_detailed(self, descriptor, threshold=None, position_id=None):
+        """
+        Поиск как в search, но с лучшим и вторым расстоянием и числом
+        точно сравнённых кандидатов на последнем этапе
+        :return: FaceSearchResult
+        """
+        if threshold is None:
+            threshold = settings.FACE_MATCH_THRESHOLD
+
+        self.ensure_loaded()
+        with self._lock:
+            matrix, user_ids = self._matrix, self._user_ids
+            radii, templates = self._radii, self._templates
+            backend_state = self._backend_state
+            partitions = self._partitions
+
+        descriptor = np.asarray(descriptor, dtype=np.float32)
+        if position_id is not None and position_id in partitions:
+            rows = partitions[position_id]
+            result = rank_rows(
+                matrix[rows],
+                user_ids[rows],
+                descriptor,
+                threshold,
+                radii[rows],
+                templates,
+            )
+            if result.match:
+                return result
+
+        rows = self.backend.candidates(backend_state, matrix, descriptor)
+        if rows is not None:
+            matrix, user_ids, radii = matrix[rows], user_ids[rows], radii[rows]
+        return rank_rows(
+            matrix, user_ids, descriptor, threshold, radii, templates
+        )
+
+    def search_batch(self, descriptors, threshold=None, position_id=None):
+        """
+        Идентифицирует пачку дескрипторов одним матричным умножением
+        :param descriptors: numpy array формы (n, 128)
+        :param threshold: порог расстояния, по умолчанию FACE_MATCH_THRESHOLD
+        :param position_id: должность, раздел которой проверяется первым
+        :return: список FaceMatch или None для каждого дескриптора
+        """
+        return [
+            result.match
+            for result in self.search_batch_detailed(
+                descriptors, threshold, position_id
+            )
+        ]
+
+    def search_batch_detailed(
+        self, descriptors, threshold=None, position_id=None
+    ):
+        """
+        Поиск как в search_batch, но с данными для телеметрии
+        :return: список FaceSearchResult для каждого дескриптора
+        """
+        if threshold is None:
+            threshold = settings.FACE_MATCH_THRESHOLD
+
+        self.ensure_loaded()
+        with self._lock:
+            matrix, user_ids = self._matrix, self._user_ids
+            radii, templates = self._radii, self._templates
+            partitions = self._partitions
+
+        descriptors = np.asarray(descriptors, dtype=np.float32)
+        results = [None] * len(descriptors)
+        pending = np.arange(len(descriptors))
+
+        if position_id is not None and position_id in partitions:
+            rows = partitions[position_id]
+            for index, result in zip(
+                pending,
+                best_matches(
+                    matrix[rows],
+                    user_ids[rows],
+                    descriptors,
+                    threshold,
+                    radii[rows],
+                    templates,
+                ),
+            ):
+                if result.match:
+                    results[index] = result
+            pending = np.array(
+                [index for index in pending if results[index] is None],
+                dtype=np.int64,
+            )
+
+        if pending.size:
+            for index, result in zip(
+                pending,
+                best_matches(
+                    matrix,
+                    user_ids,
+                    descriptors[pending],
+                    threshold,
+                    radii,
+                    templates,
+                ),
+            ):
+                results[index] = result
+        return results
+
+
+face_index = FaceIndex()
@@ -0,0 +1,261 @@
+"""
+Бэкенды поиска кандидатов для индекса лиц.
+
+Бэкенд отбирает top-k строк матрицы дескрипторов, которые затем точно
+переранжируются в FaceIndex по FACE_MATCH_THRESHOLD. Состояние бэкенда
+(центроиды, инвертированные списки) хранится отдельно от него самого,
+чтобы индекс мог атомарно подменять матрицу вместе с состоянием.
+"""
+
+from typing import NamedTuple
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+import numpy as np
+
+
+def squared_distances(matrix, points):
+    """Квадраты евклидовых расстояний между строками matrix и points."""
+    distances = (
+        np.einsum("ij,ij->i", matrix, matrix)[:, None]
+        - 2.0 * matrix @ points.T
+        + np.einsum("ij,ij->i", points, points)[None, :]
+    )
+    return np.maximum(distances, 0.0, out=distances)
+
+
+class BruteForceBackend:
+    """Точный перебор всей матрицы - эталонный бэкенд."""
+
+    def fit(self, matrix, previous=None):
+        return None
+
+    def candidates(self, state, matrix, query, k=None):
+        """None означает, что кандидаты - все строки матрицы."""
+        return None
+
+    def memory_bytes(self, state):
+        """Объём состояния бэкенда в байтах."""
+        return 0
+
+
+class IVFState(NamedTuple):
+    """Центроиды и инвертированные списки строк по кластерам."""
+
+    centroids: np.ndarray
+    order: np.ndarray
+    offsets: np.ndarray
+    trained_size: int
+
+
+class IVFBackend:
+    """
+    Кластерный индекс (IVF) поверх k-means по дескрипторам.
+
+    Поиск просматривает только n_probe ближайших к запросу кластеров.
+    Больший n_probe повышает полноту ценой задержки; n_probe = n_lists
+    эквивалентен полному перебору.
+    """
+
+    def __init__(
+        self,
+        n_lists=None,
+        n_probe=8,
+        top_k=10,
+        n_iter=10,
+        train_size_per_list=64,
+        seed=0,
+    ):
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.top_k = top_k
+        self.n_iter = n_iter
+        self.train_size_per_list = train_size_per_list
+        self.seed = seed
+
+    def _n_lists(self, size):
+        return max(1, min(size, self.n_lists or int(np.sqrt(size))))
+
+    def _kmeans(self, matrix, n_lists):
+        rng = np.random.default_rng(self.seed)
+        train_size = min(len(matrix), n_lists * self.train_size_per_list)
+        sample = np.asarray(
+            matrix[
+                np.sort(rng.choice(len(matrix), train_size, replace=False))
+            ],
+            dtype=np.float32,
+        )
+        centroids = sample[rng.choice(train_size, n_lists, replace=False)]
+
+        for _ in range(self.n_iter):
+            labels = np.argmin(squared_distances(sample, centroids), axis=1)
+            counts = np.bincount(labels, minlength=n_lists)
+            boundaries = np.cumsum(counts) - counts
+            filled = counts > 0
+            sums = np.add.reduceat(
+                sample[np.argsort(labels, kind="stable")],
+                boundaries[filled],
+            )
+            centroids[filled] = sums / counts[filled, None]
+            if not filled.all():
+                centroids[~filled] = sample[
+                    rng.choice(train_size, np.count_nonzero(~filled))
+                ]
+        return centroids
+
+    def _assign(self, matrix, centroids):
+        labels = np.empty(len(matrix), dtype=np.int64)
+        for start in range(0, len(matrix), 8192):
+            block = np.asarray(matrix[start : start + 8192], dtype=np.float32)
+            labels[start : start + 8192] = np.argmin(
+                squared_distances(block, centroids), axis=1
+            )
+        order = np.argsort(labels, kind="stable")
+        offsets = np.concatenate(
+            ([0], np.cumsum(np.bincount(labels, minlength=len(centroids))))
+        )
+        return order, offsets
+
+    def fit(self, matrix, previous=None):
+        """
+        Обучает центроиды и раскладывает строки по спискам.
+        Если индекс вырос не более чем вдвое с прошлого обучения,
+        центроиды переиспользуются и строки только переназначаются.
+        """
+        if not len(matrix):
+            return None
+        if previous is not None and len(matrix) <= 2 * previous.trained_size:
+            centroids, trained_size = previous.centroids, previous.trained_size
+        else:
+            centroids = self._kmeans(matrix, self._n_lists(len(matrix)))
+            trained_size = len(matrix)
+        order, offsets = self._assign(matrix, centroids)
+        return IVFState(centroids, order, offsets, trained_size)
+
+    def candidates(self, state, matrix, query, k=None):
+        """Возвращает до k ближайших строк из n_probe ближайших списков."""
+        if state is None:
+            return None
+        k = k or self.top_k
+        query = np.asarray(query, dtype=np.float32)[None, :]
+
+        coarse = squared_distances(state.centroids, query)[:, 0]
+        n_probe = min(self.n_probe, len(coarse))
+        lists = np.argpartition(coarse, n_probe - 1)[:n_probe]
+        rows = np.concatenate(
+            [
+                state.order[state.offsets[i] : state.offsets[i + 1]]
+                for i in lists
+            ]
+        )
+        if len(rows) <= k:
+            return rows
+
+        distances = squared_distances(
+            np.asarray(matrix[rows], dtype=np.float32), query
+        )[:, 0]
+        return rows[np.argpartition(distances, k - 1)[:k]]
+
+    def memory_bytes(self, state):
+        if state is None:
+            return 0
+        return sum(
+            array.nbytes
+            for array in (state.centroids, state.order, state.offsets)
+        )
+
+
+class QuantizedState(NamedTuple):
+    """Сжатая копия матрицы дескрипторов для грубого прохода."""
+
+    codes: np.ndarray
+    scale: np.ndarray
+    squared_norms: np.ndarray
+
+
+class QuantizedBackend:
+    """
+    Грубый проход по сжатой копии матрицы дескрипторов.
+
+    dtype="float16" вдвое, а dtype="int8" (масштаб по каждому измерению)
+    вчетверо уменьшают объём, читаемый при каждом поиске. Отобранные
+    top_k строк затем точно переранжируются в FaceIndex по float32.
+    """
+
+    DTYPES = ("float16", "int8")
+    # Строк, распаковываемых в float32 за один шаг грубого прохода
+    BLOCK_ROWS = 4096
+
+    def __init__(self, dtype="int8", top_k=10):
+        if dtype not in self.DTYPES:
+            raise ImproperlyConfigured(
+                f"Неизвестный тип квантования дескрипторов: {dtype}"
+            )
+        self.dtype = dtype
+        self.top_k = top_k
+
+    def _blocks(self, size):
+        for start in range(0, size, self.BLOCK_ROWS):
+            yield start, min(start + self.BLOCK_ROWS, size)
+
+    def _decode(self, state, start, stop):
+        block = state.codes[start:stop].astype(np.float32)
+        block *= state.scale
+        return block
+
+    def fit(self, matrix, previous=None):
+        """Кодирует матрицу, для int8 подбирая масштаб каждого измерения."""
+        if not len(matrix):
+            return None
+        if self.dtype == "int8":
+            scale = np.zeros(matrix.shape[1], dtype=np.float32)
+            for start, stop in self._blocks(len(matrix)):
+                np.maximum(
+                    scale, np.abs(matrix[start:stop]).max(axis=0), out=scale
+                )
+            scale = np.where(scale > 0, scale / 127.0, 1.0).astype(np.float32)
+        else:
+            scale = np.ones(matrix.shape[1], dtype=np.float32)
+
+        codes = np.empty(matrix.shape, dtype=self.dtype)
+        squared_norms = np.empty(len(matrix), dtype=np.float32)
+        state = QuantizedState(codes, scale, squared_norms)
+        for start, stop in self._blocks(len(matrix)):
+            block = np.asarray(matrix[start:stop], dtype=np.float32)
+            if self.dtype == "int8":
+                codes[start:stop] = np.rint(block / scale)
+            else:
+                codes[start:stop] = block
+            decoded = self._decode(state, start, stop)
+            squared_norms[start:stop] = np.einsum("ij,ij->i", decoded, decoded)
+        return state
+
+    def candidates(self, state, matrix, query, k=None):
+        """Возвращает k строк, ближайших к запросу по сжатой матрице."""
+        if state is None:
+            return None
+        k = k or self.top_k
+        if len(state.codes) <= k:
+            return None
+        query = np.asarray(query, dtype=np.float32)
+
+        # ||q||^2 одинаков для всех строк и не влияет на порядок
+        distances = np.empty(len(state.codes), dtype=np.float32)
+        for start, stop in self._blocks(len(state.codes)):
+            distances[start:stop] = state.squared_norms[start:stop] - 2.0 * (
+                self._decode(state, start, stop) @ query
+            )
+        return np.argpartition(distances, k - 1)[:k]
+
+    def memory_bytes(self, state):
+        if state is None:
+            return 0
+        return sum(array.nbytes for array in state)
+
+
+def get_backend():
+    """Создаёт бэкенд поиска из настройки FACE_SEARCH_BACKEND."""
+    config = settings.FACE_SEARCH_BACKEND
+    backend_class = import_string(config["BACKEND"])
+    return backend_class(**config.get("OPTIONS", {}))
@@ -0,0 +1,127 @@
+import fcntl
+import json
+import os
+
+from django.core.exceptions import ImproperlyConfigured
+import numpy as np
+
+CURRENT_FILE = "CURRENT"
+SNAPSHOT_ARRAYS = (
+    "user_ids",
+    "descriptors",
+    "digests",
+    "position_ids",
+    "radii",
+    "templates",
+    "template_owners",
+)
+# Файловые системы, содержимое которых не попадает на диск
+MEMORY_FILESYSTEMS = ("tmpfs", "ramfs")
+
+
+def is_memory_filesystem(path):
+    """Проверяет, что каталог смонтирован в tmpfs/ramfs."""
+    path = os.path.realpath(path)
+    best_mount, best_type = "", None
+    try:
+        with open("/proc/self/mounts") as mounts:
+            for line in mounts:
+                _, mount_point, fs_type = line.split()[:3]
+                mount_point = mount_point.replace("\\040", " ")
+                inside = path == mount_point or path.startswith(
+                    mount_point.rstrip("/") + "/"
+                )
+                if inside and len(mount_point) >= len(best_mount):
+                    best_mount, best_type = mount_point, fs_type
+    except OSError:
+        return False
+    return best_type in MEMORY_FILESYSTEMS
+
+
+def _array_path(directory, name, version):
+    return os.path.join(directory, f"{name}-{version}.npy")
+
+
+def _write_private(path, write):
+    """Атомарно записывает файл, доступный только владельцу."""
+    tmp_path = f"{path}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as file:
+        write(file)
+    os.replace(tmp_path, path)
+
+
+def read_current(directory):
+    """
+    Читает метаданные актуального снапшота
+    :return: dict с version, count и change_version или None
+    """
+    try:
+        with open(os.path.join(directory, CURRENT_FILE)) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def write_snapshot(directory, change_version, **arrays):
+    """
+    Записывает снапшот индекса лиц и переключает на него CURRENT.
+
+    Расшифрованные дескрипторы допускается хранить только в памяти,
+    поэтому каталог обязан находиться в tmpfs.
+    :param change_version: последняя запись журнала FaceIndexChange,
+        учтённая в снапшоте
+    :return: номер версии нового снапшота
+    """
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    if not is_memory_filesystem(directory):
+        raise ImproperlyConfigured(
+            f"Каталог снапшота индекса лиц {directory} должен "
+            f"находиться в tmpfs"
+        )
+
+    lock_fd = os.open(
+        os.path.join(directory, ".lock"), os.O_RDWR | os.O_CREAT, 0o600
+    )
+    try:
+        fcntl.flock(lock_fd, fcntl.LOCK_EX)
+        current = read_current(directory)
+        version = current["version"] + 1 if current else 1
+
+        for name in SNAPSHOT_ARRAYS:
+            _write_private(
+                _array_path(directory, name, version),
+                lambda file, name=name: np.save(file, arrays[name]),
+            )
+        metadata = {
+            "version": version,
+            "count": len(arrays["user_ids"]),
+            "change_version": change_version,
+        }
+        _write_private(
+            os.path.join(directory, CURRENT_FILE),
+            lambda file: file.write(json.dumps(metadata).encode()),
+        )
+
+        # Уже отображённые воркерами файлы остаются доступны им и после
+        # удаления, поэтому старые версии можно удалять сразу.
+        for file_name in os.listdir(directory):
+            if file_name.endswith(".npy") and not file_name.endswith(
+                f"-{version}.npy"
+            ):
+                os.remove(os.path.join(directory, file_name))
+    finally:
+        os.close(lock_fd)
+
+    return version
+
+
+def load_snapshot(directory, version):
+    """
+    Отображает массивы снапшота в память только для чтения
+    :return: dict с массивами снапшота
+    """
+    return {
+        name: np.load(_array_path(directory, name, version), mmap_mode="r")
+        for name in SNAPSHOT_ARRAYS
+    }
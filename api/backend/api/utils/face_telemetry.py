@@ -0,0 +1,71 @@
+import logging
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+
+from api.models import FaceMatchAttempt
+
+logger = logging.getLogger(__name__)
+
+
+def _attempt(source, result, decrypt_seconds, compare_seconds, user_id):
+    if user_id is None and result.match:
+        user_id = result.match.user_id
+    return FaceMatchAttempt(
+        source=source,
+        user_id=user_id,
+        is_match=result.match is not None,
+        best_distance=result.best_distance,
+        second_distance=result.second_distance,
+        candidates=result.candidates,
+        decrypt_ms=decrypt_seconds * 1000,
+        compare_ms=compare_seconds * 1000,
+    )
+
+
+def _save(attempts):
+    try:
+        # Точка сохранения: ошибка вставки не прерывает внешнюю транзакцию
+        with transaction.atomic():
+            FaceMatchAttempt.objects.bulk_create(attempts)
+    except DatabaseError as e:
+        # Телеметрия не должна ломать вход и регистрацию
+        logger.error(f"Ошибка записи телеметрии сравнения лица: {str(e)}")
+
+
+def record_face_match(
+    source, result, decrypt_seconds, compare_seconds, user_id=None
+):
+    """
+    Сохраняет телеметрию попытки сравнения лица
+    :param source: FaceMatchAttempt.Source
+    :param result: FaceSearchResult
+    :param user_id: подтверждаемый пользователь, по умолчанию найденный
+    """
+    if not settings.FACE_TELEMETRY_ENABLED:
+        return
+    _save(
+        [_attempt(source, result, decrypt_seconds, compare_seconds, user_id)]
+    )
+
+
+def record_face_matches(source, results, decrypt_seconds, compare_seconds):
+    """
+    Сохраняет телеметрию пачки сравнений одним запросом. Время пачки
+    делится поровну между попытками.
+    :param results: список FaceSearchResult
+    """
+    if not settings.FACE_TELEMETRY_ENABLED or not results:
+        return
+    _save(
+        [
+            _attempt(
+                source,
+                result,
+                decrypt_seconds / len(results),
+                compare_seconds / len(results),
+                None,
+            )
+            for result in results
+        ]
+    )
@@ -0,0 +1,184 @@
+from typing import NamedTuple
+
+from django.core import signing
+from django.core.cache import cache
+import numpy as np
+
+from api.utils.question_pools import cached_question_pool
+from api.utils.test_snapshots import cached_snapshot
+from backend.constants import TEST_SNAPSHOTS_CACHE_SECONDS
+
+SERVED_QUESTIONS_SALT = "api.grading.served_questions"
+
+
+class GradingError(ValueError):
+    """Ответы не соответствуют вопросам теста."""
+
+
+class Grade(NamedTuple):
+    """Результат проверки ответов теста."""
+
+    score: int
+    total_points: int
+    mark: int
+    is_passed: bool
+    # По строкам ответов в порядке отправки
+    is_correct: list
+    points_earned: list
+
+
+def calculate_mark(score, total_points):
+    """Оценка от 1 до 10 по доле набранных баллов, как на клиенте."""
+    if total_points <= 0:
+        return 1
+    percentage = score / total_points * 100
+    mark = int(percentage // 10) + (1 if percentage % 10 >= 5 else 0)
+    return max(1, min(10, mark))
+
+
+class AnswerKey:
+    """
+    Ключ ответов теста: id ответов по возрастанию, их вопросы, признак
+    правильного ответа и баллы вопроса.
+
+    Клиент выбирает один вариант ответа на вопрос, поэтому вопрос
+    засчитывается, если выбранный ответ правильный. Баллы вопроса
+    записываются в строку ответа на него.
+    """
+
+    def __init__(self, answer_ids, question_ids, is_correct, points):
+        order = np.argsort(answer_ids, kind="stable")
+        self.answer_ids = np.asarray(answer_ids, dtype=np.int64)[order]
+        self.question_ids = np.asarray(question_ids, dtype=np.int64)[order]
+        self.is_correct = np.asarray(is_correct, dtype=bool)[order]
+        self.points = np.asarray(points, dtype=np.int64)[order]
+        self.questions = np.unique(self.question_ids)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """:param rows: (id ответа, id вопроса, верный, баллы вопроса)"""
+        rows = list(rows)
+        if not rows:
+            return cls([], [], [], [])
+        return cls(*zip(*rows))
+
+    @classmethod
+    def from_questions(cls, questions):
+        """Ключ по вопросам опубликованной версии теста"""
+        return cls.from_rows(
+            (
+                answer["id"],
+                question["id"],
+                answer["is_correct"],
+                question["points"],
+            )
+            for question in questions
+            for answer in question["answers"]
+        )
+
+    def grade(self, question_ids, selected_ids, passing_score, served_ids):
+        """
+        Проверяет ответы. Нужен ровно один ответ на каждый выданный
+        клиенту вопрос, иначе можно было бы ответить только на лёгкие
+        вопросы или повторить верный ответ.
+        :param question_ids: id вопросов по строкам ответов
+        :param selected_ids: id выбранных ответов по строкам
+        :param passing_score: проходной балл в процентах
+        :param served_ids: id вопросов, выданных клиенту
+        :return: Grade
+        """
+        question_ids = np.asarray(question_ids, dtype=np.int64)
+        selected_ids = np.asarray(selected_ids, dtype=np.int64)
+        served = np.unique(np.asarray(served_ids, dtype=np.int64))
+        if not len(served):
+            raise GradingError("В тесте нет вопросов для проверки")
+        if not np.isin(served, self.questions).all():
+            raise GradingError("Выданные вопросы не относятся к версии теста")
+        if len(question_ids) != len(served) or not np.array_equal(
+            np.unique(question_ids), served
+        ):
+            raise GradingError("Нужен один ответ на каждый выданный вопрос")
+
+        rows = np.minimum(
+            np.searchsorted(self.answer_ids, selected_ids),
+            len(self.answer_ids) - 1,
+        )
+        known = (self.answer_ids[rows] == selected_ids) & (
+            self.question_ids[rows] == question_ids
+        )
+        if not known.all():
+            raise GradingError("Ответ не относится к вопросу теста")
+
+        is_correct = self.is_correct[rows]
+        question_points = self.points[rows]
+        points_earned = np.where(is_correct, question_points, 0)
+
+        score = int(points_earned.sum())
+        total_points = int(question_points.sum())
+        return Grade(
+            score=score,
+            total_points=total_points,
+            mark=calculate_mark(score, total_points),
+            is_passed=score * 100 >= total_points * passing_score,
+            is_correct=is_correct.tolist(),
+            points_earned=points_earned.tolist(),
+        )
+
+
+def sign_served_questions(user_id, test_id, version, question_ids):
+    """
+    Подписывает вопросы, выданные пользователю. Клиент возвращает
+    подпись вместе с ответами, и проверяются ответы именно на них.
+    :param version: номер версии теста, None - тест не опубликован
+    """
+    return signing.dumps(
+        {
+            "user": user_id,
+            "test": test_id,
+            "version": version,
+            "questions": sorted(question_ids),
+        },
+        salt=SERVED_QUESTIONS_SALT,
+        compress=True,
+    )
+
+
+def served_questions(token, user_id, test_id):
+    """
+    Проверяет подпись выданных вопросов
+    :return: (номер версии теста или None, id вопросов)
+    :raises GradingError: подпись неверна или выдана для другого
+        пользователя или теста
+    """
+    try:
+        served = signing.loads(token, salt=SERVED_QUESTIONS_SALT)
+    except signing.BadSignature:
+        raise GradingError("Неверная подпись выданных вопросов")
+    if served.get("user") != user_id or served.get("test") != test_id:
+        raise GradingError("Вопросы выданы для другого теста")
+    return served["version"], served["questions"]
+
+
+def cached_answer_key(test_id, snapshot_id=None, build_questions=None):
+    """
+    Ключ ответов опубликованной версии теста или, если версия не
+    указана, текущих вопросов теста. Ключ текущих вопросов строится по
+    закэшированным вопросам, из которых они выдаются клиенту, поэтому
+    проверка сбрасывается вместе с выдачей.
+    :param build_questions: функция, возвращающая вопросы теста при
+        промахе кэша вопросов
+    :return: AnswerKey
+    """
+    if snapshot_id is None:
+        return AnswerKey.from_questions(
+            cached_question_pool(test_id, build_questions)
+        )
+
+    key = f"answer_key:snapshot:{snapshot_id}"
+    answer_key = cache.get(key)
+    if answer_key is None:
+        answer_key = AnswerKey.from_questions(
+            cached_snapshot(snapshot_id).questions
+        )
+        cache.set(key, answer_key, timeout=TEST_SNAPSHOTS_CACHE_SECONDS)
+    return answer_key
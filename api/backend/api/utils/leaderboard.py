@@ -0,0 +1,370 @@
+from datetime import timedelta
+import threading
+import time
+from typing import NamedTuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Max, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+import numpy as np
+
+from api.models import ExperienceDailyRollup, ExperienceEvent, User
+from backend.constants import (
+    LEADERBOARD_CHANGE_LAG_SECONDS,
+    LEADERBOARD_PERIOD_SECONDS,
+)
+
+# Периоды рейтинга, кроме рейтинга за всё время
+PERIODS = ("day", "week", "month")
+
+
+class Standing(NamedTuple):
+    """Место пользователя в таблице лидеров и его соседи."""
+
+    rank: int
+    points: int
+    total: int
+    # Список (место, user_id, очки) вокруг пользователя, включая его
+    neighbours: list
+
+
+class Board:
+    """
+    Таблица лидеров: пользователи по убыванию очков, при равных очках
+    по возрастанию id.
+
+    Очки хранятся со знаком минус, чтобы оба массива были отсортированы
+    по возрастанию и место пользователя находилось двоичным поиском.
+    Равные очки дают одинаковое место (1, 2, 2, 4).
+    """
+
+    def __init__(self, negated=None, user_ids=None):
+        self._negated = (
+            np.empty(0, dtype=np.int64) if negated is None else negated
+        )
+        self._user_ids = (
+            np.empty(0, dtype=np.int64) if user_ids is None else user_ids
+        )
+
+    @classmethod
+    def from_rows(cls, user_ids, points):
+        negated = -np.asarray(points, dtype=np.int64)
+        user_ids = np.asarray(user_ids, dtype=np.int64)
+        order = np.lexsort((user_ids, negated))
+        return cls(negated[order], user_ids[order])
+
+    def __len__(self):
+        return len(self._user_ids)
+
+    @property
+    def user_ids(self):
+        return self._user_ids
+
+    def rank(self, points):
+        """Место, которое занимает пользователь с points очками."""
+        return int(np.searchsorted(self._negated, -points, "left")) + 1
+
+    def _position(self, user_id, points):
+        """Индекс строки пользователя или места для её вставки."""
+        low = np.searchsorted(self._negated, -points, "left")
+        high = np.searchsorted(self._negated, -points, "right")
+        return int(low + np.searchsorted(self._user_ids[low:high], user_id))
+
+    def _find(self, user_id, points):
+        index = self._position(user_id, points)
+        if (
+            index < len(self)
+            and self._user_ids[index] == user_id
+            and self._negated[index] == -points
+        ):
+            return index
+        return None
+
+    def insert(self, user_id, points):
+        index = self._position(user_id, points)
+        self._negated = np.insert(self._negated, index, -points)
+        self._user_ids = np.insert(self._user_ids, index, user_id)
+
+    def remove(self, user_id, points):
+        index = self._find(user_id, points)
+        if index is not None:
+            self._negated = np.delete(self._negated, index)
+            self._user_ids = np.delete(self._user_ids, index)
+
+    def window(self, start, stop):
+        """Список (место, user_id, очки) для строк [start, stop)."""
+        start, stop = max(0, start), min(len(self), stop)
+        negated = self._negated[start:stop]
+        ranks = np.searchsorted(self._negated, negated, "left") + 1
+        return list(
+            zip(
+                ranks.tolist(),
+                self._user_ids[start:stop].tolist(),
+                (-negated).tolist(),
+            )
+        )
+
+    def standing(self, user_id, points, radius):
+        index = self._find(user_id, points)
+        if index is None:
+            return None
+        return Standing(
+            rank=self.rank(points),
+            points=points,
+            total=len(self),
+            neighbours=self.window(index - radius, index + radius + 1),
+        )
+
+
+class RankedBoard(NamedTuple):
+    """Таблица лидеров вместе с очками пользователей в ней."""
+
+    board: Board
+    points: dict
+
+    def __len__(self):
+        return len(self.board)
+
+    @property
+    def user_ids(self):
+        """id пользователей по местам в таблице."""
+        return self.board.user_ids
+
+    def window(self, start, stop):
+        """Список (место, user_id, очки) для мест с start + 1 по stop."""
+        return self.board.window(start, stop)
+
+    def standing(self, user_id, radius=0):
+        """
+        Место пользователя и radius соседей выше и ниже него
+        :return: Standing или None, если пользователя нет в таблице
+        """
+        points = self.points.get(user_id)
+        if points is None:
+            return None
+        return self.board.standing(user_id, points, radius)
+
+
+class Leaderboard:
+    """
+    Общая таблица лидеров и таблицы по должностям в памяти процесса.
+
+    Изменения очков применяются точечно по журналу ExperienceEvent:
+    перечитываются только пользователи с новыми начислениями. Смена
+    должности, новые и удалённые пользователи учитываются полной
+    пересборкой по истечении LEADERBOARD_TTL.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._built_at = 0.0
+        self._change_version = 0
+        self._points = {}
+        self._positions = {}
+        self._global = Board()
+        self._by_position = {}
+
+    def build(self):
+        """Перестраивает таблицы по всем пользователям."""
+        change_version = (
+            ExperienceEvent.objects.aggregate(last=Max("id"))["last"] or 0
+        )
+        rows = list(
+            User.objects.values_list(
+                "id", "experience_points", "position_id"
+            ).iterator(chunk_size=5000)
+        )
+        user_ids = np.array([row[0] for row in rows], dtype=np.int64)
+        points = np.array([row[1] for row in rows], dtype=np.int64)
+        position_ids = np.array(
+            [-1 if row[2] is None else row[2] for row in rows],
+            dtype=np.int64,
+        )
+
+        by_position = {}
+        for position_id in np.unique(position_ids[position_ids >= 0]):
+            mask = position_ids == position_id
+            by_position[int(position_id)] = Board.from_rows(
+                user_ids[mask], points[mask]
+            )
+
+        with self._lock:
+            self._points = dict(zip(user_ids.tolist(), points.tolist()))
+            self._positions = {
+                user_id: position_id for user_id, _, position_id in rows
+            }
+            self._global = Board.from_rows(user_ids, points)
+            self._by_position = by_position
+            self._change_version = change_version
+            self._built_at = time.monotonic()
+            self._loaded = True
+
+    def ensure_current(self):
+        """Строит таблицы при первом обращении и применяет начисления."""
+        if (
+            self._loaded
+            and time.monotonic() - self._built_at < settings.LEADERBOARD_TTL
+        ):
+            self.apply_changes()
+        else:
+            self.build()
+
+    def apply_changes(self):
+        """
+        Применяет начисления из журнала ExperienceEvent
+        :return: True, если таблицы изменились
+        """
+        last = ExperienceEvent.objects.aggregate(last=Max("id"))["last"] or 0
+        if last == self._change_version:
+            return False
+
+        with self._lock:
+            # Недавние записи перечитываются: запись с меньшим id могла
+            # закоммититься позже уже применённой.
+            recent = timezone.now() - timedelta(
+                seconds=LEADERBOARD_CHANGE_LAG_SECONDS
+            )
+            user_ids = set(
+                ExperienceEvent.objects.filter(
+                    Q(id__gt=self._change_version) | Q(created_at__gte=recent)
+                ).values_list("user_id", flat=True)
+            )
+            changed = False
+            for user_id, points, position_id in User.objects.filter(
+                pk__in=user_ids
+            ).values_list("id", "experience_points", "position_id"):
+                changed |= self._patch(user_id, points, position_id)
+            self._change_version = max(self._change_version, last)
+            return changed
+
+    def _patch(self, user_id, points, position_id):
+        old_points = self._points.get(user_id)
+        old_position_id = self._positions.get(user_id)
+        if old_points == points and old_position_id == position_id:
+            return False
+
+        if old_points is not None:
+            self._global.remove(user_id, old_points)
+            if old_position_id is not None:
+                self._by_position[old_position_id].remove(user_id, old_points)
+        self._global.insert(user_id, points)
+        if position_id is not None:
+            self._by_position.setdefault(position_id, Board()).insert(
+                user_id, points
+            )
+        self._points[user_id] = points
+        self._positions[user_id] = position_id
+        return True
+
+    def _board(self, position_id):
+        if position_id is None:
+            return self._global
+        return self._by_position.get(position_id, Board())
+
+    def ranked(self, position_id=None):
+        """
+        Рейтинг за всё время
+        :param position_id: должность, None - общая таблица
+        :return: RankedBoard
+        """
+        self.ensure_current()
+        with self._lock:
+            board = self._board(position_id)
+            if position_id is None:
+                return RankedBoard(board, self._points)
+            return RankedBoard(
+                board,
+                {
+                    user_id: self._points[user_id]
+                    for user_id in board.user_ids.tolist()
+                },
+            )
+
+
+leaderboard = Leaderboard()
+
+
+def refresh_daily_rollups(start, end):
+    """
+    Пересчитывает ExperienceDailyRollup за дни с start по end по журналу
+    начислений. Начальный баланс в дневные очки не входит.
+    """
+    events = ExperienceEvent.objects.filter(
+        created_at__date__gte=start, created_at__date__lte=end
+    ).exclude(source=ExperienceEvent.Source.OPENING_BALANCE)
+    rollups = [
+        ExperienceDailyRollup(user_id=user_id, date=date, points=points)
+        for user_id, date, points in events.annotate(
+            day=TruncDate("created_at", tzinfo=timezone.get_current_timezone())
+        )
+        .values("user_id", "day")
+        .annotate(total=Sum("points"))
+        .values_list("user_id", "day", "total")
+        .iterator()
+    ]
+    with transaction.atomic():
+        ExperienceDailyRollup.objects.filter(
+            date__gte=start, date__lte=end
+        ).delete()
+        ExperienceDailyRollup.objects.bulk_create(rollups, batch_size=1000)
+    return len(rollups)
+
+
+def period_start(period, today):
+    """Первый день периода "day", "week" или "month", включающего today."""
+    if period == "day":
+        return today
+    if period == "week":
+        return today - timedelta(days=today.weekday())
+    if period == "month":
+        return today.replace(day=1)
+    raise ValueError(f"Неизвестный период рейтинга: {period}")
+
+
+_period_boards = {}
+_period_boards_lock = threading.Lock()
+
+
+def period_board(period, position_id=None, shift_id=None):
+    """
+    Рейтинг по очкам за текущий день, неделю или месяц из дневных
+    свёрток. Построенная таблица хранится в процессе
+    LEADERBOARD_PERIOD_SECONDS.
+    :param position_id: только сотрудники должности
+    :param shift_id: только очки, набранные в дни дежурства в смене
+    :return: RankedBoard
+    """
+    today = timezone.localdate()
+    key = (period, position_id, shift_id, today)
+    with _period_boards_lock:
+        cached = _period_boards.get(key)
+    if cached and time.monotonic() - cached[0] < LEADERBOARD_PERIOD_SECONDS:
+        return cached[1]
+
+    rollups = ExperienceDailyRollup.objects.filter(
+        date__gte=period_start(period, today), date__lte=today
+    )
+    if position_id is not None:
+        rollups = rollups.filter(user__position_id=position_id)
+    if shift_id is not None:
+        rollups = rollups.filter(
+            user__duty_schedules__shift_id=shift_id,
+            user__duty_schedules__date=F("date"),
+        )
+    points = dict(
+        rollups.values("user_id")
+        .annotate(total=Sum("points"))
+        .values_list("user_id", "total")
+    )
+    ranked = RankedBoard(
+        Board.from_rows(list(points), list(points.values())), points
+    )
+    with _period_boards_lock:
+        # Таблицы прошлых дней больше не понадобятся
+        for stale in [item for item in _period_boards if item[3] != today]:
+            del _period_boards[stale]
+        _period_boards[key] = (time.monotonic(), ranked)
+    return ranked
@@ -0,0 +1,27 @@
+from django.core.cache import cache
+
+from api.utils.cache_versions import bump_version, current_version
+from backend.constants import QUESTION_POOLS_CACHE_SECONDS
+
+QUESTION_POOLS_VERSION_KEY = "question_pools_version"
+
+
+def cached_question_pool(test_id, build):
+    """
+    Сериализованные вопросы теста из кэша, при промахе строятся build.
+    По ним же проверяются ответы на неопубликованный тест.
+    :param build: функция, возвращающая список вопросов теста
+    :return: список словарей вопросов
+    """
+    version = current_version(QUESTION_POOLS_VERSION_KEY)
+    key = f"question_pool:{version}:{test_id}"
+    pool = cache.get(key)
+    if pool is None:
+        pool = build()
+        cache.set(key, pool, timeout=QUESTION_POOLS_CACHE_SECONDS)
+    return pool
+
+
+def invalidate_question_pools():
+    """Сбрасывает вопросы всех тестов после изменения тестов или вопросов."""
+    bump_version(QUESTION_POOLS_VERSION_KEY)
@@ -0,0 +1,44 @@
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Max
+
+from api.models import Tests, TestSnapshot
+from backend.constants import TEST_SNAPSHOTS_CACHE_SECONDS
+
+
+def publish_test(test, questions):
+    """
+    Публикует новую версию теста
+    :param questions: список вопросов в том виде, в котором их получит
+    клиент
+    :return: TestSnapshot
+    """
+    with transaction.atomic():
+        # Блокировка строки теста не даёт двум публикациям занять один номер
+        test = Tests.objects.select_for_update().get(pk=test.pk)
+        last = test.snapshots.aggregate(last=Max("version"))["last"] or 0
+        snapshot = TestSnapshot.objects.create(
+            test=test,
+            version=last + 1,
+            test_is_control=test.test_is_control,
+            passing_score=test.passing_score,
+            questions=questions,
+        )
+        test.published_snapshot = snapshot
+        test.save(update_fields=["published_snapshot"])
+    return snapshot
+
+
+def cached_snapshot(snapshot_id):
+    """
+    Версия теста из кэша или одним чтением строки. Версии не меняются
+    после публикации, поэтому кэш не нужно сбрасывать.
+    :return: TestSnapshot или None
+    """
+    key = f"test_snapshot:{snapshot_id}"
+    snapshot = cache.get(key)
+    if snapshot is None:
+        snapshot = TestSnapshot.objects.filter(pk=snapshot_id).first()
+        if snapshot is not None:
+            cache.set(key, snapshot, timeout=TEST_SNAPSHOTS_CACHE_SECONDS)
+    return snapshot
@@ -0,0 +1,45 @@
+from bisect import bisect_right
+from typing import NamedTuple
+
+from django.core.cache import cache
+
+from api.utils.cache_versions import bump_version, current_version
+from backend.constants import THRESHOLD_TABLES_CACHE_SECONDS
+
+THRESHOLD_TABLES_VERSION_KEY = "threshold_tables_version"
+
+
+class ThresholdTable(NamedTuple):
+    """Пороги званий или значков должности в порядке возрастания."""
+
+    thresholds: tuple
+    ids: tuple
+
+    def reached(self, points):
+        """id записей с порогом не больше points по возрастанию порога."""
+        return self.ids[: bisect_right(self.thresholds, points)]
+
+
+def cached_threshold_table(name, position_id, rows):
+    """
+    Таблица порогов из кэша, при промахе строится из rows
+    :param name: вид таблицы ("rank", "badge")
+    :param rows: функция, возвращающая пары (порог, id)
+    :return: ThresholdTable
+    """
+    version = current_version(THRESHOLD_TABLES_VERSION_KEY)
+    key = f"threshold_table:{version}:{name}:{position_id}"
+    table = cache.get(key)
+    if table is None:
+        pairs = sorted(rows())
+        table = ThresholdTable(
+            tuple(threshold for threshold, _ in pairs),
+            tuple(row_id for _, row_id in pairs),
+        )
+        cache.set(key, table, timeout=THRESHOLD_TABLES_CACHE_SECONDS)
+    return table
+
+
+def invalidate_threshold_tables():
+    """Сбрасывает все таблицы порогов после изменения званий или значков."""
+    bump_version(THRESHOLD_TABLES_VERSION_KEY)
@@ -0,0 +1,107 @@
+import base64
+import binascii
+import hashlib
+import os
+
+from django.core.cache import cache
+
+from backend.constants import (
+    SESSION_KEY_MAX_USES,
+    SESSION_KEY_MINUTES,
+    TRANSPORT_KEY_SECONDS,
+)
+
+SESSION_PREFIX = "face_session"
+
+
+class TransportKeyError(ValueError):
+    """Ключ передачи истёк, исчерпан или запрос повторён."""
+
+
+def _session_cache_key(key_id, *parts):
+    return ":".join((SESSION_PREFIX, key_id) + parts)
+
+
+def _nonce_digest(encrypted_data):
+    """
+    Отпечаток байтов iv дескриптора. Считается по декодированным
+    байтам: b64decode без проверки пропускает посторонние символы, и
+    один и тот же iv можно записать разными строками.
+    """
+    iv = encrypted_data.get("iv") if isinstance(encrypted_data, dict) else None
+    if not iv:
+        raise TransportKeyError("Не указан iv зашифрованного дескриптора")
+    try:
+        nonce = base64.b64decode(iv, validate=True)
+    except (TypeError, ValueError, binascii.Error):
+        raise TransportKeyError("Неверный iv зашифрованного дескриптора")
+    return hashlib.blake2b(nonce, digest_size=16).hexdigest()
+
+
+def issue_transport_key(session=False):
+    """
+    Создаёт ключ для шифрования дескриптора на устройстве
+    :param session: сессионный ключ киоска на SESSION_KEY_MAX_USES
+        операций в течение SESSION_KEY_MINUTES вместо разового
+    :return: (key_id, ключ, время жизни в секундах)
+    """
+    raw_key = os.urandom(32)
+    key_id = os.urandom(16).hex()
+    if not session:
+        cache.set(key_id, raw_key, timeout=TRANSPORT_KEY_SECONDS)
+        return key_id, raw_key, TRANSPORT_KEY_SECONDS
+
+    timeout = SESSION_KEY_MINUTES * 60
+    cache.set_many(
+        {
+            _session_cache_key(key_id): raw_key,
+            _session_cache_key(key_id, "uses"): 0,
+        },
+        timeout=timeout,
+    )
+    return key_id, raw_key, timeout
+
+
+def use_transport_key(key_id, encrypted_items):
+    """
+    Возвращает ключ для дешифрования дескрипторов запроса.
+
+    Использование сессионного ключа учитывается: каждый дескриптор
+    расходует одну операцию, а его iv (nonce AES-GCM) принимается
+    только один раз, поэтому перехваченный запрос нельзя повторить.
+    Счётчики и принятые iv хранятся в общем кэше (проверка api.E001),
+    поэтому повтор не проходит и через другой воркер. Разовые ключи
+    работают как раньше.
+    :param encrypted_items: зашифрованные дескрипторы запроса
+    :raises TransportKeyError: ключ недействителен
+    """
+    if not key_id:
+        raise TransportKeyError("Ключ шифрования истёк или не существует")
+
+    raw_key = cache.get(_session_cache_key(key_id))
+    if raw_key is None:
+        raw_key = cache.get(key_id)
+        if not raw_key:
+            raise TransportKeyError("Ключ шифрования истёк или не существует")
+        return raw_key
+
+    try:
+        uses = cache.incr(
+            _session_cache_key(key_id, "uses"), len(encrypted_items)
+        )
+    except ValueError:
+        raise TransportKeyError("Ключ шифрования истёк или не существует")
+    if uses > SESSION_KEY_MAX_USES:
+        raise TransportKeyError("Лимит операций ключа шифрования исчерпан")
+
+    for encrypted_data in encrypted_items:
+        nonce = _nonce_digest(encrypted_data)
+        if not cache.add(
+            _session_cache_key(key_id, "iv", nonce),
+            True,
+            timeout=SESSION_KEY_MINUTES * 60,
+        ):
+            raise TransportKeyError(
+                "Дескриптор уже был отправлен с этим ключом"
+            )
+    return raw_key
@@ -1,10 +1,6 @@
-import base64
 from datetime import datetime
-import json
-import os
+import time
 
-from Crypto.Cipher import AES
-from dotenv import load_dotenv
 from django.conf import settings
 from django.contrib.admin.views.decorators import staff_member_required
 from django.http import HttpResponse
@@ -14,75 +10,123 @@ from openpyxl.utils import get_column_letter
 from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
 
 from api.admin import dashboard_callback
-from api.models import User
+from api.models import FaceMatchAttempt
+from api.utils.face_index import (
+    FaceMatch,
+    FaceSearchResult,
+    face_index,
+    stored_templates,
+    user_entry,
+)
+from api.utils.face_telemetry import record_face_match, record_face_matches
+
+
+def identify_face(
+    input_descriptor, position_id=None, source=None, decrypt_seconds=0.0
+):
+    """
+    Идентификация 1:N - ищет ближайшего пользователя среди всех
+    :param input_descriptor: numpy array с дескриптором лица
+    :param position_id: должность, среди сотрудников которой искать
+        в первую очередь
+    :param source: FaceMatchAttempt.Source для записи телеметрии
+    :param decrypt_seconds: время дешифрования входного дескриптора
+    :return: FaceMatch с id пользователя и расстоянием или None
+    """
+    started = time.perf_counter()
+    result = face_index.search_detailed(
+        input_descriptor, position_id=position_id
+    )
+    if source:
+        record_face_match(
+            source, result, decrypt_seconds, time.perf_counter() - started
+        )
+    return result.match
+
+
+def identify_faces(input_descriptors, position_id=None, decrypt_seconds=0.0):
+    """
+    Идентификация 1:N для пачки дескрипторов одним матричным умножением
+    с записью телеметрии киоска
+    :param input_descriptors: numpy array формы (n, 128)
+    :param position_id: должность, среди сотрудников которой искать
+        в первую очередь
+    :param decrypt_seconds: время дешифрования всей пачки
+    :return: список FaceMatch или None для каждого дескриптора
+    """
+    started = time.perf_counter()
+    results = face_index.search_batch_detailed(
+        input_descriptors, position_id=position_id
+    )
+    record_face_matches(
+        FaceMatchAttempt.Source.KIOSK,
+        results,
+        decrypt_seconds,
+        time.perf_counter() - started,
+    )
+    return [result.match for result in results]
+
 
-load_dotenv()
+def verify_face(user, input_descriptor, decrypt_seconds=0.0):
+    """
+    Верификация 1:1 - сравнивает дескриптор только с дескрипторами user,
+    включая дополнительные шаблоны
+    :param user: пользователь, личность которого подтверждается
+    :param input_descriptor: numpy array с дескриптором лица
+    :param decrypt_seconds: время дешифрования входного дескриптора
+    :return: FaceMatch с id пользователя и расстоянием или None
+    """
+    stored_value = user.stored_face_descriptor
+    if not stored_value:
+        return None
+    started = time.perf_counter()
+    entry = user_entry(
+        user.id,
+        stored_value,
+        user.face_descriptor_key_id,
+        user.position_id,
+        stored_templates([user.id]).get(user.id, ()),
+    )
+    if entry is None:
+        return None
+    decrypted = time.perf_counter()
 
-AES_STORAGE_KEY = os.getenv("AES_STORAGE_KEY")
-AES_STORAGE_KEY = AES_STORAGE_KEY.encode()
+    templates = (
+        entry.centroid[None, :] if entry.templates is None else entry.templates
+    )
+    distance = float(
+        np.linalg.norm(templates - input_descriptor, axis=1).min()
+    )
+    match = (
+        FaceMatch(user.id, distance)
+        if distance < settings.FACE_MATCH_THRESHOLD
+        else None
+    )
+    record_face_match(
+        FaceMatchAttempt.Source.VERIFICATION,
+        FaceSearchResult(match, distance, None, 1),
+        decrypt_seconds + decrypted - started,
+        time.perf_counter() - decrypted,
+        user_id=user.id,
+    )
+    return match
 
 
-def is_face_already_registered(input_descriptor):
+def is_face_already_registered(input_descriptor, decrypt_seconds=0.0):
     """
     Проверяет, есть ли в системе пользователь с похожим дескриптором лица
     :param input_descriptor: numpy array с дескриптором лица
+    :param decrypt_seconds: время дешифрования входного дескриптора
     :return: True если найден похожий пользователь, иначе False
     """
-    for user in User.objects.exclude(face_descriptor__isnull=True):
-        try:
-            encrypted_data = json.loads(user.face_descriptor)
-            stored_descriptor = np.array(
-                decrypt_descriptor(
-                    encrypted_data,
-                    AES_STORAGE_KEY
-                ), dtype=np.float32
-            )
-
-            distance = np.linalg.norm(input_descriptor - stored_descriptor)
-            if distance < settings.FACE_MATCH_THRESHOLD:
-                return True
-        except Exception as e:
-            print(f"Ошибка обработки дескриптора лица пользователя "
-                  f"{user.id}: {str(e)}")
-            continue
-    return False
-
-
-def decrypt_descriptor(encrypted_data, key):
-    """Дешифрует дескриптор лица"""
-    try:
-        iv = base64.b64decode(encrypted_data['iv'])
-        ciphertext = base64.b64decode(encrypted_data['ciphertext'])
-        tag = base64.b64decode(encrypted_data['tag'])
-
-        cipher = AES.new(key, AES.MODE_GCM, nonce=iv)
-        decrypted = cipher.decrypt_and_verify(ciphertext, tag)
-        return json.loads(decrypted.decode('utf-8'))
-    except Exception as e:
-        raise ValueError(f"Ошибка дешифрования: {str(e)}")
-
-
-def encrypt_descriptor(descriptor, key):
-    """Шифрует дескриптор лица для хранения"""
-    try:
-        descriptor_json = json.dumps(
-            descriptor.tolist()
-            if isinstance(descriptor, np.ndarray)
-            else descriptor
-        )
-
-        cipher = AES.new(key, AES.MODE_GCM)
-        ciphertext, tag = cipher.encrypt_and_digest(
-            descriptor_json.encode('utf-8')
+    return (
+        identify_face(
+            input_descriptor,
+            source=FaceMatchAttempt.Source.REGISTRATION,
+            decrypt_seconds=decrypt_seconds,
         )
-
-        return {
-            'iv': base64.b64encode(cipher.nonce).decode('utf-8'),
-            'ciphertext': base64.b64encode(ciphertext).decode('utf-8'),
-            'tag': base64.b64encode(tag).decode('utf-8')
-        }
-    except Exception as e:
-        raise ValueError(f"Ошибка шифрования: {str(e)}")
+        is not None
+    )
 
 
 @staff_member_required
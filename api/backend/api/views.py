@@ -1,15 +1,11 @@
 import base64
-import json
-import os
+import time
 
-from django.conf import settings
 from django.contrib.auth import authenticate, login, logout
-from django.core.cache import cache
 from django.db import IntegrityError, models
 from django.db.models import Prefetch
 from django.utils import timezone
 from drf_spectacular.utils import extend_schema
-from dotenv import load_dotenv
 import numpy as np
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
@@ -26,6 +22,8 @@ from api.models import (
     Video,
     NormativeLegislation,
     InstructionResult,
+    FaceMatchAttempt,
+    KioskCheckIn,
     GameSwiper,
     FireSafetyQuiz,
     MedicineQuiz,
@@ -49,26 +47,31 @@ from api.serializers import (
     GameSwiperSerializer,
     GameSwiperResultSerializer,
     QuizResultSerializer,
-    MedicineQuizSerializer
+    MedicineQuizSerializer,
+    KioskFaceBatchSerializer,
+    FaceTemplateSerializer,
 )
-from api.permissions import IsAdminPermission
-from api.utils.utils import decrypt_descriptor
+from api.permissions import IsAdminPermission, IsManagementPermission
+from api.utils.crypto import decrypt_descriptor
+from api.utils.leaderboard import PERIODS, leaderboard, period_board
+from api.utils.transport_keys import (
+    TransportKeyError,
+    issue_transport_key,
+    use_transport_key,
+)
+from api.utils.utils import identify_face, identify_faces
 from backend.constants import (
     GAME_HOUR,
     GAME_MINUTE,
+    LEADERBOARD_MAX_RADIUS,
     LIMIT_GAME_SWIPER_QUESTIONS,
     MAX_LENGTH_FACE_DESCRIPTOR,
     ME,
-    POWER_OF_USER
+    POWER_OF_USER,
+    SESSION_KEY_MAX_USES,
 )
 
 
-load_dotenv()
-
-AES_STORAGE_KEY = os.getenv("AES_STORAGE_KEY")
-AES_STORAGE_KEY = AES_STORAGE_KEY.encode()
-
-
 @extend_schema(
     tags=["User"],
     description="Получение, создание, изменение и удаление пользователей.",
@@ -137,7 +140,15 @@ class UserViewSet(viewsets.ReadOnlyModelViewSet):
 
 @extend_schema(tags=["Rating"], description="Рейтинг пользователей.")
 class RatingViewSet(viewsets.ReadOnlyModelViewSet):
-    """Представление для получения рейтинга пользователей."""
+    """
+    Представление для получения рейтинга пользователей.
+
+    Порядок пользователей берётся из таблицы лидеров в памяти процесса,
+    из БД читается только текущая страница. Параметры:
+    position - id должности для рейтинга внутри должности,
+    period - day, week или month для рейтинга по очкам за период,
+    shift - id смены для рейтинга по очкам, набранным в её дежурства.
+    """
 
     serializer_class = RatingSerializer
     permission_classes = (IsAuthenticated,)
@@ -152,6 +163,91 @@ class RatingViewSet(viewsets.ReadOnlyModelViewSet):
             .order_by("-experience_points")
         )
 
+    def _id_param(self, name):
+        value = self.request.query_params.get(name)
+        if value is None:
+            return None
+        try:
+            return int(value)
+        except ValueError:
+            raise ValidationError({name: "Некорректный идентификатор"})
+
+    def _ranked(self, position_id):
+        """Таблица лидеров за всё время или за период из параметров."""
+        period = self.request.query_params.get("period")
+        shift_id = self._id_param("shift")
+        if period is None and shift_id is None:
+            return leaderboard.ranked(position_id)
+        if shift_id is not None and period is None:
+            period = "day"
+        if period not in PERIODS:
+            raise ValidationError(
+                {"period": f"Допустимые значения: {', '.join(PERIODS)}"}
+            )
+        return period_board(period, position_id, shift_id)
+
+    def _serialize_places(self, places):
+        """Сериализует пользователей из списка (место, user_id, очки)."""
+        users = self.get_queryset().in_bulk(
+            [user_id for _, user_id, _ in places]
+        )
+        data = []
+        for place, user_id, _ in places:
+            if user_id in users:
+                item = self.get_serializer(users[user_id]).data
+                item["place"] = place
+                data.append(item)
+        return data
+
+    def list(self, request, *args, **kwargs):
+        ranked = self._ranked(self._id_param("position"))
+        page = self.paginate_queryset(ranked.user_ids)
+        if page is None:
+            return Response(
+                self._serialize_places(ranked.window(0, len(ranked)))
+            )
+        start = self.paginator.offset
+        return self.get_paginated_response(
+            self._serialize_places(ranked.window(start, start + len(page)))
+        )
+
+    @action(detail=False, methods=["GET"], url_path="me", url_name="me")
+    def me(self, request):
+        """
+        Место текущего пользователя и соседи по рейтингу. Параметры:
+        scope=position - рейтинг внутри должности пользователя,
+        radius - сколько соседей показать выше и ниже,
+        period и shift - как у списка.
+        """
+        position_id = None
+        if request.query_params.get("scope") == "position":
+            position_id = request.user.position_id
+            if position_id is None:
+                return Response(
+                    {"error": "У пользователя не указана должность"},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+        try:
+            radius = int(request.query_params.get("radius", 2))
+        except ValueError:
+            raise ValidationError({"radius": "Ожидается целое число"})
+        radius = min(max(radius, 0), LEADERBOARD_MAX_RADIUS)
+
+        standing = self._ranked(position_id).standing(request.user.id, radius)
+        if standing is None:
+            return Response(
+                {"error": "Пользователь ещё не попал в рейтинг"},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+        return Response(
+            {
+                "place": standing.rank,
+                "total": standing.total,
+                "experience_points": standing.points,
+                "neighbours": self._serialize_places(standing.neighbours),
+            }
+        )
+
 
 @extend_schema(tags=["SignUp"], description="Регистрация пользователей.")
 class SignUpView(APIView):
@@ -272,22 +368,40 @@ class LoginView(APIView):
 
 @extend_schema(tags=["GenerateAESKey"], description="Получение ключа для шифрования дескриптора.")
 class GenerateAESKeyView(APIView):
-    """Ручка для генерации временного AES-ключа."""
+    """
+    Ручка для генерации временного AES-ключа.
+
+    С параметром session=true выдаётся сессионный ключ киоска на
+    SESSION_KEY_MAX_USES операций: каждый дескриптор шифруется
+    с новым iv, повторно отправленный iv отклоняется.
+    """
+
     permission_classes = (AllowAny,)
 
     def get(self, request):
-        raw_key = os.urandom(32)
-        key_id = os.urandom(16).hex()
-
-        cache.set(key_id, raw_key, timeout=300)
+        session = request.query_params.get("session", "").lower() == "true"
+        key_id, raw_key, expires_in = issue_transport_key(session=session)
 
         encoded_key = base64.b64encode(raw_key).decode('utf-8')
-        return Response({"key_id": key_id, "key": encoded_key})
+        response = {
+            "key_id": key_id,
+            "key": encoded_key,
+            "expires_in": expires_in,
+        }
+        if session:
+            response["max_uses"] = SESSION_KEY_MAX_USES
+        return Response(response)
 
 
 @extend_schema(tags=["LoginFace"], description="Аутентификация по лицу.")
 class FaceLoginView(APIView):
-    """Аутентификация по лицу"""
+    """
+    Аутентификация по лицу.
+
+    Необязательный параметр position (id должности киоска) сужает поиск
+    до сотрудников этой должности с переходом к общему поиску, если
+    совпадение не найдено.
+    """
 
     permission_classes = (AllowAny,)
 
@@ -301,16 +415,30 @@ class FaceLoginView(APIView):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        try:
-            encoded_key = cache.get(request.data.get("key_id"))
-            if not encoded_key:
+        position_id = request.data.get("position")
+        if position_id is not None:
+            try:
+                position_id = int(position_id)
+            except (TypeError, ValueError):
                 return Response(
-                    {"error": "Ключ истёк или не существует"},
+                    {"error": "Некорректный идентификатор должности"},
                     status=status.HTTP_400_BAD_REQUEST,
                 )
 
+        try:
+            encoded_key = use_transport_key(
+                request.data.get("key_id"), [encrypted_data]
+            )
+        except TransportKeyError as e:
+            return Response(
+                {"error": str(e)}, status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            started = time.perf_counter()
             decrypted_descriptor = decrypt_descriptor(encrypted_data, encoded_key)
             input_descriptor = np.array(decrypted_descriptor, dtype=np.float32)
+            decrypt_seconds = time.perf_counter() - started
 
             if len(input_descriptor) != MAX_LENGTH_FACE_DESCRIPTOR:
                 return Response(
@@ -324,32 +452,15 @@ class FaceLoginView(APIView):
             )
 
         # 3. Ищем ближайшего пользователя
-        best_match = None
-        min_distance = float("inf")
-
-        for user in User.objects.exclude(face_descriptor__isnull=True):
-            try:
-                # Дешифруем дескриптор из БД
-                stored_encrypted = json.loads(user.face_descriptor)
-                stored_descriptor = np.array(
-                    decrypt_descriptor(stored_encrypted, AES_STORAGE_KEY),
-                    dtype=np.float32,
-                )
-
-                if stored_descriptor.shape != (MAX_LENGTH_FACE_DESCRIPTOR,):
-                    continue
-
-                distance = np.linalg.norm(input_descriptor - stored_descriptor)
-
-                if distance < min_distance and distance < settings.FACE_MATCH_THRESHOLD:
-                    min_distance = distance
-                    best_match = user
-
-            except Exception as e:
-                print(
-                    f"Error processing user {user.id} face descriptor: {str(e)}"
-                )
-                continue
+        match = identify_face(
+            input_descriptor,
+            position_id=position_id,
+            source=FaceMatchAttempt.Source.LOGIN,
+            decrypt_seconds=decrypt_seconds,
+        )
+        best_match = (
+            User.objects.filter(pk=match.user_id).first() if match else None
+        )
 
         # 4. Проверяем результат
         if best_match:
@@ -376,6 +487,137 @@ class FaceLoginView(APIView):
             status=status.HTTP_401_UNAUTHORIZED,
         )
 
+
+@extend_schema(
+    tags=["FaceTemplate"],
+    description=(
+        "Добавление шаблона лица текущему пользователю после "
+        "подтверждения лица."
+    ),
+)
+class FaceTemplateView(APIView):
+    """
+    Добавление шаблона лица (в каске, при другом освещении) без
+    перезаписи основного дескриптора. Шаблон принимается только вместе
+    со свежим снимком, подтверждающим лицо владельца учётной записи.
+    """
+
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request):
+        """Количество сохранённых дескрипторов текущего пользователя."""
+        return Response(
+            {
+                "has_face_descriptor": bool(
+                    request.user.stored_face_descriptor
+                ),
+                "templates": request.user.face_templates.count(),
+            }
+        )
+
+    def post(self, request):
+        serializer = FaceTemplateSerializer(
+            data=request.data, context={"request": request}
+        )
+        serializer.is_valid(raise_exception=True)
+        template = serializer.save()
+        return Response(
+            {"status": "success", "template_id": template.id},
+            status=status.HTTP_201_CREATED,
+        )
+
+
+@extend_schema(
+    tags=["KioskFaceBatch"],
+    description="Пакетная идентификация сотрудников на киоске.",
+)
+class KioskFaceBatchView(APIView):
+    """
+    Пакетная идентификация сотрудников на киоске.
+
+    Все дескрипторы зашифрованы одним ключом key_id и сравниваются
+    с индексом лиц одним матричным умножением. Опознанные сотрудники
+    записываются в KioskCheckIn для подтверждения руководителем,
+    сессии для них не создаются.
+    """
+
+    permission_classes = (IsManagementPermission,)
+
+    def post(self, request):
+        serializer = KioskFaceBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        encrypted_descriptors = serializer.validated_data["face_descriptors"]
+
+        try:
+            encoded_key = use_transport_key(
+                serializer.validated_data["key_id"], encrypted_descriptors
+            )
+        except TransportKeyError as e:
+            return Response(
+                {"error": str(e)}, status=status.HTTP_400_BAD_REQUEST
+            )
+
+        results = [None] * len(encrypted_descriptors)
+        indexes, descriptors = [], []
+        started = time.perf_counter()
+        for index, encrypted_data in enumerate(encrypted_descriptors):
+            try:
+                descriptor = np.array(
+                    decrypt_descriptor(encrypted_data, encoded_key),
+                    dtype=np.float32,
+                )
+                if descriptor.shape != (MAX_LENGTH_FACE_DESCRIPTOR,):
+                    raise ValueError(
+                        "Дескриптор лица должен содержать 128 элементов"
+                    )
+            except ValueError as e:
+                results[index] = {"index": index, "error": str(e)}
+                continue
+            indexes.append(index)
+            descriptors.append(descriptor)
+        decrypt_seconds = time.perf_counter() - started
+
+        matches = (
+            identify_faces(
+                np.stack(descriptors),
+                position_id=serializer.validated_data.get("position"),
+                decrypt_seconds=decrypt_seconds,
+            )
+            if descriptors
+            else []
+        )
+        users = User.objects.in_bulk(
+            {match.user_id for match in matches if match}
+        )
+
+        check_ins = []
+        for index, match in zip(indexes, matches):
+            user = users.get(match.user_id) if match else None
+            if user is None:
+                results[index] = {
+                    "index": index,
+                    "error": "Лицо не распознано или пользователь не существует",
+                }
+                continue
+            check_ins.append(
+                KioskCheckIn(
+                    operator=request.user,
+                    employee=user,
+                    distance=match.distance,
+                )
+            )
+            results[index] = {
+                "index": index,
+                "user_id": user.id,
+                "first_name": user.first_name,
+                "last_name": user.last_name,
+                "distance": match.distance,
+            }
+        KioskCheckIn.objects.bulk_create(check_ins)
+
+        return Response({"results": results}, status=status.HTTP_200_OK)
+
+
 @extend_schema(tags=["Logout"], description="Выход из сестемы.")
 class LogoutView(APIView):
     """Представление для выхода из системы"""
@@ -424,7 +666,13 @@ class InstructionViewSet(viewsets.ReadOnlyModelViewSet):
 
 @extend_schema(tags=["Tests"], description="Получение тестов.")
 class TestViewSet(viewsets.ReadOnlyModelViewSet):
-    """Представление для получения тестов."""
+    """
+    Представление для получения тестов.
+
+    С параметром summary=true вместо истории попыток пользователя
+    возвращается сводка: число попыток, лучшая оценка, время последней
+    попытки и признак сдачи.
+    """
 
     serializer_class = TestSerializer
     permission_classes = (IsAuthenticated,)
@@ -435,23 +683,46 @@ class TestViewSet(viewsets.ReadOnlyModelViewSet):
             return TestListSerializer
         return TestSerializer
 
+    def _summary_requested(self):
+        return self.request.query_params.get("summary", "").lower() == "true"
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context["summary"] = self._summary_requested()
+        return context
+
     def get_queryset(self):
         user = self.request.user
-        test_results_prefetch = Prefetch(
-            "test_results",
-            queryset=TestResult.objects.all(),
-            to_attr="all_test_results",
-        )
-        return (Tests.objects.filter(
+        queryset = Tests.objects.filter(
             models.Q(position=user.position) | models.Q(position__isnull=True)
-        ).select_related(
-        "position"
-        ).prefetch_related(
-            "questions",
-            "questions__answers",
-            "questions__reference_link",
-            test_results_prefetch,
-        ))
+        ).select_related("position")
+
+        if self._summary_requested():
+            user_results = models.Q(test_results__user=user)
+            return queryset.annotate(
+                attempts_count=models.Count(
+                    "test_results", filter=user_results
+                ),
+                best_mark=models.Max(
+                    "test_results__mark", filter=user_results
+                ),
+                last_attempt_at=models.Max(
+                    "test_results__completion_time", filter=user_results
+                ),
+                has_passed=models.Exists(
+                    TestResult.objects.filter(
+                        test=models.OuterRef("pk"), user=user, is_passed=True
+                    )
+                ),
+            )
+
+        return queryset.prefetch_related(
+            Prefetch(
+                "test_results",
+                queryset=TestResult.objects.filter(user=user),
+                to_attr="user_test_results",
+            )
+        )
 
 
 @extend_schema(
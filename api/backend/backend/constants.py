@@ -11,6 +11,37 @@ MAX_LENGTH_EMAIL_ADDRESS = 254
 MAX_LENGTH_ROLE = 10
 MAX_LENGTH_PHONE = 12
 MAX_LENGTH_FACE_DESCRIPTOR = 128
+MAX_FACE_BATCH_SIZE = 50
+# Сколько дополнительных шаблонов лица хранить на пользователя
+MAX_FACE_TEMPLATES = 5
+# Журнал изменений индекса лиц: сколько хранить записи (должно быть
+# больше FACE_INDEX_TTL) и за какой период перечитывать их повторно
+# (транзакции коммитятся не по порядку id)
+FACE_INDEX_CHANGES_RETENTION_DAYS = 7
+FACE_INDEX_CHANGE_LAG_SECONDS = 60
+# Сколько последних попыток сравнения лиц хранить в телеметрии
+# и сколько дней хранить каждую попытку
+FACE_TELEMETRY_MAX_ROWS = 100000
+FACE_MATCH_ATTEMPTS_RETENTION_DAYS = 90
+# Сколько секунд хранить в кэше таблицы порогов званий и значков
+THRESHOLD_TABLES_CACHE_SECONDS = 600
+# Сколько секунд хранить в кэше сериализованные вопросы теста
+QUESTION_POOLS_CACHE_SECONDS = 3600
+# Сколько секунд хранить в кэше опубликованные версии тестов
+TEST_SNAPSHOTS_CACHE_SECONDS = 86400
+# Таблица лидеров: за какой период перечитывать начисления повторно
+# и сколько соседей показывать выше и ниже пользователя
+LEADERBOARD_CHANGE_LAG_SECONDS = 60
+LEADERBOARD_MAX_RADIUS = 10
+# Рейтинги за период: как часто сворачивать начисления по дням
+# (в минутах) и сколько секунд процесс хранит построенную таблицу
+EXPERIENCE_ROLLUP_MINUTES = 5
+LEADERBOARD_PERIOD_SECONDS = 60
+# Ключи шифрования дескрипторов при передаче: время жизни разового
+# ключа в секундах, сессионного ключа киоска в минутах и число операций
+TRANSPORT_KEY_SECONDS = 300
+SESSION_KEY_MINUTES = 60
+SESSION_KEY_MAX_USES = 1000
 MAX_LENGTH_PASSWORD = 128
 MAX_LENGTH_TELEGRAM_CHAT_ID = 200
 
@@ -38,6 +69,13 @@ EVENING_MINUTE = 45
 
 GAME_HOUR = 7
 GAME_MINUTE = 0
+
+FACE_SNAPSHOT_MINUTES = 5
+FACE_INDEX_CHANGES_PRUNE_HOUR = 3
+FACE_INDEX_CHANGES_PRUNE_MINUTE = 30
+FACE_MATCH_ATTEMPTS_PRUNE_HOUR = 4
+FACE_MATCH_ATTEMPTS_PRUNE_MINUTE = 0
+
 LIMIT_GAME_SWIPER_QUESTIONS = 60
 QUIZ_FACTOR = 200
 SWIPER_FACTOR = 4
@@ -15,6 +15,12 @@ from backend.constants import (
     EVENING_MINUTE,
     GAME_HOUR,
     GAME_MINUTE,
+    FACE_SNAPSHOT_MINUTES,
+    EXPERIENCE_ROLLUP_MINUTES,
+    FACE_INDEX_CHANGES_PRUNE_HOUR,
+    FACE_INDEX_CHANGES_PRUNE_MINUTE,
+    FACE_MATCH_ATTEMPTS_PRUNE_HOUR,
+    FACE_MATCH_ATTEMPTS_PRUNE_MINUTE,
 )
 
 load_dotenv()
@@ -33,6 +39,59 @@ ALLOWED_HOSTS = os.getenv(
 AUTH_USER_MODEL = "api.User"
 TEST_QUESTIONS_LIMIT = 10
 FACE_MATCH_THRESHOLD = 0.78
+# Максимальный возраст индекса лиц в памяти процесса (в секундах).
+# Изменения применяются по журналу FaceIndexChange, полная пересборка
+# по истечении TTL - страховка на случай пропущенных записей.
+FACE_INDEX_TTL = int(os.getenv("FACE_INDEX_TTL", 3600))
+# Максимальный возраст таблицы лидеров в памяти процесса (в секундах).
+# Начисления применяются по журналу ExperienceEvent, смена должностей
+# и новые пользователи - при полной пересборке.
+LEADERBOARD_TTL = int(os.getenv("LEADERBOARD_TTL", 300))
+# Каталог общего для воркеров снапшота индекса лиц, только tmpfs
+# (например, /dev/shm/instruction_faces). Пустое значение - каждый
+# воркер строит индекс сам.
+FACE_INDEX_SNAPSHOT_DIR = os.getenv("FACE_INDEX_SNAPSHOT_DIR")
+# Запись телеметрии попыток сравнения лиц (модель FaceMatchAttempt)
+FACE_TELEMETRY_ENABLED = (
+    os.getenv("FACE_TELEMETRY_ENABLED", "true").lower() == "true"
+)
+# Ключи шифрования дескрипторов лиц при хранении. Каждый дескриптор
+# хранит идентификатор своего ключа; на время ротации прежние ключи
+# перечисляются в AES_STORAGE_PREVIOUS_KEYS в виде "id:ключ,id:ключ".
+# Дескрипторы без идентификатора зашифрованы ключом с id "default".
+AES_STORAGE_KEY_ID = os.getenv("AES_STORAGE_KEY_ID", "default")
+AES_STORAGE_KEYS = {
+    key_id: key.encode()
+    for key_id, key in (
+        item.split(":", 1)
+        for item in os.getenv("AES_STORAGE_PREVIOUS_KEYS", "").split(",")
+        if item
+    )
+}
+AES_STORAGE_KEYS[AES_STORAGE_KEY_ID] = os.getenv(
+    "AES_STORAGE_KEY", ""
+).encode()
+# Общий для всех процессов кэш. В нём хранятся ключи передачи
+# дескрипторов, счётчик изменений индекса лиц и версии закэшированных
+# таблиц, поэтому кэш в памяти процесса не подходит (проверка api.E001).
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": os.getenv("CACHE_URL", "redis://localhost:6379/1"),
+    }
+}
+# Бэкенд отбора кандидатов для индекса лиц:
+# api.utils.face_search.BruteForceBackend - точный перебор (эталон),
+# api.utils.face_search.IVFBackend - кластерный индекс, полнота и задержка
+# регулируются n_probe (число просматриваемых кластеров) и top_k,
+# api.utils.face_search.QuantizedBackend - грубый проход по float16/int8
+# копии матрицы (OPTIONS: {"dtype": "int8"}) с точным переранжированием.
+FACE_SEARCH_BACKEND = {
+    "BACKEND": os.getenv(
+        "FACE_SEARCH_BACKEND", "api.utils.face_search.BruteForceBackend"
+    ),
+    "OPTIONS": {},
+}
 
 
 INSTALLED_APPS = [
@@ -176,6 +235,30 @@ CELERY_BEAT_SCHEDULE = {
             nowfun=lambda: datetime.now(pytz.timezone("Europe/Moscow")),
         ),
     },
+    "rollup-experience-points": {
+        "task": "api.tasks.rollup_experience_points",
+        "schedule": crontab(minute=f"*/{EXPERIENCE_ROLLUP_MINUTES}"),
+    },
+    "build-face-snapshot": {
+        "task": "api.tasks.build_face_snapshot",
+        "schedule": crontab(minute=f"*/{FACE_SNAPSHOT_MINUTES}"),
+    },
+    "prune-face-match-attempts": {
+        "task": "api.tasks.prune_face_match_attempts",
+        "schedule": crontab(
+            hour=FACE_MATCH_ATTEMPTS_PRUNE_HOUR,
+            minute=FACE_MATCH_ATTEMPTS_PRUNE_MINUTE,
+            nowfun=lambda: datetime.now(pytz.timezone("Europe/Moscow")),
+        ),
+    },
+    "prune-face-index-changes": {
+        "task": "api.tasks.prune_face_index_changes",
+        "schedule": crontab(
+            hour=FACE_INDEX_CHANGES_PRUNE_HOUR,
+            minute=FACE_INDEX_CHANGES_PRUNE_MINUTE,
+            nowfun=lambda: datetime.now(pytz.timezone("Europe/Moscow")),
+        ),
+    },
 }
 
 LOGIN_URL = "two_factor:login"
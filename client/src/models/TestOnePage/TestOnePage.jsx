@@ -392,6 +392,7 @@ function TestOnePage() {
       },
       serverResults: {
         test: id,
+        questions_token: test?.questions_token,
         is_passed: isPassed,
         mark,
         score,